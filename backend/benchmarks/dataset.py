@@ -0,0 +1,133 @@
+import random
+from datetime import datetime, timedelta
+
+from sqlalchemy import Connection, Engine, insert
+from sqlmodel import col, select
+
+from models import ChatMessage, GameSession, JournalEntry, StateChangeLog
+from services.tokens import estimate_tokens
+
+ENTRY_TYPES = ("quest", "lore", "character")
+WORDS = (
+    "tavern", "ale", "bard", "sword", "dragon", "ember", "road", "king", "shadow", "forest", "coin", "map",
+    "guard", "gate", "moon", "river", "tower", "witch", "oath", "ruin", "merchant", "storm", "crown", "wolf",
+    "the", "a", "of", "and", "to", "in", "you", "see", "walk", "ask", "draw", "whisper", "old", "dark", "north",
+)
+# Messages inserted per statement
+BATCH_SIZE = 5000
+
+
+def _sentence(rng: random.Random, words: int) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(words)).capitalize() + "."
+
+
+def _text(rng: random.Random, min_words: int, max_words: int) -> str:
+    words = rng.randint(min_words, max_words)
+    return " ".join(_sentence(rng, 12) for _ in range(max(words // 12, 1)))
+
+
+def _insert_session(conn: Connection, **values) -> int:
+    """Inserts a game session, returning its id."""
+    primary_key = conn.execute(insert(GameSession).values(**values)).inserted_primary_key
+    assert primary_key is not None
+    return primary_key[0]
+
+
+def _insert_messages(conn, rng: random.Random, session_id: int, count: int, start: datetime):
+    for offset in range(0, count, BATCH_SIZE):
+        rows = []
+        for i in range(offset, min(offset + BATCH_SIZE, count)):
+            role = "user" if i % 2 == 0 else "assistant"
+            content = _text(rng, 5, 20) if role == "user" else _text(rng, 40, 120)
+            rows.append({
+                "session_id": session_id,
+                "role": role,
+                "content": content,
+                "token_count": estimate_tokens(content),
+                "timestamp": start + timedelta(seconds=i),
+            })
+        conn.execute(insert(ChatMessage), rows)
+
+
+def populate(
+    engine: Engine,
+    messages: int,
+    entries: int,
+    change_logs: int,
+    filler_sessions: int = 3,
+    filler_messages: int = 1000,
+    seed: int = 0
+) -> int:
+    """
+    Fills an empty database with a synthetic campaign: one session with `messages` chat
+    messages (all but the last turn summarized), `entries` journal entries and `change_logs`
+    change logs spread over its latest AI messages, plus smaller filler sessions so that
+    queries have to filter by session. Returns the id of the large session.
+    """
+    rng = random.Random(seed)
+    start = datetime.utcnow() - timedelta(seconds=messages + 3600)
+    with engine.begin() as conn:
+        session_id = _insert_session(
+            conn,
+            name="Benchmark campaign",
+            start_prompt="You wake up in a tavern.",
+            summary=_text(rng, 200, 300),
+            created_at=start,
+        )
+        _insert_messages(conn, rng, session_id, messages, start)
+        for n in range(filler_sessions):
+            filler_id = _insert_session(conn, name=f"Filler {n}", start_prompt="-", created_at=start)
+            _insert_messages(conn, rng, filler_id, filler_messages, start)
+
+        # Keep a short unsummarized tail, as a live campaign would have
+        last_ids = conn.execute(
+            select(ChatMessage.id)
+            .where(ChatMessage.session_id == session_id)
+            .order_by(col(ChatMessage.id).desc())
+            .limit(4)
+        ).scalars().all()
+        conn.execute(
+            GameSession.__table__.update()  # type: ignore[attr-defined]
+            .where(GameSession.id == session_id)
+            .values(summarized_up_to_id=last_ids[-1] - 1)
+        )
+
+        entry_rows = [
+            {
+                "session_id": session_id,
+                "title": f"{rng.choice(WORDS).capitalize()} {rng.choice(WORDS)} {i}",
+                "content": _text(rng, 20, 60),
+                "entry_type": ENTRY_TYPES[i % len(ENTRY_TYPES)],
+                "created_at": start,
+            }
+            for i in range(entries)
+        ]
+        conn.execute(insert(JournalEntry), entry_rows)
+        entry_ids = conn.execute(
+            select(JournalEntry.id).where(JournalEntry.session_id == session_id)
+        ).scalars().all()
+
+        ai_ids = conn.execute(
+            select(ChatMessage.id)
+            .where(ChatMessage.session_id == session_id)
+            .where(ChatMessage.role == "assistant")
+            .order_by(col(ChatMessage.id).desc())
+            .limit(max(change_logs // 3, 1))
+        ).scalars().all()
+        log_rows = []
+        for i in range(change_logs):
+            entry = entry_rows[rng.randrange(len(entry_rows))] if entry_rows else None
+            log_rows.append({
+                "session_id": session_id,
+                "message_id": ai_ids[i % len(ai_ids)],
+                "entity_type": "journal_entry",
+                "entity_id": entry_ids[rng.randrange(len(entry_ids))] if entry_ids else 0,
+                "operation": "update",
+                "previous_state": {
+                    "title": entry["title"], "content": entry["content"], "entry_type": entry["entry_type"]
+                } if entry else None,
+                "created_at": start,
+            })
+        if log_rows:
+            conn.execute(insert(StateChangeLog), log_rows)
+    return session_id
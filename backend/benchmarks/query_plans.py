@@ -0,0 +1,33 @@
+"""
+Fails (exit status 1) if a hot query's SQLite plan doesn't use its index or scans a table.
+
+    python -m benchmarks.query_plans
+
+Checks the HOT_QUERIES of database.py against an empty database with the current schema,
+the same check the app logs at startup, for use as a CI gate.
+"""
+import logging
+import os
+import sys
+import tempfile
+
+
+def main() -> int:
+    with tempfile.TemporaryDirectory(prefix="tavern-plans-") as db_dir:
+        # Settings are read on import, so the app modules are imported only after this
+        os.environ["DATABASE_FILE"] = os.path.join(db_dir, "plans.db")
+        from database import HOT_QUERIES, SQLModel, engine, migrate, query_plan_problems
+
+        logging.disable(logging.INFO)
+        SQLModel.metadata.create_all(engine)
+        migrate()
+        problems = query_plan_problems()
+        engine.dispose()
+    for problem in problems:
+        print(problem)
+    print(f"{len(HOT_QUERIES) - len(problems)}/{len(HOT_QUERIES)} hot queries use their index")
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
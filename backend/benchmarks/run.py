@@ -0,0 +1,345 @@
+"""
+Micro-benchmarks of the per-turn DB and context hot paths on a synthetic campaign.
+
+    python -m benchmarks.run                          # 10k messages, compared with its baseline
+    python -m benchmarks.run --messages 200000 --save # record the baseline for 200k messages
+
+Runs against a throwaway SQLite file with the LLM stubbed out. Each benchmark reports its
+median and best wall time and the number of SQL statements it issued. The run fails (exit
+status 1) if a benchmark issues more statements than its baseline, which catches query
+shape and ORM loading regressions regardless of the machine, or gets slower than the
+baseline by more than --tolerance.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from collections.abc import Awaitable, Callable
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any
+
+BASELINE_DIR = Path(__file__).parent / "baselines"
+
+
+@dataclass
+class Benchmark:
+    name: str
+    run: Callable[[], Awaitable[Any]]
+    # Untimed preparation before every iteration, e.g. recreating what the last one deleted
+    setup: Callable[[], Awaitable[Any]] | None = None
+
+
+class StatementCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, *args):
+        self.count += 1
+
+
+def _parse_args(argv: list[str] | None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=10_000, help="chat messages in the benchmarked session")
+    parser.add_argument("--entries", type=int, default=300, help="journal entries in the session")
+    parser.add_argument("--change-logs", type=int, default=600, help="state change logs in the session")
+    parser.add_argument("--repeat", type=int, default=20, help="timed iterations per benchmark")
+    parser.add_argument("--tolerance", type=float, default=0.5, help="allowed slowdown of the median (0.5 = 50%%)")
+    parser.add_argument("--baseline", type=Path, help="baseline file (default: baselines/messages-<N>.json)")
+    parser.add_argument("--save", action="store_true", help="write the results as the new baseline")
+    return parser.parse_args(argv)
+
+
+def main(argv: list[str] | None = None) -> int:
+    args = _parse_args(argv)
+    db_dir = tempfile.TemporaryDirectory(prefix="tavern-bench-")
+    # Settings are read on import, so the app modules are imported only after this
+    os.environ["DATABASE_FILE"] = os.path.join(db_dir.name, "bench.db")
+    try:
+        results = asyncio.run(_run(args))
+    finally:
+        db_dir.cleanup()
+
+    baseline_path = args.baseline or BASELINE_DIR / f"messages-{args.messages}.json"
+    report = {
+        "config": {
+            "messages": args.messages,
+            "entries": args.entries,
+            "change_logs": args.change_logs,
+            "repeat": args.repeat,
+        },
+        "environment": {"python": platform.python_version(), "sqlite": sqlite3.sqlite_version},
+        "results": results,
+    }
+    baseline = json.loads(baseline_path.read_text()) if baseline_path.exists() else None
+    if baseline is not None and baseline["config"] != report["config"]:
+        print(f"Baseline {baseline_path} was recorded with {baseline['config']}, not comparing")
+        baseline = None
+    regressions = _print_report(results, baseline["results"] if baseline else None, args.tolerance)
+
+    if args.save:
+        baseline_path.parent.mkdir(parents=True, exist_ok=True)
+        baseline_path.write_text(json.dumps(report, indent=2) + "\n")
+        print(f"Saved baseline to {baseline_path}")
+        return 0
+    return 1 if regressions else 0
+
+
+def _print_report(
+    results: dict[str, dict[str, Any]], baseline: dict[str, dict[str, Any]] | None, tolerance: float
+) -> list[str]:
+    """Prints the results next to the baseline; returns the names of regressed benchmarks."""
+    regressions = []
+    print(f"{'benchmark':<34} {'median ms':>10} {'min ms':>9} {'queries':>8} {'baseline ms':>12} {'change':>8}")
+    for name, result in results.items():
+        line = f"{name:<34} {result['median_ms']:>10.2f} {result['min_ms']:>9.2f} {result['queries']:>8}"
+        before = (baseline or {}).get(name)
+        if before is not None:
+            change = result["median_ms"] / before["median_ms"] - 1 if before["median_ms"] else 0.0
+            line += f" {before['median_ms']:>12.2f} {change:>+8.0%}"
+            problems = []
+            if result["queries"] > before["queries"]:
+                problems.append(f"queries {before['queries']} -> {result['queries']}")
+            if change > tolerance:
+                problems.append("slower")
+            if problems:
+                line += "  REGRESSION: " + ", ".join(problems)
+                regressions.append(name)
+        print(line)
+    return regressions
+
+
+async def _run(args: argparse.Namespace) -> dict[str, dict[str, Any]]:
+    import httpx
+    from sqlalchemy import event, update
+    from sqlmodel import select
+
+    from benchmarks.dataset import populate
+    from config import settings
+    from database import async_engine, create_db_and_tables, engine, new_session
+    from main import app
+    from models import ChatMessage, GameSession, JournalEntry, StateChangeLog
+    from services.context_builder import ContextBuilder
+    from services.game_engine import GameEngine
+    from services.journal_manager import JournalManager
+    from services.llm import ollama_service
+    from services.world_state import world_state_cache
+
+    logging.disable(logging.INFO)
+    create_db_and_tables()
+    started = time.perf_counter()
+    session_id = populate(engine, args.messages, args.entries, args.change_logs)
+    print(f"Generated {args.messages} messages in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+
+    async with new_session() as db:
+        known = (await db.exec(
+            select(JournalEntry)
+            .where(JournalEntry.session_id == session_id)
+            .where(JournalEntry.entry_type == "character")
+            .limit(3)
+        )).all()
+    created = 0
+
+    async def fake_extraction(user_input: str, ai_response_text: str, serialized_state: Any, language: str = "en"):
+        nonlocal created
+        created += 1
+        # Updates to a few existing characters plus one new quest, like a typical turn
+        return {
+            "quests": [{"operation": "add", "name": f"Benchmark quest {created}", "description": "Find the map."}],
+            "lore": [],
+            "characters": [
+                {"operation": "update", "name": entry.title, "description": entry.content + " Seen again."}
+                for entry in known
+            ],
+        }
+
+    async def fake_summary(text: str, previous_summary: str | None = None, language: str = "en") -> str:
+        return (previous_summary or "")[:2000]
+
+    ollama_service.aextract_journal_updates = fake_extraction  # type: ignore[method-assign]
+    ollama_service.asummarize_context = fake_summary  # type: ignore[method-assign]
+
+    action = "I ask the bard about the dragon on the ember road"
+
+    async def build_context():
+        async with new_session() as db:
+            session = await db.get(GameSession, session_id)
+            await ContextBuilder(db).build_context(session, player_action=action)  # type: ignore[arg-type]
+
+    async def invalidate_world_state():
+        world_state_cache.invalidate(session_id)
+
+    async def update_world_state():
+        async with new_session() as db:
+            session = await db.get(GameSession, session_id)
+            ai_msg = (await db.exec(
+                select(ChatMessage)
+                .where(ChatMessage.session_id == session_id)
+                .where(ChatMessage.role == "assistant")
+                .order_by(ChatMessage.id.desc())  # type: ignore[union-attr]
+                .limit(1)
+            )).one()
+            await JournalManager(db).update_world_state(
+                session, action, "The bard tells you of the dragon.", ai_msg  # type: ignore[arg-type]
+            )
+
+    async def rewind_summary_watermark():
+        # Leave exactly one summarization's worth of messages past the watermark
+        async with new_session() as db:
+            ids = (await db.exec(
+                select(ChatMessage.id)
+                .where(ChatMessage.session_id == session_id)
+                .order_by(ChatMessage.id.desc())  # type: ignore[union-attr]
+                .limit(settings.SUMMARY_THRESHOLD + 1)
+            )).all()
+            await db.exec(
+                update(GameSession).where(GameSession.id == session_id).values(summarized_up_to_id=ids[-1])
+            )  # type: ignore[call-overload]
+            await db.commit()
+
+    async def check_summarization():
+        async with new_session() as db:
+            session = await db.get(GameSession, session_id)
+            await GameEngine(db)._check_summarization(session)  # type: ignore[arg-type]
+
+    async def play_turn():
+        # A turn to undo: user and AI message, with journal changes logged against the reply
+        async with new_session() as db:
+            user_msg = ChatMessage(session_id=session_id, role="user", content=action)
+            ai_msg = ChatMessage(session_id=session_id, role="assistant", content="The bard shrugs.")
+            db.add(user_msg)
+            db.add(ai_msg)
+            await db.commit()
+            entries = (await db.exec(
+                select(JournalEntry).where(JournalEntry.session_id == session_id).limit(5)
+            )).all()
+            for entry in entries:
+                db.add(StateChangeLog(
+                    session_id=session_id,
+                    message_id=ai_msg.id,  # type: ignore[arg-type]
+                    entity_type="journal_entry",
+                    entity_id=entry.id,  # type: ignore[arg-type]
+                    operation="update",
+                    previous_state={"title": entry.title, "content": entry.content, "entry_type": entry.entry_type},
+                ))
+            await db.commit()
+
+    async def play_turns():
+        for _ in range(10):
+            await play_turn()
+
+    async def undo_move():
+        async with new_session() as db:
+            await GameEngine(db).undo_moves(session_id)
+
+    async def undo_ten_moves():
+        async with new_session() as db:
+            await GameEngine(db).undo_moves(session_id, 10)
+
+    async def fork_session():
+        async with new_session() as db:
+            await GameEngine(db).fork_session(session_id, fork_point)
+
+    # A fork of the campaign halfway through, to read history through the ancestry
+    async with new_session() as db:
+        fork_point = (await db.exec(
+            select(ChatMessage.id)
+            .where(ChatMessage.session_id == session_id)
+            .order_by(ChatMessage.id)  # type: ignore[arg-type]
+            .offset(args.messages // 2)
+            .limit(1)
+        )).one()
+        fork_id = (await GameEngine(db).fork_session(session_id, fork_point)).id
+        db.add_all([
+            ChatMessage(session_id=fork_id, role=role, content="The road forks here.")  # type: ignore[arg-type]
+            for role in ("user", "assistant") * 5
+        ])
+        await db.commit()
+
+    client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench")
+
+    def get(path: str) -> Callable[[], Awaitable[Any]]:
+        async def request():
+            response = await client.get(path)
+            response.raise_for_status()
+        return request
+
+    journal_etag = ""
+
+    async def fetch_journal_etag():
+        nonlocal journal_etag
+        journal_etag = (await client.get(f"/sessions/{session_id}/journal")).headers["ETag"]
+
+    async def get_journal_not_modified():
+        response = await client.get(f"/sessions/{session_id}/journal", headers={"If-None-Match": journal_etag})
+        assert response.status_code == 304, response.status_code
+
+    # Cursor of a page as deep as the deep offset one
+    async with new_session() as db:
+        deep_cursor = (await db.exec(
+            select(ChatMessage.id)
+            .where(ChatMessage.session_id == session_id)
+            .order_by(ChatMessage.id.desc())  # type: ignore[union-attr]
+            .offset(args.messages // 2)
+            .limit(1)
+        )).one()
+
+    benchmarks = [
+        Benchmark("build_context (cold cache)", build_context, setup=invalidate_world_state),
+        Benchmark("build_context (warm cache)", build_context),
+        Benchmark("update_world_state", update_world_state),
+        Benchmark("_check_summarization", check_summarization, setup=rewind_summary_watermark),
+        Benchmark("undo_moves", undo_move, setup=play_turn),
+        Benchmark("undo_moves (10 turns)", undo_ten_moves, setup=play_turns),
+        Benchmark("GET /history", get(f"/sessions/{session_id}/history?limit=20")),
+        Benchmark(
+            "GET /history (deep offset)", get(f"/sessions/{session_id}/history?limit=20&offset={args.messages // 2}")
+        ),
+        Benchmark(
+            "GET /history (deep cursor)", get(f"/sessions/{session_id}/history?limit=20&before_id={deep_cursor}")
+        ),
+        Benchmark("GET /journal", get(f"/sessions/{session_id}/journal")),
+        Benchmark("GET /journal (not modified)", get_journal_not_modified, setup=fetch_journal_etag),
+        Benchmark("fork_session", fork_session),
+        Benchmark("GET /history (fork)", get(f"/sessions/{fork_id}/history?limit=20")),
+    ]
+
+    counter = StatementCounter()
+    event.listen(async_engine.sync_engine, "before_cursor_execute", counter)
+    results = {}
+    try:
+        for benchmark in benchmarks:
+            times = []
+            queries = 0
+            # The first iteration warms up caches and connections and isn't counted
+            for _ in range(args.repeat + 1):
+                if benchmark.setup is not None:
+                    await benchmark.setup()
+                counter.count = 0
+                started = time.perf_counter()
+                await benchmark.run()
+                times.append(time.perf_counter() - started)
+                queries = counter.count
+            times = times[1:]
+            results[benchmark.name] = {
+                "median_ms": round(statistics.median(times) * 1000, 3),
+                "min_ms": round(min(times) * 1000, 3),
+                "queries": queries,
+            }
+    finally:
+        event.remove(async_engine.sync_engine, "before_cursor_execute", counter)
+        await client.aclose()
+        await ollama_service.aclose()
+        await async_engine.dispose()
+    return results
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,24 +1,88 @@
-from pydantic import field_validator
-from pydantic_settings import BaseSettings
+import json
+from typing import Annotated
+
+from pydantic import BaseModel, field_validator
+from pydantic_settings import BaseSettings, NoDecode
+
+
+class TaskOptions(BaseModel):
+    """Per-task LLM overrides; unset fields fall back to the global settings."""
+    model: str | None = None
+    num_ctx: int | None = None
+    num_predict: int | None = None
+    temperature: float | None = None
+    keep_alive: str | None = None
 
 
 class Settings(BaseSettings):
     OLLAMA_BASE_URL: str = "http://localhost:11434"
     OLLAMA_MODEL: str = "llama3"
+    # Several Ollama hosts (comma-separated) to spread load across; OLLAMA_BASE_URL is used if empty
+    OLLAMA_BASE_URLS: Annotated[list[str], NoDecode] = []
+    OLLAMA_AFFINITY_SLACK: int = 2 # extra in-flight requests tolerated to keep a session on its warm host
+    OLLAMA_HEALTH_CHECK_INTERVAL: float = 10.0
+    OLLAMA_EJECT_AFTER_FAILURES: int = 3 # consecutive failed requests before a host is taken out of rotation
+    # HTTP client pool for Ollama (seconds / counts)
+    OLLAMA_CONNECT_TIMEOUT: float = 5.0
+    OLLAMA_READ_TIMEOUT: float = 120.0
+    OLLAMA_TOTAL_TIMEOUT: float = 300.0
+    OLLAMA_POOL_TIMEOUT: float = 10.0 # waiting for a free pooled connection
+    OLLAMA_MAX_CONNECTIONS: int = 20
+    OLLAMA_MAX_KEEPALIVE_CONNECTIONS: int = 10
+    OLLAMA_MAX_CONCURRENT_REQUESTS: int = 4 # per backend; further calls queue by priority
+    LLM_MAX_QUEUE_DEPTH: int = 8 # waiting player turns per backend before new ones get a 429
+    # Use /api/chat with a stable system + history prefix so Ollama can reuse its KV cache
+    OLLAMA_CHAT_MODE: bool = False
+    OLLAMA_KEEP_ALIVE: str = "30m" # how long Ollama keeps the model loaded after a request
     LOG_LEVEL: str = "INFO"
     DATABASE_FILE: str = "../database/database.db"
+    # SQLite connection profile, applied to every pooled connection
+    SQLITE_JOURNAL_MODE: str = "WAL"
+    SQLITE_SYNCHRONOUS: str = "NORMAL"
+    SQLITE_BUSY_TIMEOUT_MS: int = 5000
+    SQLITE_MMAP_SIZE: int = 256 * 1024 * 1024
+    SQLITE_CACHE_SIZE: int = -64000 # negative = KiB, i.e. ~64 MB per connection
+    SQLITE_TEMP_STORE: str = "MEMORY"
+    SQLITE_POOL_SIZE: int = 5
+    SQLITE_MAX_OVERFLOW: int = 10
+    SQLITE_POOL_TIMEOUT: float = 30.0
+    # Queue writers on an in-process lock instead of contending for SQLite's write lock
+    SQLITE_SERIALIZE_WRITES: bool = True
     SUMMARY_THRESHOLD: int = 10
+    # Non-streaming turns get the narration and the journal delta from one structured generation
+    SINGLE_CALL_TURNS: bool = False
+    BACKGROUND_WORKERS: int = 4
+    TURN_TIMEOUT: float = 180.0 # seconds a turn may take, LLM queueing included, unless the request sets one
+    IDEMPOTENCY_CACHE_SIZE: int = 1024 # idempotency keys of finished turns remembered for retries
+    WORLD_STATE_CACHE_SIZE: int = 256 # sessions kept in the rendered world-state LRU
+    # Undo/redo: journal snapshot every N turns, which deep undos restore from instead of replaying change logs
+    JOURNAL_CHECKPOINT_INTERVAL: int = 20
+    REDO_STACK_SIZE: int = 10 # undo operations kept per session for redo
+    REDO_MAX_TURNS: int = 20 # undos of more turns can't be redone (they skip loading the undone change logs)
+    # Prompt packing: context window (num_ctx) per model name, with a default for unlisted models
+    DEFAULT_CONTEXT_WINDOW: int = 8192
+    MODEL_CONTEXT_WINDOWS: dict[str, int] = {}
+    RESPONSE_TOKEN_RESERVE: int = 1024 # tokens left free for the reply
+    WORLD_STATE_TOKEN_SHARE: float = 0.5 # max share of the prompt budget for journal sections
+    # Model/options per task ("game_master", "journal_extractor", "summarizer"), e.g.
+    # LLM_TASKS='{"journal_extractor": {"model": "qwen2.5:3b", "num_ctx": 4096, "temperature": 0}}'
+    LLM_TASKS: dict[str, TaskOptions] = {}
+    # Journals larger than this are narrowed to the most relevant entries per turn (0 = always send all)
+    JOURNAL_RELEVANT_ENTRIES: int = 40
+    JOURNAL_COMPACT_JSON: bool = True # serialize the extractor's game state without indentation
     CORS_ORIGINS: list[str] | str = [
         "http://localhost:5173",
         "http://localhost:3000",
         "http://localhost",
     ]
 
-    @field_validator("CORS_ORIGINS", mode="before")
+    @field_validator("CORS_ORIGINS", "OLLAMA_BASE_URLS", mode="before")
     @classmethod
     def parse_cors_origins(cls, v):
         if isinstance(v, str) and not v.strip().startswith("["):
-            return [origin.strip() for origin in v.split(",")]
+            return [origin.strip() for origin in v.split(",") if origin.strip()]
+        if isinstance(v, str):
+            return json.loads(v)
         return v
 
     class Config:
@@ -1,17 +1,233 @@
-from sqlmodel import Session, SQLModel, create_engine
+import asyncio
+import logging
+from collections.abc import AsyncIterator
+from typing import Any
+
+from sqlalchemy import Column, Connection, event
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.sql import Select
+from sqlalchemy.sql.schema import ScalarElementColumnDefault
+from sqlmodel import SQLModel, create_engine, func, select
+from sqlmodel.ext.asyncio.session import AsyncSession
 
 from config import settings
 from models import *  # noqa: F403
+from models import ChatMessage, JournalCheckpoint, JournalEntry, StateChangeLog
+from services.lineage import history_filter
+
+logger = logging.getLogger(__name__)
 
 sqlite_file_name = settings.DATABASE_FILE
 sqlite_url = f"sqlite:///{sqlite_file_name}"
+async_sqlite_url = f"sqlite+aiosqlite:///{sqlite_file_name}"
 
 connect_args = {"check_same_thread": False}
-engine = create_engine(sqlite_url, connect_args=connect_args)
+pool_args: dict[str, Any] = {
+    "pool_size": settings.SQLITE_POOL_SIZE,
+    "max_overflow": settings.SQLITE_MAX_OVERFLOW,
+    "pool_timeout": settings.SQLITE_POOL_TIMEOUT,
+}
+# Sync engine is only used for schema management at startup
+engine = create_engine(sqlite_url, connect_args=connect_args, **pool_args)
+# Async engine serves all request handlers and background jobs
+async_engine = create_async_engine(async_sqlite_url, connect_args=connect_args, **pool_args)
+
+def _apply_sqlite_profile(dbapi_connection, connection_record):
+    """Applies the configured pragmas to each new SQLite connection."""
+    cursor = dbapi_connection.cursor()
+    cursor.execute(f"PRAGMA journal_mode={settings.SQLITE_JOURNAL_MODE}")
+    cursor.execute(f"PRAGMA synchronous={settings.SQLITE_SYNCHRONOUS}")
+    cursor.execute(f"PRAGMA busy_timeout={settings.SQLITE_BUSY_TIMEOUT_MS}")
+    cursor.execute(f"PRAGMA mmap_size={settings.SQLITE_MMAP_SIZE}")
+    cursor.execute(f"PRAGMA cache_size={settings.SQLITE_CACHE_SIZE}")
+    cursor.execute(f"PRAGMA temp_store={settings.SQLITE_TEMP_STORE}")
+    cursor.close()
+
+for _engine in (engine, async_engine.sync_engine):
+    event.listen(_engine, "connect", _apply_sqlite_profile)
+
+# Held by a session from its first write until its transaction ends
+_write_lock = asyncio.Lock()
+
+class SerializedAsyncSession(AsyncSession):
+    """
+    AsyncSession that takes the process-wide write lock before flushing pending changes
+    and keeps it until commit/rollback, so concurrent writers (requests and background
+    jobs) queue up in the app instead of failing with "database is locked".
+    Reads never take the lock; with WAL they run alongside the single writer.
+    """
+
+    _holds_write_lock = False
+
+    async def _acquire_write_lock(self, force: bool = False):
+        if not settings.SQLITE_SERIALIZE_WRITES or self._holds_write_lock:
+            return
+        if force or self.new or self.dirty or self.deleted:
+            await _write_lock.acquire()
+            self._holds_write_lock = True
+
+    def _release_write_lock(self):
+        if self._holds_write_lock:
+            self._holds_write_lock = False
+            _write_lock.release()
+
+    async def flush(self, objects=None):
+        await self._acquire_write_lock()
+        await super().flush(objects)
+
+    async def commit(self):
+        await self._acquire_write_lock()
+        try:
+            await super().commit()
+        finally:
+            self._release_write_lock()
+
+    async def rollback(self):
+        try:
+            await super().rollback()
+        finally:
+            self._release_write_lock()
+
+    async def close(self):
+        try:
+            await super().close()
+        finally:
+            self._release_write_lock()
+
+# Representative shapes of the per-turn queries, with the index each one must use
+HOT_QUERIES: dict[str, tuple[Select, str]] = {
+    "recent history": (
+        select(ChatMessage)
+        .where(ChatMessage.session_id == 1)
+        .order_by(ChatMessage.id.desc())  # type: ignore[union-attr]
+        .limit(10),
+        "ix_chatmessage_session_id",
+    ),
+    "forked history segment": (
+        select(ChatMessage)
+        .where(ChatMessage.session_id == 1)
+        .where(ChatMessage.id <= 100)  # type: ignore[operator]
+        .order_by(ChatMessage.id.desc())  # type: ignore[union-attr]
+        .limit(10),
+        "ix_chatmessage_session_id",
+    ),
+    "forked unsummarized tail": (
+        select(ChatMessage)
+        .where(history_filter([(2, None), (1, 100)]))
+        .where(ChatMessage.id > 50)  # type: ignore[operator]
+        .order_by(ChatMessage.id)  # type: ignore[arg-type]
+        .limit(40),
+        "ix_chatmessage_session_id",
+    ),
+    "unsummarized tail count": (
+        select(func.count())
+        .select_from(ChatMessage)
+        .where(ChatMessage.session_id == 1)
+        .where(ChatMessage.id > 100),  # type: ignore[operator]
+        "ix_chatmessage_session_id",
+    ),
+    "journal entries of a session": (
+        select(JournalEntry).where(JournalEntry.session_id == 1),
+        "ix_journalentry_session_type_title",
+    ),
+    "change logs by message": (
+        select(StateChangeLog).where(StateChangeLog.message_id.in_([1, 2])),  # type: ignore[attr-defined]
+        "ix_statechangelog_message_id",
+    ),
+    "checkpoint for a rewind": (
+        select(JournalCheckpoint)
+        .where(JournalCheckpoint.session_id == 1)
+        .where(JournalCheckpoint.message_id >= 100)
+        .order_by(JournalCheckpoint.message_id)  # type: ignore[arg-type]
+        .limit(1),
+        "ix_journalcheckpoint_session_message",
+    ),
+}
+
+# One-off data fixes run right after a column is added to an existing table
+BACKFILLS: dict[tuple[str, str], str] = {
+    # Existing summaries are assumed to cover the whole history written so far
+    ("gamesession", "summarized_up_to_id"): (
+        "UPDATE gamesession SET summarized_up_to_id = "
+        "(SELECT MAX(id) FROM chatmessage WHERE chatmessage.session_id = gamesession.id) "
+        "WHERE summary IS NOT NULL"
+    ),
+}
+
+# Indexes of older versions that no query uses any more, dropped by migrate()
+DROPPED_INDEXES = (
+    # History is read in id order since forks and cursor pagination
+    "ix_chatmessage_session_timestamp",
+)
 
 def create_db_and_tables():
     SQLModel.metadata.create_all(engine)
+    migrate()
+    verify_query_plans()
+
+def migrate():
+    """Brings database files created by older versions up to the current schema."""
+    with engine.begin() as conn:
+        for table in SQLModel.metadata.sorted_tables:
+            existing = {row[1] for row in conn.exec_driver_sql(f"PRAGMA table_info({table.name})")}
+            for column in table.columns:
+                if column.name not in existing:
+                    _add_column(conn, table.name, column)
+            # create_all only creates indexes together with new tables
+            for index in table.indexes:
+                index.create(conn, checkfirst=True)
+        for index_name in DROPPED_INDEXES:
+            conn.exec_driver_sql(f"DROP INDEX IF EXISTS {index_name}")
+
+def _add_column(conn: Connection, table_name: str, column: Column):
+    ddl = f"ALTER TABLE {table_name} ADD COLUMN {column.name} {column.type.compile(conn.dialect)}"
+    default = column.default.arg if isinstance(column.default, ScalarElementColumnDefault) else None
+    if default is not None:
+        ddl += f" DEFAULT {default!r}"
+    if not column.nullable and default is not None:
+        ddl += " NOT NULL"
+    logger.info(f"Migrating: {ddl}")
+    conn.exec_driver_sql(ddl)
+    backfill = BACKFILLS.get((table_name, column.name))
+    if backfill:
+        conn.exec_driver_sql(backfill)
+
+def explain_query_plan(conn: Connection, statement: Select) -> list[str]:
+    """Returns the SQLite EXPLAIN QUERY PLAN details for a statement."""
+    sql = statement.compile(conn.engine, compile_kwargs={"literal_binds": True})
+    return [row[-1] for row in conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {sql}")]
+
+def query_plan_problems() -> list[str]:
+    """Hot queries whose plan doesn't use the expected index or scans a whole table."""
+    problems = []
+    with engine.connect() as conn:
+        for name, (statement, index_name) in HOT_QUERIES.items():
+            plan = explain_query_plan(conn, statement)
+            if not any(index_name in detail for detail in plan):
+                problems.append(f"Query '{name}' does not use {index_name}: {plan}")
+            elif any(detail.startswith("SCAN ") and " USING " not in detail for detail in plan):
+                problems.append(f"Query '{name}' scans a table: {plan}")
+    return problems
+
+def verify_query_plans() -> bool:
+    """
+    Checks that the planner uses the expected index for every hot query, logging the ones
+    that don't. `python -m benchmarks.query_plans` runs the same check as a failing gate.
+    """
+    problems = query_plan_problems()
+    for problem in problems:
+        logger.warning(problem)
+    return not problems
+
+async def lock_for_write(session: AsyncSession):
+    """Takes the write lock ahead of statements the unit of work doesn't track, such as bulk insert()s."""
+    if isinstance(session, SerializedAsyncSession):
+        await session._acquire_write_lock(force=True)
+
+def new_session() -> AsyncSession:
+    # Objects stay usable after commit: an expired attribute can't be lazily reloaded under asyncio
+    return SerializedAsyncSession(async_engine, expire_on_commit=False)
 
-def get_session():
-    with Session(engine) as session:
+async def get_session() -> AsyncIterator[AsyncSession]:
+    async with new_session() as session:
         yield session
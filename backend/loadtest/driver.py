@@ -0,0 +1,146 @@
+"""
+Load driver simulating concurrent players against a running backend.
+
+    python -m loadtest.fake_ollama --port 11435 &
+    OLLAMA_BASE_URL=http://127.0.0.1:11435 uvicorn main:app --port 8000 &
+    python -m loadtest.driver --base-url http://127.0.0.1:8000 --players 20 --turns 10
+
+Each player creates a session, then plays turns: an action (POST /action, or /action/stream
+with --stream), followed by the GET /history and /journal reads the frontend makes after
+every turn, with some think time in between. Reports throughput and p50/p95/p99 latency
+per endpoint, status codes, and "database is locked" errors.
+"""
+import argparse
+import asyncio
+import random
+import statistics
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+
+import httpx
+
+ACTIONS = (
+    "I look around the tavern.",
+    "I ask the innkeeper about the dragon.",
+    "I buy a round of ale for the bard.",
+    "I head north along the ember road.",
+    "I draw my sword and approach the ruin.",
+    "I whisper the old oath at the gate.",
+)
+
+
+@dataclass
+class EndpointStats:
+    latencies: list[float] = field(default_factory=list)
+    statuses: Counter[str] = field(default_factory=Counter)
+    lock_errors: int = 0
+
+
+class LoadReport:
+    def __init__(self):
+        self.endpoints: dict[str, EndpointStats] = {}
+        self.turns = 0
+        self.started = time.perf_counter()
+
+    def record(self, endpoint: str, seconds: float, status: str, body: str = ""):
+        stats = self.endpoints.setdefault(endpoint, EndpointStats())
+        stats.latencies.append(seconds)
+        stats.statuses[status] += 1
+        if "database is locked" in body:
+            stats.lock_errors += 1
+
+    def print(self):
+        elapsed = time.perf_counter() - self.started
+        print(f"\n{self.turns} turns in {elapsed:.1f}s ({self.turns / elapsed:.2f} turns/s)\n")
+        print(f"{'endpoint':<20} {'requests':>9} {'req/s':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} "
+              f"{'locked':>7}  statuses")
+        for endpoint, stats in self.endpoints.items():
+            print(
+                f"{endpoint:<20} {len(stats.latencies):>9} {len(stats.latencies) / elapsed:>7.2f} "
+                f"{_percentile(stats.latencies, 50):>8.0f} {_percentile(stats.latencies, 95):>8.0f} "
+                f"{_percentile(stats.latencies, 99):>8.0f} {stats.lock_errors:>7}  "
+                + ", ".join(f"{status}: {n}" for status, n in sorted(stats.statuses.items()))
+            )
+
+
+def _percentile(values: list[float], q: int) -> float:
+    """q-th percentile in milliseconds."""
+    if len(values) < 2:
+        return values[0] * 1000 if values else 0.0
+    return statistics.quantiles(values, n=100, method="inclusive")[q - 1] * 1000
+
+
+async def _timed(report: LoadReport, endpoint: str, request) -> httpx.Response | None:
+    started = time.perf_counter()
+    try:
+        response = await request
+    except httpx.HTTPError as e:
+        report.record(endpoint, time.perf_counter() - started, type(e).__name__, str(e))
+        return None
+    report.record(endpoint, time.perf_counter() - started, str(response.status_code), response.text)
+    return response
+
+
+async def _stream_action(client: httpx.AsyncClient, path: str, json: dict) -> httpx.Response:
+    """Consumes an SSE turn, returning a response whose status reflects an error event."""
+    async with client.stream("POST", path, json=json) as response:
+        body = "".join([chunk async for chunk in response.aiter_text()])
+    if response.status_code == 200 and "event: error" in body:
+        return httpx.Response(500, text=body)
+    return httpx.Response(response.status_code, text=body)
+
+
+async def _player(
+    n: int, client: httpx.AsyncClient, report: LoadReport, args: argparse.Namespace, rng: random.Random
+):
+    await asyncio.sleep(rng.uniform(0, args.ramp_up))
+    response = await _timed(report, "POST /sessions", client.post(
+        "/sessions/", json={"name": f"Load test player {n}", "start_prompt": "You wake up in a tavern."}
+    ))
+    if response is None or response.status_code != 200:
+        return
+    session_id = response.json()["id"]
+
+    for _ in range(args.turns):
+        payload = {"action": rng.choice(ACTIONS), "language": "en"}
+        if args.stream:
+            response = await _timed(
+                report, "POST /action/stream", _stream_action(client, f"/sessions/{session_id}/action/stream", payload)
+            )
+        else:
+            response = await _timed(report, "POST /action", client.post(f"/sessions/{session_id}/action", json=payload))
+        if response is not None and response.status_code == 200:
+            report.turns += 1
+        await _timed(report, "GET /history", client.get(f"/sessions/{session_id}/history", params={"limit": 20}))
+        await _timed(report, "GET /journal", client.get(f"/sessions/{session_id}/journal"))
+        await asyncio.sleep(rng.uniform(0, 2 * args.think_time))
+
+
+async def run(args: argparse.Namespace) -> LoadReport:
+    report = LoadReport()
+    rng = random.Random(args.seed)
+    limits = httpx.Limits(max_connections=args.players * 2, max_keepalive_connections=args.players)
+    async with httpx.AsyncClient(base_url=args.base_url, timeout=args.timeout, limits=limits) as client:
+        await asyncio.gather(*(
+            _player(n, client, report, args, random.Random(rng.random())) for n in range(args.players)
+        ))
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--players", type=int, default=10)
+    parser.add_argument("--turns", type=int, default=5, help="turns per player")
+    parser.add_argument("--think-time", type=float, default=1.0, help="mean pause between turns (s)")
+    parser.add_argument("--ramp-up", type=float, default=5.0, help="players join spread over this many seconds")
+    parser.add_argument("--stream", action="store_true", help="play turns through /action/stream")
+    parser.add_argument("--timeout", type=float, default=300.0, help="client timeout per request (s)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    asyncio.run(run(args)).print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+"""
+Stand-in for an Ollama server, for load tests without GPUs.
+
+    python -m loadtest.fake_ollama --port 11435 --latency 0.3 --tokens-per-second 40 --parallel 4
+
+Serves /api/generate and /api/chat (streamed or not) with canned text at a configurable
+speed: each generation takes --latency seconds of prompt evaluation, then produces tokens at
+--tokens-per-second. At most --parallel generations run at once and the rest queue, like
+OLLAMA_NUM_PARALLEL. Requests with a JSON `format` (journal extraction, single-call turns)
+get canned JSON matching the app's schemas. Reported token counts and durations follow
+the simulated timings.
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+from collections.abc import AsyncIterator
+from typing import Any
+
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+
+NARRATION = (
+    "The tavern falls quiet as you step inside. A hooded bard lowers her lute and studies you, "
+    "while the innkeeper, a broad man named Harrow, slides a mug of ale across the counter. "
+    "Rumors of a dragon on the ember road have emptied the northern villages, he says, and "
+    "the king pays well for anyone foolish enough to look into it."
+)
+NAMES = ("Harrow", "Mira the Bard", "Old Tomas", "Captain Vel", "The Ember Witch")
+
+
+def _journal_updates(rng: random.Random) -> dict[str, Any]:
+    name = rng.choice(NAMES)
+    return {
+        "quests": [{
+            "operation": "add",
+            "name": f"Scout the ember road #{rng.randint(1, 50)}",
+            "description": "Find out what burns the northern villages.",
+        }],
+        "characters": [{"operation": "update", "name": name, "description": f"{name} was seen at the tavern."}],
+        "lore": [],
+    }
+
+
+class FakeOllama:
+    def __init__(self, latency: float, tokens_per_second: float, parallel: int, jitter: float, seed: int = 0):
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+        self.jitter = jitter
+        self.slots = asyncio.Semaphore(parallel)
+        self.rng = random.Random(seed)
+
+    def _reply(self, payload: dict[str, Any]) -> str:
+        schema = payload.get("format")
+        if not schema:
+            return NARRATION
+        updates = _journal_updates(self.rng)
+        if isinstance(schema, dict) and "narration" in schema.get("properties", {}):
+            updates = {"narration": NARRATION, **updates}
+        return json.dumps(updates, ensure_ascii=False)
+
+    @staticmethod
+    def _prompt_tokens(payload: dict[str, Any]) -> int:
+        if "messages" in payload:
+            text = "".join(message.get("content", "") for message in payload["messages"])
+        else:
+            text = payload.get("system", "") + payload.get("prompt", "")
+        return max(len(text) // 4, 1)
+
+    async def generate(self, payload: dict[str, Any], chat: bool) -> AsyncIterator[dict[str, Any]]:
+        """Yields the generation as Ollama stream chunks, the last one with the stats."""
+        reply = self._reply(payload)
+        # Roughly one token per word, keeping the separators so the text reassembles exactly
+        tokens = [word + " " for word in reply.split(" ")]
+        tokens[-1] = tokens[-1][:-1]
+        queued = time.perf_counter()
+        async with self.slots:
+            started = time.perf_counter()
+            prompt_seconds = max(self.latency * (1 + self.rng.uniform(-self.jitter, self.jitter)), 0.0)
+            await asyncio.sleep(prompt_seconds)
+            eval_started = time.perf_counter()
+            for token in tokens:
+                if self.tokens_per_second > 0:
+                    await asyncio.sleep(1 / self.tokens_per_second)
+                yield self._chunk(token, chat)
+            finished = time.perf_counter()
+        yield {
+            **self._chunk("", chat),
+            "done": True,
+            "done_reason": "stop",
+            "prompt_eval_count": self._prompt_tokens(payload),
+            "prompt_eval_duration": int((eval_started - started) * 1e9),
+            "eval_count": len(tokens),
+            "eval_duration": int((finished - eval_started) * 1e9),
+            "load_duration": 0,
+            "total_duration": int((finished - queued) * 1e9),
+        }
+
+    @staticmethod
+    def _chunk(text: str, chat: bool) -> dict[str, Any]:
+        if chat:
+            return {"message": {"role": "assistant", "content": text}, "done": False}
+        return {"response": text, "done": False}
+
+
+def create_app(fake: FakeOllama) -> FastAPI:
+    app = FastAPI(title="Fake Ollama")
+
+    async def respond(request: Request, chat: bool):
+        payload = await request.json()
+        chunks = fake.generate(payload, chat)
+        if payload.get("stream", True):
+            async def ndjson() -> AsyncIterator[str]:
+                async for chunk in chunks:
+                    yield json.dumps(chunk) + "\n"
+            return StreamingResponse(ndjson(), media_type="application/x-ndjson")
+        text = []
+        async for chunk in chunks:
+            text.append(chunk["message"]["content"] if chat else chunk["response"])
+        if chat:
+            chunk["message"]["content"] = "".join(text)
+        else:
+            chunk["response"] = "".join(text)
+        return chunk
+
+    @app.post("/api/generate")
+    async def generate(request: Request):
+        return await respond(request, chat=False)
+
+    @app.post("/api/chat")
+    async def chat(request: Request):
+        return await respond(request, chat=True)
+
+    @app.get("/api/version")
+    async def version():
+        return {"version": "0.0.0-fake"}
+
+    @app.get("/api/tags")
+    async def tags():
+        return {"models": [{"name": "fake"}]}
+
+    return app
+
+
+def main():
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--latency", type=float, default=0.3, help="prompt evaluation time per request (s)")
+    parser.add_argument("--tokens-per-second", type=float, default=40.0, help="generation speed (0 = instant)")
+    parser.add_argument("--parallel", type=int, default=4, help="generations served at once")
+    parser.add_argument("--jitter", type=float, default=0.2, help="relative random variation of --latency")
+    args = parser.parse_args()
+    fake = FakeOllama(args.latency, args.tokens_per_second, args.parallel, args.jitter)
+    uvicorn.run(create_app(fake), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
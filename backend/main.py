@@ -6,8 +6,11 @@ from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
 
 from config import settings
-from database import create_db_and_tables
-from routers import game, sessions
+from database import async_engine, create_db_and_tables
+from routers import game, metrics, sessions
+from services.background import post_turn_worker
+from services.llm import ollama_service
+from services.turns import turn_registry
 
 # Configure logging with detailed format
 level = logging.getLevelNamesMapping().get(settings.LOG_LEVEL, logging.INFO)
@@ -20,22 +23,25 @@ logger = logging.getLogger(__name__)
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     create_db_and_tables()
+    ollama_service.start()
     yield
+    await turn_registry.shutdown()
+    await post_turn_worker.shutdown()
+    await ollama_service.aclose()
+    await async_engine.dispose()
 
 app = FastAPI(lifespan=lifespan)
 
-# Exception handler middleware
-@app.middleware("http")
-async def log_exceptions(request: Request, call_next):
-    try:
-        return await call_next(request)
-    except Exception as e:
-        # Log full traceback
-        logger.exception(f"Unhandled exception during {request.method} {request.url.path}")
-        return JSONResponse(
-            status_code=500,
-            content={"detail": str(e), "type": type(e).__name__}
-        )
+# Unhandled exceptions: a handler rather than an HTTP middleware, since BaseHTTPMiddleware hides
+# client disconnects from the endpoints (a waiting /action must notice them to cancel its turn)
+@app.exception_handler(Exception)
+async def log_exceptions(request: Request, exc: Exception):
+    # Log full traceback
+    logger.error(f"Unhandled exception during {request.method} {request.url.path}", exc_info=exc)
+    return JSONResponse(
+        status_code=500,
+        content={"detail": str(exc), "type": type(exc).__name__}
+    )
 
 app.add_middleware(
     CORSMiddleware,
@@ -47,7 +53,8 @@ app.add_middleware(
 
 app.include_router(sessions.router)
 app.include_router(game.router)
+app.include_router(metrics.router)
 
 @app.get("/")
-def read_root():
+async def read_root():
     return {"message": "TavernWorker API is running"}
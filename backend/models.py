@@ -1,6 +1,6 @@
 from datetime import datetime
 
-from sqlmodel import JSON, Field, Relationship, SQLModel
+from sqlmodel import JSON, Field, Index, Relationship, SQLModel
 
 
 class GameSession(SQLModel, table=True):
@@ -8,21 +8,43 @@ class GameSession(SQLModel, table=True):
     name: str
     start_prompt: str
     summary: str | None = Field(default=None)
+    # Last message folded into the summary; later messages are still pending summarization
+    summarized_up_to_id: int | None = Field(default=None)
+    # Summary state before the latest summarization, restored when undo crosses the watermark
+    previous_summary: str | None = Field(default=None)
+    previous_summarized_up_to_id: int | None = Field(default=None)
+    # Forks share the parent's history up to fork_message_id instead of copying it
+    parent_id: int | None = Field(default=None, foreign_key="gamesession.id", index=True)
+    fork_message_id: int | None = Field(default=None)
     created_at: datetime = Field(default_factory=datetime.utcnow)
     
     messages: list["ChatMessage"] = Relationship(back_populates="session", cascade_delete=True)
     journal_entries: list["JournalEntry"] = Relationship(back_populates="session", cascade_delete=True)
+    checkpoints: list["JournalCheckpoint"] = Relationship(back_populates="session", cascade_delete=True)
 
 class ChatMessage(SQLModel, table=True):
+    __table_args__ = (
+        # History reads: WHERE session_id = ? [AND id <= fork point] ORDER BY id DESC LIMIT n;
+        # unsummarized tail: WHERE session_id = ? AND id > watermark
+        Index("ix_chatmessage_session_id", "session_id", "id"),
+    )
+
     id: int | None = Field(default=None, primary_key=True)
     session_id: int = Field(foreign_key="gamesession.id")
     role: str # user, assistant, system
     content: str
+    # Estimated LLM tokens of content, cached for prompt packing
+    token_count: int | None = Field(default=None)
+    # Prompt tokens Ollama had to evaluate for this reply (lower = more of the prompt came from its cache)
+    prompt_eval_count: int | None = Field(default=None)
     timestamp: datetime = Field(default_factory=datetime.utcnow)
     
     session: GameSession = Relationship(back_populates="messages")
 
 class JournalEntry(SQLModel, table=True):
+    # Loading a session's journal (matched by type and name in memory) and per-type listings
+    __table_args__ = (Index("ix_journalentry_session_type_title", "session_id", "entry_type", "title"),)
+
     id: int | None = Field(default=None, primary_key=True)
     session_id: int = Field(foreign_key="gamesession.id")
     title: str
@@ -35,9 +57,25 @@ class JournalEntry(SQLModel, table=True):
 class StateChangeLog(SQLModel, table=True):
     id: int | None = Field(default=None, primary_key=True)
     session_id: int = Field(foreign_key="gamesession.id")
-    message_id: int = Field(foreign_key="chatmessage.id")
+    message_id: int = Field(foreign_key="chatmessage.id", index=True)
     entity_type: str # "journal_entry"
     entity_id: int
     operation: str # "create", "update", "delete"
     previous_state: dict | None = Field(default=None, sa_type=JSON)
     created_at: datetime = Field(default_factory=datetime.utcnow)
+
+class JournalCheckpoint(SQLModel, table=True):
+    # Snapshot of a session's journal and summary right after an AI message's post-turn steps,
+    # taken every JOURNAL_CHECKPOINT_INTERVAL turns so deep undos don't replay every change log
+    __table_args__ = (Index("ix_journalcheckpoint_session_message", "session_id", "message_id"),)
+
+    id: int | None = Field(default=None, primary_key=True)
+    session_id: int = Field(foreign_key="gamesession.id")
+    message_id: int
+    summary: str | None = Field(default=None)
+    summarized_up_to_id: int | None = Field(default=None)
+    # Journal entries as JSON-mode dumps, like StateChangeLog.previous_state
+    entries: list[dict] = Field(default_factory=list, sa_type=JSON)
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+
+    session: GameSession = Relationship(back_populates="checkpoints")
@@ -78,6 +78,21 @@ PROMPTS: dict[str, dict[str, str]] = {
             "- If no changes for a category, return an empty list.\n"
             "- BE DECISIVE: When a quest is done or character is gone, use \"delete\" immediately.\n"
             "- Respond ONLY with the JSON object."
+        ),
+        "structured_turn": (
+            "OUTPUT FORMAT (replaces plain narration):\n"
+            "Respond with a single JSON object holding your narration and the changes this turn makes to the world state:\n"
+            "{\n"
+            "  \"narration\": \"The game master's narration for this turn\",\n"
+            "  \"quests\": [ { \"operation\": \"add\" | \"update\" | \"delete\", \"name\": \"Quest Title\", \"description\": \"Quest details...\" } ],\n"
+            "  \"characters\": [ { \"operation\": \"add\" | \"update\" | \"delete\", \"name\": \"Character Name\", \"description\": \"Character details...\" } ],\n"
+            "  \"lore\": [ { \"operation\": \"add\" | \"update\" | \"delete\", \"name\": \"Lore Topic\", \"description\": \"Lore details...\" } ]\n"
+            "}\n\n"
+            "Rules for the lists:\n"
+            "- 'name' must match exactly the name from <world_state> for updates and deletions.\n"
+            "- Delete quests that are completed, failed or abandoned, and characters that are dead or gone.\n"
+            "- If nothing changed for a category, use an empty list.\n"
+            "- Respond ONLY with the JSON object."
         )
     },
     "ru": {
@@ -157,6 +172,21 @@ PROMPTS: dict[str, dict[str, str]] = {
             "- Если изменений нет, верни пустой список.\n"
             "- БУДЬ РЕШИТЕЛЬНЫМ: Когда квест выполнен или персонаж исчез, используй \"delete\" немедленно.\n"
             "- Отвечай ТОЛЬКО JSON-объектом."
+        ),
+        "structured_turn": (
+            "ФОРМАТ ВЫВОДА (вместо обычного повествования):\n"
+            "Отвечай одним JSON-объектом, содержащим твоё повествование и изменения состояния мира за этот ход:\n"
+            "{\n"
+            "  \"narration\": \"Повествование мастера игры за этот ход\",\n"
+            "  \"quests\": [ { \"operation\": \"add\" | \"update\" | \"delete\", \"name\": \"Название квеста\", \"description\": \"Описание...\" } ],\n"
+            "  \"characters\": [ { \"operation\": \"add\" | \"update\" | \"delete\", \"name\": \"Имя персонажа\", \"description\": \"Описание...\" } ],\n"
+            "  \"lore\": [ { \"operation\": \"add\" | \"update\" | \"delete\", \"name\": \"Тема лора\", \"description\": \"Описание...\" } ]\n"
+            "}\n\n"
+            "Правила для списков:\n"
+            "- 'name' должен точно совпадать с именем из <world_state> для обновлений и удалений.\n"
+            "- Удаляй выполненные, проваленные или заброшенные квесты, а также погибших или ушедших персонажей.\n"
+            "- Если изменений в категории нет, используй пустой список.\n"
+            "- Отвечай ТОЛЬКО JSON-объектом."
         )
     }
 }
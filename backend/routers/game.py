@@ -1,12 +1,23 @@
 
+import asyncio
+import json
 import logging
-from fastapi import APIRouter, Depends, HTTPException
-from pydantic import BaseModel
-from sqlmodel import Session, select
+from collections.abc import AsyncIterator
 
-from database import get_session
-from models import ChatMessage, JournalEntry
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from database import get_session, new_session
+from models import ChatMessage, GameSession, JournalEntry
 from services.game_engine import GameEngine
+from services.lineage import lineage_cache, newest_messages
+from services.llm import DeadlineExceededError, LLMSaturatedError, LLMUnavailableError, ollama_service
+from services.metrics import server_timing, stage_timings
+from services.turns import SessionBusyError, Turn, turn_registry
+from services.versions import etag_matches, session_versions
 
 logger = logging.getLogger(__name__)
 
@@ -16,20 +27,121 @@ router = APIRouter(
     responses={404: {"description": "Not found"}},
 )
 
+# How often a waiting /action request checks whether its client is still connected
+DISCONNECT_POLL_SECONDS = 1.0
+
 class ActionRequest(BaseModel):
     action: str
     language: str = "en"
+    # Client-chosen id of this action; retries with the same key attach to the original turn
+    idempotency_key: str | None = None
+    # Seconds the turn may take before it is abandoned (TURN_TIMEOUT if not set)
+    timeout: float | None = Field(default=None, gt=0)
 
 class ActionResponse(BaseModel):
     response: str
+    message_id: int
+
+class MessageStatusResponse(BaseModel):
+    message_id: int
+    journal_pending: bool
+
+class ForkRequest(BaseModel):
+    # Last message the fork shares; defaults to the latest one
+    message_id: int | None = None
+    name: str | None = None
+
+async def _start_turn(
+    session_id: int, request: ActionRequest, db: AsyncSession, stream: bool
+) -> Turn | ChatMessage:
+    """
+    Starts the turn for an action, or attaches to it if it is a retry of the running turn.
+    Returns the saved AI message instead if a turn with this idempotency key already finished.
+    """
+    message_id = turn_registry.completed_message_id(session_id, request.idempotency_key)
+    if message_id is not None:
+        ai_msg = await db.get(ChatMessage, message_id)
+        # The message id may have been reused by another session since
+        if ai_msg is not None and ai_msg.session_id == session_id:
+            return ai_msg
+    if not await db.get(GameSession, session_id):
+        raise HTTPException(status_code=404, detail="Session not found")
+    # The turn uses its own DB session; don't keep a pooled connection while waiting for it
+    await db.close()
+
+    async def run(turn: Turn) -> ChatMessage:
+        stage_timings.set(turn.timings)
+        # The turn outlives the request that started it, so it gets its own DB session
+        async with new_session() as turn_db:
+            engine = GameEngine(turn_db)
+            if not stream:
+                return await engine.process_action(
+                    session_id, request.action, language=request.language, timeout=request.timeout
+                )
+            async for chunk in await engine.process_action_stream(
+                session_id, request.action, language=request.language, timeout=request.timeout
+            ):
+                if isinstance(chunk, ChatMessage):
+                    return chunk
+                await turn.publish(chunk)
+        raise RuntimeError("Turn ended without a reply")
+
+    try:
+        # Admission control sheds new turns up front rather than queue ones that would time out
+        return turn_registry.start(session_id, request.idempotency_key, run, admit=ollama_service.admit)
+    except SessionBusyError as e:
+        raise HTTPException(status_code=409, detail=str(e)) from e
+    except LLMSaturatedError as e:
+        raise HTTPException(
+            status_code=429,
+            detail="The game master is busy, please retry shortly",
+            headers={"Retry-After": str(e.retry_after)},
+        ) from e
+
+async def _wait_for_reply(http_request: Request, turn: Turn) -> ChatMessage:
+    """Waits for the turn's reply; stops waiting (letting an unwatched turn be cancelled) if the client leaves."""
+    reply = asyncio.ensure_future(turn.wait())
+    try:
+        while True:
+            done, _ = await asyncio.wait({reply}, timeout=DISCONNECT_POLL_SECONDS)
+            if done:
+                return reply.result()
+            if await http_request.is_disconnected():
+                logger.info(f"Client of session {turn.session_id} disconnected while waiting for a reply")
+                # Nobody will read the response
+                raise HTTPException(status_code=499, detail="Client disconnected")
+    finally:
+        reply.cancel()
 
 @router.post("/action", response_model=ActionResponse)
-def send_action(session_id: int, request: ActionRequest, db: Session = Depends(get_session)):
-    """Process a user action in the game."""
-    engine = GameEngine(db)
+async def send_action(
+    session_id: int,
+    request: ActionRequest,
+    http_request: Request,
+    response: Response,
+    db: AsyncSession = Depends(get_session)
+):
+    """
+    Process a user action in the game.
+    Turns of a session run one at a time: while one is in progress, other actions get a 409,
+    except retries carrying the same idempotency key, which wait for the running turn.
+    If the client disconnects (and no retry is waiting), the turn is cancelled and rolled back.
+    The Server-Timing header breaks the turn's time down by stage.
+    """
+    turn = await _start_turn(session_id, request, db, stream=False)
     try:
-        response_text = engine.process_action(session_id, request.action, language=request.language)
-        return ActionResponse(response=response_text)
+        if isinstance(turn, ChatMessage):
+            ai_msg = turn
+        else:
+            ai_msg = await _wait_for_reply(http_request, turn)
+            response.headers["Server-Timing"] = server_timing(turn.timings)
+        return ActionResponse(response=ai_msg.content, message_id=ai_msg.id)  # type: ignore[arg-type]
+    except HTTPException:
+        raise
+    except DeadlineExceededError as e:
+        raise HTTPException(status_code=504, detail=str(e)) from e
+    except LLMUnavailableError as e:
+        raise HTTPException(status_code=503, detail=str(e)) from e
     except ValueError as e:
         logger.error(f"ValueError in send_action for session {session_id}: {e}")
         raise HTTPException(status_code=404, detail=str(e)) from e
@@ -37,50 +149,149 @@ def send_action(session_id: int, request: ActionRequest, db: Session = Depends(g
         logger.exception(f"Unexpected error in send_action for session {session_id}")
         raise HTTPException(status_code=500, detail=str(e)) from e
 
-@router.post("/undo", response_model=dict[str, bool])
-def undo_action(session_id: int, db: Session = Depends(get_session)):
-    """Undo the last user action."""
+def _sse_event(event: str, data: dict) -> str:
+    """Formats a single Server-Sent Events message."""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@router.post("/action/stream")
+async def send_action_stream(session_id: int, request: ActionRequest, db: AsyncSession = Depends(get_session)):
+    """
+    Process a user action, streaming the game master's reply as Server-Sent Events.
+    Emits a "token" event per generated chunk, then a "done" event with the full response
+    and message id once the reply is saved, or an "error" event if the turn fails mid-stream.
+    A retry with the idempotency key of the running turn replays its tokens so far and follows it.
+    """
+    turn = await _start_turn(session_id, request, db, stream=True)
+
+    async def event_stream() -> AsyncIterator[str]:
+        if isinstance(turn, ChatMessage):
+            yield _sse_event("done", {"response": turn.content, "message_id": turn.id})
+            return
+        try:
+            async for chunk in turn.follow():
+                if isinstance(chunk, ChatMessage):
+                    yield _sse_event("done", {"response": chunk.content, "message_id": chunk.id})
+                else:
+                    yield _sse_event("token", {"text": chunk})
+        except Exception as e:
+            logger.exception(f"Unexpected error in send_action_stream for session {session_id}")
+            yield _sse_event("error", {"detail": str(e)})
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        # Disable proxy buffering (nginx) so tokens reach the browser immediately
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@router.get("/messages/{message_id}/status", response_model=MessageStatusResponse)
+async def get_message_status(session_id: int, message_id: int, db: AsyncSession = Depends(get_session)):
+    """Check whether journal/summary processing for an AI message is still pending."""
     engine = GameEngine(db)
-    success = engine.undo_last_move(session_id)
-    if not success:
+    return MessageStatusResponse(
+        message_id=message_id,
+        journal_pending=engine.is_journal_pending(session_id, message_id)
+    )
+
+@router.post("/undo", response_model=dict[str, bool | int])
+async def undo_action(
+    session_id: int,
+    steps: int = Query(1, ge=1, description="Number of moves to undo"),
+    db: AsyncSession = Depends(get_session)
+):
+    """Undo the last `steps` user actions (fewer if the session has fewer)."""
+    if turn_registry.is_busy(session_id):
+        raise HTTPException(status_code=409, detail="Cannot undo while a turn is in progress")
+    engine = GameEngine(db)
+    undone = await engine.undo_moves(session_id, steps)
+    if not undone:
         raise HTTPException(status_code=400, detail="No moves to undo")
-    return {"success": True}
+    return {"success": True, "undone": undone}
+
+@router.post("/redo", response_model=dict[str, bool | int])
+async def redo_action(session_id: int, db: AsyncSession = Depends(get_session)):
+    """Redo the moves removed by the last undo, unless a turn was played since."""
+    if turn_registry.is_busy(session_id):
+        raise HTTPException(status_code=409, detail="Cannot redo while a turn is in progress")
+    engine = GameEngine(db)
+    redone = await engine.redo_moves(session_id)
+    if not redone:
+        raise HTTPException(status_code=400, detail="Nothing to redo")
+    return {"success": True, "redone": redone}
+
+@router.post("/fork", response_model=GameSession)
+async def fork_session(session_id: int, request: ForkRequest, db: AsyncSession = Depends(get_session)):
+    """Branch the campaign at a message of its history, e.g. to try another choice."""
+    if not await db.get(GameSession, session_id):
+        raise HTTPException(status_code=404, detail="Session not found")
+    try:
+        return await GameEngine(db).fork_session(session_id, request.message_id, request.name)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e)) from e
+
+def _not_modified(http_request: Request, response: Response, session_id: int) -> Response | None:
+    """
+    Tags a polled read with the session's version. Returns a 304 response if the client's
+    copy is still current, before anything is read from the database.
+    """
+    etag = session_versions.etag(session_id)
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag_matches(http_request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return None
 
 @router.get("/history", response_model=list[ChatMessage])
-def get_history(
+async def get_history(
     session_id: int, 
+    http_request: Request,
+    response: Response,
     limit: int = 20, 
     offset: int = 0, 
-    db: Session = Depends(get_session)
+    before_id: int | None = Query(None, description="Only messages older than this one (cursor for the next page)"),
+    db: AsyncSession = Depends(get_session)
 ):
-    """Get chat history for the session with pagination."""
+    """
+    Get chat history for the session, newest page first. Page back by passing the id of the
+    oldest message received as `before_id`; unlike `offset`, this stays put when new turns
+    land and doesn't scan the skipped messages.
+    """
+    not_modified = _not_modified(http_request, response, session_id)
+    if not_modified is not None:
+        return not_modified
     # Get messages ordered by newest first to apply limit/offset correctly from the end
-    messages = db.exec(
-        select(ChatMessage)
-        .where(ChatMessage.session_id == session_id)
-        .order_by(ChatMessage.timestamp.desc())  # type: ignore[attr-defined]
-        .offset(offset)
-        .limit(limit)
-    ).all()
+    # Forks include the history they share with the sessions they were forked from
+    lineage = await lineage_cache.get(db, session_id)
+    messages = await newest_messages(db, lineage, limit, offset=offset, before_id=before_id)
     
     # Reverse to return in chronological order (oldest first)
     return list(reversed(messages))
 
 @router.get("/journal", response_model=list[JournalEntry])
-def get_journal(session_id: int, db: Session = Depends(get_session)):
+async def get_journal(
+    session_id: int, http_request: Request, response: Response, db: AsyncSession = Depends(get_session)
+):
     """Get journal entries for the session."""
-    entries = db.exec(
+    not_modified = _not_modified(http_request, response, session_id)
+    if not_modified is not None:
+        return not_modified
+    entries = (await db.exec(
         select(JournalEntry)
         .where(JournalEntry.session_id == session_id)
-    ).all()
+    )).all()
     return entries
 
 @router.get("/characters", response_model=list[JournalEntry])
-def get_characters(session_id: int, db: Session = Depends(get_session)):
+async def get_characters(
+    session_id: int, http_request: Request, response: Response, db: AsyncSession = Depends(get_session)
+):
     """Get characters for the session."""
-    chars = db.exec(
+    not_modified = _not_modified(http_request, response, session_id)
+    if not_modified is not None:
+        return not_modified
+    chars = (await db.exec(
         select(JournalEntry)
         .where(JournalEntry.session_id == session_id)
         .where(JournalEntry.entry_type == "character")
-    ).all()
+    )).all()
     return chars
@@ -0,0 +1,32 @@
+from typing import Any
+
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+
+from services.llm import ollama_service
+from services.metrics import llm_metrics, render_prometheus
+
+router = APIRouter(
+    prefix="/metrics",
+    tags=["metrics"],
+)
+
+@router.get("", response_class=PlainTextResponse)
+async def get_prometheus_metrics():
+    """
+    Turn stage and LLM call histograms (including Ollama's own load, prompt evaluation and
+    generation times) and backend load gauges, in the Prometheus text format.
+    """
+    return PlainTextResponse(
+        render_prometheus(ollama_service.scheduler_stats()),
+        media_type="text/plain; version=0.0.4; charset=utf-8",
+    )
+
+@router.get("/llm", response_model=dict[str, Any])
+async def get_llm_metrics():
+    """
+    Latency and token counters of LLM calls per task and model, for tuning the model split,
+    per-task queue waits and events such as unparseable or repaired responses, and the
+    current load of each backend.
+    """
+    return {**llm_metrics.snapshot(), "backends": ollama_service.scheduler_stats()}
@@ -1,9 +1,15 @@
 
 from fastapi import APIRouter, Depends, HTTPException
-from sqlmodel import Session, select
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
 
 from database import get_session
 from models import GameSession
+from services.lineage import lineage_cache
+from services.redo import redo_stack
+from services.turns import turn_registry
+from services.versions import session_versions
+from services.world_state import world_state_cache
 
 router = APIRouter(
     prefix="/sessions",
@@ -12,39 +18,49 @@ router = APIRouter(
 )
 
 @router.post("/", response_model=GameSession)
-def create_session(session_data: GameSession, db: Session = Depends(get_session)):
+async def create_session(session_data: GameSession, db: AsyncSession = Depends(get_session)):
     """Create a new game session."""
     db.add(session_data)
-    db.commit()
-    db.refresh(session_data)
+    await db.commit()
+    await db.refresh(session_data)
     return session_data
 
 @router.get("/", response_model=list[GameSession])
-def read_sessions(skip: int = 0, limit: int = 100, db: Session = Depends(get_session)):
+async def read_sessions(skip: int = 0, limit: int = 100, db: AsyncSession = Depends(get_session)):
     """List all game sessions."""
-    sessions = db.exec(select(GameSession).offset(skip).limit(limit)).all()
+    sessions = (await db.exec(select(GameSession).offset(skip).limit(limit))).all()
     return sessions
 
 @router.get("/{session_id}", response_model=GameSession)
-def read_session(session_id: int, db: Session = Depends(get_session)):
+async def read_session(session_id: int, db: AsyncSession = Depends(get_session)):
     """Get a specific game session by ID."""
-    session = db.get(GameSession, session_id)
+    session = await db.get(GameSession, session_id)
     if not session:
         raise HTTPException(status_code=404, detail="Session not found")
     return session
 
 @router.delete("/{session_id}")
-def delete_session(session_id: int, db: Session = Depends(get_session)):
+async def delete_session(session_id: int, db: AsyncSession = Depends(get_session)):
     """Delete a game session."""
-    session = db.get(GameSession, session_id)
+    session = await db.get(GameSession, session_id)
     if not session:
         raise HTTPException(status_code=404, detail="Session not found")
+    # Forks read their history through this session
+    fork = (await db.exec(select(GameSession.id).where(GameSession.parent_id == session_id).limit(1))).first()
+    if fork is not None:
+        raise HTTPException(status_code=409, detail="Session has forks; delete them first")
     
     # Cascade delete should be handled by database relationships if configured, 
     # but SQLModel/SQLAlchemy might need explicit deletion if not set up with cascade.
     # For now, we'll just delete the session and let the DB handle constraints or errors.
     # Ideally, we should delete related messages/characters/journal entries first or use CASCADE in models.
     
-    db.delete(session)
-    db.commit()
+    await db.delete(session)
+    await db.commit()
+    world_state_cache.invalidate(session_id)
+    redo_stack.clear(session_id)
+    lineage_cache.invalidate(session_id)
+    turn_registry.forget_session(session_id)
+    # Its id may be reused; tags handed out for this session must not match the new one
+    session_versions.bump(session_id)
     return {"ok": True}
@@ -0,0 +1,89 @@
+import asyncio
+import logging
+from collections import deque
+from collections.abc import Awaitable, Callable
+from dataclasses import dataclass
+
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+@dataclass
+class PostTurnJob:
+    session_id: int
+    message_id: int
+    kind: str # "journal", "summary"
+    run: Callable[[], Awaitable[None]]
+
+class PostTurnWorker:
+    """
+    Runs post-turn jobs (journal extraction, summarization) off the request path.
+    Jobs of one session run strictly in submission order; different sessions are
+    drained by separate tasks, with at most `max_concurrent` jobs running at once.
+    """
+
+    def __init__(self, max_concurrent: int = settings.BACKGROUND_WORKERS):
+        self._slots = asyncio.Semaphore(max_concurrent)
+        self._idle = asyncio.Condition()
+        self._queues: dict[int, deque[PostTurnJob]] = {}
+        self._running: dict[int, PostTurnJob] = {}
+        self._tasks: dict[int, asyncio.Task] = {}
+
+    def submit(self, job: PostTurnJob):
+        """Queues a job; starts draining the session's queue if nothing runs for it yet."""
+        queue = self._queues.get(job.session_id)
+        if queue is not None:
+            queue.append(job)
+            return
+        self._queues[job.session_id] = deque([job])
+        self._tasks[job.session_id] = asyncio.create_task(self._drain(job.session_id))
+
+    async def _drain(self, session_id: int):
+        queue = self._queues[session_id]
+        try:
+            while queue:
+                job = queue.popleft()
+                self._running[session_id] = job
+                try:
+                    async with self._slots:
+                        await job.run()
+                except Exception:
+                    logger.exception(
+                        f"Post-turn {job.kind} job failed for session {session_id}, message {job.message_id}"
+                    )
+                finally:
+                    del self._running[session_id]
+                    async with self._idle:
+                        self._idle.notify_all()
+        finally:
+            del self._queues[session_id]
+            del self._tasks[session_id]
+
+    def is_pending(self, session_id: int, message_id: int) -> bool:
+        """Whether any job for the given message is still queued or running."""
+        running = self._running.get(session_id)
+        if running and running.message_id == message_id:
+            return True
+        return any(job.message_id == message_id for job in self._queues.get(session_id, ()))
+
+    async def cancel(self, session_id: int, message_ids: list[int]):
+        """
+        Drops queued jobs for the given messages and waits for the job currently running
+        for the session (if any) to finish, so its writes can be rolled back afterwards.
+        """
+        ids = set(message_ids)
+        queue = self._queues.get(session_id)
+        if queue:
+            kept = [job for job in queue if job.message_id not in ids]
+            if len(kept) != len(queue):
+                logger.info(f"Cancelled {len(queue) - len(kept)} queued post-turn jobs for session {session_id}")
+            queue.clear()
+            queue.extend(kept)
+        async with self._idle:
+            await self._idle.wait_for(lambda: session_id not in self._running)
+
+    async def shutdown(self):
+        """Lets queued jobs finish."""
+        await asyncio.gather(*self._tasks.values(), return_exceptions=True)
+
+post_turn_worker = PostTurnWorker()
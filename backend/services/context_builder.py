@@ -1,53 +1,108 @@
-from sqlmodel import Session, select
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
 
+from config import settings
 from models import ChatMessage, GameSession
+from prompts import get_prompt
+from services.lineage import history_filter, lineage_cache, newest_messages
+from services.llm_tasks import GAME_MASTER
+from services.tokens import estimate_tokens, prompt_budget
+from services.world_state import world_state_cache
+
+# Messages fetched per round trip while filling the history budget
+HISTORY_PAGE_SIZE = 20
+# Tag wrappers around the prompt parts
+PROMPT_OVERHEAD_TOKENS = 40
 
 
 class ContextBuilder:
-    def __init__(self, db: Session):
+    def __init__(self, db: AsyncSession):
         self.db = db
 
-    def build_context(self, session: GameSession) -> dict:
-        """Constructs the context for the LLM as structured data."""
+    async def build_context(self, session: GameSession, player_action: str = "", language: str = "en") -> dict:
+        """
+        Constructs the context for the LLM as structured data, packed into the model's token budget:
+        summary first, then journal sections (up to WORLD_STATE_TOKEN_SHARE of the budget), then as
+        much recent history as still fits.
+        Besides the rendered prompt parts, the parts are returned separately for chat mode,
+        where the history is a list of chat messages.
+        """
         world_state_parts = []
+        budget = prompt_budget(GAME_MASTER) - PROMPT_OVERHEAD_TOKENS
+        budget -= estimate_tokens(get_prompt("game_master", language)) + estimate_tokens(player_action)
         
         # Add Session Summary if exists
         if session.summary:
             world_state_parts.append(f"SUMMARY:\n{session.summary}")
+            budget -= estimate_tokens(world_state_parts[0])
         
-        # Add Character Info (from journal entries)
-        characters = [j for j in session.journal_entries if j.entry_type == "character"]
-        if characters:
-            chars_desc = "\n".join([f"- {c.title}: {c.content}" for c in characters])
-            world_state_parts.append(f"CHARACTERS:\n{chars_desc}")
-
-        # Add Active Quests (Journal)
-        active_quests = [j for j in session.journal_entries if j.entry_type == "quest"]
-        if active_quests:
-            quests_desc = "\n".join([f"- {q.title}: {q.content}" for q in active_quests])
-            world_state_parts.append(f"ACTIVE QUESTS:\n{quests_desc}")
-        
-        # Add Lore
-        lore_entries = [j for j in session.journal_entries if j.entry_type == "lore"]
-        if lore_entries:
-            lore_desc = "\n".join([f"- {lore.title}: {lore.content}" for lore in lore_entries])
-            world_state_parts.append(f"WORLD LORE:\n{lore_desc}")
-
-        # Build Recent Chat History (Limit to last 10 messages to fit context)
-        recent_messages = self.db.exec(
-            select(ChatMessage)
-            .where(ChatMessage.session_id == session.id)
-            .order_by(ChatMessage.timestamp.desc())  # type: ignore[attr-defined]
-            .limit(10)
-        ).all()
-        
-        # Reverse back to chronological order
-        recent_messages = recent_messages[::-1]
+        # Add Characters, Active Quests and Lore (from journal entries), rendered once per journal change;
+        # large journals are narrowed to the entries relevant to the action
+        world_state = await world_state_cache.get(self.db, session.id)  # type: ignore[arg-type]
+        sections = world_state.sections(
+            max_tokens=max(int(budget * settings.WORLD_STATE_TOKEN_SHARE), 0), query=player_action
+        )
+        world_state_parts.extend(sections)
+        budget -= sum(estimate_tokens(section) for section in sections)
+
+        # Build Recent Chat History with whatever budget is left
+        if settings.OLLAMA_CHAT_MODE:
+            recent_messages = await self._unsummarized_messages(session, budget)
+        else:
+            # Reverse back to chronological order
+            recent_messages = (await self._recent_messages(session.id, budget))[::-1]  # type: ignore[arg-type]
         
         # Format conversation history
         history_text = "\n".join([f"{m.role.upper()}: {m.content}" for m in recent_messages])
+        history = [{"role": m.role, "content": m.content} for m in recent_messages]
+        if history and history[-1]["role"] == "user" and history[-1]["content"] == player_action:
+            # The current action is sent separately, together with the world state
+            history.pop()
 
         return {
             "world_state": "\n\n".join(world_state_parts) if world_state_parts else "No world state yet.",
-            "conversation_history": history_text if history_text else "This is the start of the game."
+            "conversation_history": history_text if history_text else "This is the start of the game.",
+            "summary": session.summary,
+            "journal": "\n\n".join(sections) if sections else "No world state yet.",
+            "history": history,
         }
+
+    async def _unsummarized_messages(self, session: GameSession, budget: int) -> list[ChatMessage]:
+        """
+        Chronological messages after the summary watermark. Unlike a sliding window, this
+        list only grows between summarizations, keeping the chat prompt prefix stable.
+        Falls back to the newest messages that fit if the whole tail doesn't.
+        """
+        lineage = await lineage_cache.get(self.db, session.id)  # type: ignore[arg-type]
+        messages = (await self.db.exec(
+            select(ChatMessage)
+            .where(history_filter(lineage))
+            .where(ChatMessage.id > (session.summarized_up_to_id or 0))  # type: ignore[operator]
+            .order_by(ChatMessage.id)  # type: ignore[arg-type]
+            .limit(HISTORY_PAGE_SIZE * 2)
+        )).all()
+        cost = sum((m.token_count or estimate_tokens(m.content)) + 3 for m in messages)
+        if len(messages) < HISTORY_PAGE_SIZE * 2 and cost <= budget:
+            return list(messages)
+        return (await self._recent_messages(session.id, budget))[::-1]  # type: ignore[arg-type]
+
+    async def _recent_messages(self, session_id: int, budget: int) -> list[ChatMessage]:
+        """Newest-first messages whose cached token counts fit into the budget, forked-from history included."""
+        lineage = await lineage_cache.get(self.db, session_id)
+        messages: list[ChatMessage] = []
+        before_id: int | None = None
+        while budget > 0:
+            page = await newest_messages(self.db, lineage, HISTORY_PAGE_SIZE, before_id=before_id)
+
+            for message in page:
+                # Role prefix and newline on top of the content
+                cost = (message.token_count or estimate_tokens(message.content)) + 3
+                if cost > budget:
+                    return messages
+                messages.append(message)
+                budget -= cost
+
+            if len(page) < HISTORY_PAGE_SIZE:
+                break
+            before_id = page[-1].id
+        return messages
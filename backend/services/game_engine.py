@@ -1,162 +1,651 @@
+import asyncio
 import logging
+from collections.abc import AsyncIterator
 from datetime import datetime
+from typing import Any
 
-from sqlmodel import Session, select
+from sqlalchemy import case, delete, insert, or_, update
+from sqlmodel import col, func, select
+from sqlmodel.ext.asyncio.session import AsyncSession
 
 from config import settings
-from models import ChatMessage, GameSession, JournalEntry, StateChangeLog
+from database import lock_for_write, new_session
+from models import ChatMessage, GameSession, JournalCheckpoint, JournalEntry, StateChangeLog
+from services.background import PostTurnJob, post_turn_worker
 from services.context_builder import ContextBuilder
 from services.journal_manager import JournalManager
-from services.llm import ollama_service
+from services.lineage import history_filter, in_history, lineage_cache, newest_messages
+from services.llm import GenerationStats, affinity_key, ollama_service, request_deadline
+from services.metrics import stage_timings, timed_stage
+from services.redo import RedoStep, redo_stack
+from services.tokens import estimate_tokens
+from services.turns import turn_registry
+from services.versions import session_versions
+from services.world_state import world_state_cache
 
 logger = logging.getLogger(__name__)
 
 class GameEngine:
-    def __init__(self, db: Session):
+    def __init__(self, db: AsyncSession):
         self.db = db
         self.context_builder = ContextBuilder(db)
         self.journal_manager = JournalManager(db)
 
-    def process_action(self, session_id: int, user_input: str, language: str = "en") -> str:
+    async def process_action(
+        self, session_id: int, user_input: str, language: str = "en", timeout: float | None = None
+    ) -> ChatMessage:
         """
         Main game loop:
         1. Get session and context.
         2. Append user message to DB.
         3. Construct prompt.
         4. Get LLM response.
-        5. Parse response for journal updates.
-        6. Append AI message to DB.
-        7. Check for summarization.
+        5. Append AI message to DB.
+        6. Queue journal update and summarization in the background.
+        With SINGLE_CALL_TURNS, step 4 also returns the journal delta, which is applied
+        right away instead of running a separate extraction.
+        LLM calls of the turn must finish within `timeout` seconds (TURN_TIMEOUT by default);
+        if the turn fails or is cancelled before the reply is saved, the user message is removed.
+        Returns the saved AI message.
         """
-        session = self.db.get(GameSession, session_id)
+        session, context, user_msg = await self._start_turn(session_id, user_input, language, timeout)
+
+        # 3. Generate Response
+        stats = GenerationStats()
+        journal_updates = None
+        try:
+            with timed_stage("generation"):
+                if settings.SINGLE_CALL_TURNS:
+                    ai_response_text, journal_updates = await ollama_service.agenerate_structured_turn(
+                        context, user_input, language=language, stats=stats
+                    )
+                else:
+                    ai_response_text = await ollama_service.agenerate_turn(
+                        context, user_input, language=language, stats=stats
+                    )
+        except BaseException:
+            await self._abandon_turn(user_msg)
+            raise
+
+        return await self._finish_turn(
+            session, user_input, ai_response_text, language=language, stats=stats, journal_updates=journal_updates
+        )
+
+    async def process_action_stream(
+        self, session_id: int, user_input: str, language: str = "en", timeout: float | None = None
+    ) -> AsyncIterator[str | ChatMessage]:
+        """
+        Streaming variant of process_action.
+        The session lookup and user message are handled eagerly, so a missing session
+        raises ValueError here rather than in the middle of the stream. The returned
+        iterator yields response chunks as the LLM produces them and, once the generation
+        is complete, finishes the turn and yields the saved AI message as its last item.
+        Closing the iterator early aborts the generation and removes the user message.
+        """
+        session, context, user_msg = await self._start_turn(session_id, user_input, language, timeout)
+
+        stats = GenerationStats()
+        chunks = ollama_service.astream_turn(context, user_input, language=language, stats=stats)
+
+        async def stream() -> AsyncIterator[str | ChatMessage]:
+            parts = []
+            try:
+                with timed_stage("generation"):
+                    async for chunk in chunks:
+                        parts.append(chunk)
+                        yield chunk
+            except BaseException:
+                # Leaving the upstream stream here also closes its connection, so Ollama stops generating
+                await chunks.aclose()  # type: ignore[attr-defined]
+                await self._abandon_turn(user_msg)
+                raise
+            yield await self._finish_turn(session, user_input, "".join(parts), language=language, stats=stats)
+
+        return stream()
+
+    async def _start_turn(
+        self, session_id: int, user_input: str, language: str, timeout: float | None = None
+    ) -> tuple[GameSession, dict, ChatMessage]:
+        """Saves the user message and builds the LLM context for it."""
+        session = await self.db.get(GameSession, session_id)
         if not session:
             raise ValueError("Session not found")
+        # A new move makes the undone ones unreachable
+        redo_stack.clear(session_id)
+        # Keep this session's LLM calls (including its background jobs) on one host
+        affinity_key.set(session_id)
+        request_deadline.set(asyncio.get_running_loop().time() + (timeout or settings.TURN_TIMEOUT))
 
         # 1. Save User Message
-        user_msg = ChatMessage(session_id=session_id, role="user", content=user_input)
+        user_msg = ChatMessage(
+            session_id=session_id, role="user", content=user_input, token_count=estimate_tokens(user_input)
+        )
         self.db.add(user_msg)
-        self.db.commit()
+        with timed_stage("db_commit"):
+            await self.db.commit()
+        session_versions.bump(session_id)
 
         # 2. Build Context
-        context = self.context_builder.build_context(session)
+        with timed_stage("context"):
+            context = await self.context_builder.build_context(session, player_action=user_input, language=language)
+        # End the read transaction so the connection goes back to the pool during generation
+        await self.db.commit()
+        return session, context, user_msg
 
-        # 3. Generate Response
-        ai_response_text = ollama_service.generate_response(
-            player_action=user_input,
-            world_state=context["world_state"],
-            conversation_history=context["conversation_history"],
-            language=language
-        )
+    async def _abandon_turn(self, user_msg: ChatMessage):
+        """Removes the user message of a turn that ended without a reply."""
+        logger.info(f"Turn for session {user_msg.session_id} ended without a reply, removing user message")
+        await self.db.rollback()
+        await self.db.delete(user_msg)
+        await self.db.commit()
+        session_versions.bump(user_msg.session_id)
+
+    async def _finish_turn(
+        self,
+        session: GameSession,
+        user_input: str,
+        ai_response_text: str,
+        language: str = "en",
+        stats: GenerationStats | None = None,
+        journal_updates: dict | None = None
+    ) -> ChatMessage:
+        """
+        Saves the AI message and queues the post-turn journal and summary steps.
+        Journal updates that came with the reply are applied directly instead.
+        """
+        session_id = session.id
+        assert session_id is not None
 
         # 4. Save AI Message
-        ai_msg = ChatMessage(session_id=session_id, role="assistant", content=ai_response_text)
+        ai_msg = ChatMessage(
+            session_id=session_id,
+            role="assistant",
+            content=ai_response_text,
+            token_count=estimate_tokens(ai_response_text),
+            prompt_eval_count=stats.prompt_eval_count if stats else None
+        )
+        if stats and stats.prompt_eval_count is not None:
+            logger.info(f"Session {session_id}: GM prompt evaluated {stats.prompt_eval_count} tokens")
         self.db.add(ai_msg)
-        self.db.commit()
+        with timed_stage("db_commit"):
+            await self.db.commit()
+        session_versions.bump(session_id)
 
-        # 5. Update Journal/World State (Async or Sync)
-        self.journal_manager.update_world_state(session, user_input, ai_response_text, ai_msg, language=language)
+        # 5. Update Journal/World State and 6. Check for Summarization, in order, off the request path
+        message_id = ai_msg.id
+        assert message_id is not None
+        if journal_updates is not None:
+            await self.journal_manager.apply_updates(session, ai_msg, journal_updates)
+        else:
+            post_turn_worker.submit(PostTurnJob(
+                session_id, message_id, "journal",
+                lambda: _run_with_engine(
+                    lambda eng: eng._update_journal(session_id, message_id, user_input, ai_response_text, language)
+                )
+            ))
+        post_turn_worker.submit(PostTurnJob(
+            session_id, message_id, "summary",
+            lambda: _run_with_engine(lambda eng: eng._summarize(session_id, message_id, language))
+        ))
+        return ai_msg
 
-        # 6. Check for Summarization
-        self._check_summarization(session, language=language)
+    async def _update_journal(
+        self, session_id: int, message_id: int, user_input: str, ai_response_text: str, language: str
+    ):
+        """Background step: extracts journal updates for a saved AI message."""
+        affinity_key.set(session_id)
+        # Runs after the reply is saved, so the turn's deadline doesn't apply (and its timings are sent)
+        request_deadline.set(None)
+        stage_timings.set(None)
+        session = await self.db.get(GameSession, session_id)
+        ai_msg = await self.db.get(ChatMessage, message_id)
+        if not session or not ai_msg:
+            # The turn was undone (or the session deleted) before the job ran
+            return
+        await self.journal_manager.update_world_state(session, user_input, ai_response_text, ai_msg, language=language)
 
-        return ai_response_text
+    async def _summarize(self, session_id: int, message_id: int, language: str):
+        """
+        Background step: runs the summarization check for a session after a saved AI message,
+        then checkpoints. It is the turn's last step, so the checkpoint has both its journal
+        changes and its summary.
+        """
+        affinity_key.set(session_id)
+        request_deadline.set(None)
+        stage_timings.set(None)
+        session = await self.db.get(GameSession, session_id)
+        if not session or not await self.db.get(ChatMessage, message_id):
+            # The turn was undone (or the session deleted) before the job ran
+            return
+        await self._check_summarization(session, language=language)
+        await self._checkpoint_if_due(session_id, message_id)
+
+    def is_journal_pending(self, session_id: int, message_id: int) -> bool:
+        """Whether post-turn processing for the given message is still queued or running."""
+        return post_turn_worker.is_pending(session_id, message_id)
 
-    def _check_summarization(self, session: GameSession, language: str = "en"):
+    async def _check_summarization(self, session: GameSession, language: str = "en"):
         """Checks if we need to summarize the history."""
-        # Simple logic: Summarize every N messages
-        # Or check token count (more complex)
-        
-        count = self.db.exec(
-            select(ChatMessage).where(ChatMessage.session_id == session.id)
-        ).all()
-        
-        if len(count) > 0 and len(count) % settings.SUMMARY_THRESHOLD == 0:
+        # Summarize every N messages past the watermark. Only the unsummarized tail is
+        # counted and fetched, so the cost doesn't grow with the length of the campaign.
+        watermark = session.summarized_up_to_id or 0
+        history = history_filter(await lineage_cache.get(self.db, session.id))  # type: ignore[arg-type]
+        unsummarized = (await self.db.exec(
+            select(func.count())
+            .select_from(ChatMessage)
+            .where(history)
+            .where(ChatMessage.id > watermark)  # type: ignore[operator]
+        )).one()
+
+        if unsummarized >= settings.SUMMARY_THRESHOLD:
             # Trigger summarization
-            # Get the last N messages to add to summary
-            recent_msgs = count[-settings.SUMMARY_THRESHOLD:]
+            # Get the next N messages to add to summary
+            recent_msgs = (await self.db.exec(
+                select(ChatMessage)
+                .where(history)
+                .where(ChatMessage.id > watermark)  # type: ignore[operator]
+                .order_by(ChatMessage.id)  # type: ignore[arg-type]
+                .limit(settings.SUMMARY_THRESHOLD)
+            )).all()
             recent_text = "\n".join([f"{m.role}: {m.content}" for m in recent_msgs])
+            await self.db.commit()  # release the connection while the LLM runs
             
             # Replace old summary with new consolidated one that includes previous summary + recent events
-            new_summary = ollama_service.summarize_context(
-                recent_text, 
-                previous_summary=session.summary,
-                language=language
-            )
+            with timed_stage("summarize"):
+                new_summary = await ollama_service.asummarize_context(
+                    recent_text,
+                    previous_summary=session.summary,
+                    language=language
+                )
             
+            # Keep the previous summary so an undo across the watermark can restore it
+            session.previous_summary = session.summary
+            session.previous_summarized_up_to_id = session.summarized_up_to_id
             session.summary = new_summary
+            session.summarized_up_to_id = recent_msgs[-1].id
             
             self.db.add(session)
-            self.db.commit()
+            with timed_stage("db_commit"):
+                await self.db.commit()
+            session_versions.bump(session.id)  # type: ignore[arg-type]
+
+    async def _checkpoint_if_due(self, session_id: int, message_id: int):
+        """
+        Snapshots the journal and summary after the post-turn steps of an AI message, if
+        JOURNAL_CHECKPOINT_INTERVAL turns have passed since the session's last checkpoint.
+        """
+        last = (await self.db.exec(
+            select(func.max(JournalCheckpoint.message_id)).where(JournalCheckpoint.session_id == session_id)
+        )).one()
+        turns = (await self.db.exec(
+            select(func.count())
+            .select_from(ChatMessage)
+            .where(ChatMessage.session_id == session_id)
+            .where(ChatMessage.id > (last or 0))  # type: ignore[operator]
+            .where(ChatMessage.id <= message_id)  # type: ignore[operator]
+            .where(ChatMessage.role == "assistant")
+        )).one()
+        if turns < settings.JOURNAL_CHECKPOINT_INTERVAL:
+            return
+        session = await self.db.get(GameSession, session_id)
+        if not session:
+            return
+        entries = (await self.db.exec(select(JournalEntry).where(JournalEntry.session_id == session_id))).all()
+        self.db.add(JournalCheckpoint(
+            session_id=session_id,
+            message_id=message_id,
+            summary=session.summary,
+            summarized_up_to_id=session.summarized_up_to_id,
+            entries=[_entry_state(entry) for entry in entries],
+        ))
+        await self.db.commit()
 
-    def undo_last_move(self, session_id: int):
+    async def undo_moves(self, session_id: int, steps: int = 1) -> int:
         """
-        Undoes the last move by deleting the last user message and all subsequent messages.
-        Note: This does not currently revert Journal/Character changes.
+        Undoes the last `steps` moves by deleting their user messages and all subsequent messages.
+        Journal changes logged for these messages are reverted, and their pending post-turn jobs
+        are cancelled. Returns the number of moves undone.
+        The journal revert is worked out in memory and written in bulk: every touched entry goes
+        back to the state recorded by its earliest change log among the undone messages. Undos of
+        up to REDO_MAX_TURNS moves start from the current journal and can be redone; deeper ones
+        start from the first checkpoint after the rewind point, so only the change logs up to that
+        checkpoint are read.
         """
-        # Find the last user message
-        last_user_msg = self.db.exec(
-            select(ChatMessage)
+        # Messages that forks of this session share stay
+        fork_point = (await self.db.exec(
+            select(func.max(GameSession.fork_message_id)).where(GameSession.parent_id == session_id)
+        )).one()
+        user_ids = (await self.db.exec(
+            select(ChatMessage.id)
             .where(ChatMessage.session_id == session_id)
             .where(ChatMessage.role == "user")
-            .order_by(ChatMessage.timestamp.desc())  # type: ignore[attr-defined]
-            .limit(1)
-        ).first()
+            .where(ChatMessage.id > (fork_point or 0))  # type: ignore[operator]
+            .order_by(ChatMessage.id.desc())  # type: ignore[union-attr]
+            .limit(steps)
+        )).all()
+        if not user_ids:
+            return 0
+        # Everything from the oldest undone user message (the last, newest first) on goes; ids,
+        # unlike timestamps, can't tie
+        cutoff = user_ids[-1]
+        assert cutoff is not None
+        redoable = len(user_ids) <= settings.REDO_MAX_TURNS
 
-        if not last_user_msg:
-            return False
+        removed = select(ChatMessage).where(ChatMessage.session_id == session_id).where(col(ChatMessage.id) >= cutoff)
+        messages = (await self.db.exec(removed.order_by(ChatMessage.id))).all() if redoable else []  # type: ignore[arg-type]
+        msg_ids = [m.id for m in messages] if redoable else list((await self.db.exec(
+            select(ChatMessage.id).where(ChatMessage.session_id == session_id).where(col(ChatMessage.id) >= cutoff)
+        )).all())
 
-        # Delete this message and all subsequent messages
-        msgs_to_delete = self.db.exec(
-            select(ChatMessage)
-            .where(ChatMessage.session_id == session_id)
-            .where(ChatMessage.timestamp >= last_user_msg.timestamp)
-        ).all()
+        # Drop queued post-turn jobs for these messages and let a running one finish,
+        # so everything it logged is reverted below
+        await post_turn_worker.cancel(session_id, msg_ids)  # type: ignore[arg-type]
+
+        current, target, logs = await self._journal_before(session_id, cutoff, from_checkpoint=not redoable)
+        changes: dict[int, dict[str, Any] | None] = {
+            entry_id: None for entry_id in current if entry_id not in target
+        }
+        for entry_id, state in target.items():
+            entry = current.get(entry_id)
+            if entry is None or _entry_state(entry) != state:
+                changes[entry_id] = state
+
+        # Taken before the write, which updates the loaded entries in place
+        before = {
+            entry_id: _entry_state(current[entry_id]) if entry_id in current else None for entry_id in changes
+        }
+        session = await self.db.get(GameSession, session_id)
+        summary = _summary_state(session) if session else {}
+        await lock_for_write(self.db)
+        restored = await self._apply_journal_changes(session_id, current, changes)
+        await self.db.exec(  # type: ignore[call-overload]
+            delete(StateChangeLog)
+            .where(col(StateChangeLog.session_id) == session_id)
+            .where(col(StateChangeLog.message_id) >= cutoff)
+        )
+        await self.db.exec(  # type: ignore[call-overload]
+            delete(JournalCheckpoint)
+            .where(col(JournalCheckpoint.session_id) == session_id)
+            .where(col(JournalCheckpoint.message_id) >= cutoff)
+        )
+        await self.db.exec(  # type: ignore[call-overload]
+            delete(ChatMessage).where(col(ChatMessage.session_id) == session_id).where(col(ChatMessage.id) >= cutoff)
+        )
+        if restored:
+            await self._remap_entries(session_id, restored)
+
+        # If summarized messages are removed, fall back to a summary that doesn't cover them
+        if session and session.summarized_up_to_id and session.summarized_up_to_id >= cutoff:
+            session.summary, session.summarized_up_to_id = await self._summary_before(session, cutoff)
+            session.previous_summary = None
+            session.previous_summarized_up_to_id = None
+            self.db.add(session)
 
-        # Collect IDs of messages to be deleted
-        msg_ids = [m.id for m in msgs_to_delete]
+        await self.db.commit()
+        world_state_cache.invalidate(session_id)
+        session_versions.bump(session_id)
+        # A retry of the undone action should run again rather than return the deleted reply
+        turn_registry.forget(session_id, msg_ids)  # type: ignore[arg-type]
+        if redoable:
+            step = RedoStep(
+                turns=len(user_ids),
+                messages=[message.model_dump(exclude={"session"}) for message in messages],
+                logs=[log.model_dump() for log in logs],
+                journal=before,
+                summary=summary,
+            )
+            step.remap({}, restored)
+            redo_stack.push(session_id, step)
+        else:
+            redo_stack.clear(session_id)
+        return len(user_ids)
 
-        # Fetch StateChangeLogs for these messages
-        logs = self.db.exec(
+    async def _journal_before(
+        self, session_id: int, cutoff: int, from_checkpoint: bool
+    ) -> tuple[dict[int, JournalEntry], dict[int, dict[str, Any]], list[StateChangeLog]]:
+        """
+        Works out the session's journal as it was before the changes logged for messages from
+        `cutoff` on. Returns the current entries by id, the states (JSON-mode dumps) of the entries
+        that existed back then by id, and the change logs that were reverted.
+        With `from_checkpoint`, the revert starts from the first checkpoint at or after `cutoff`,
+        if any, so only the change logs up to it are read; all current entries are returned.
+        Otherwise it starts from the current journal, and only entries with reverted changes are.
+        """
+        checkpoint = None if not from_checkpoint else (await self.db.exec(
+            select(JournalCheckpoint)
+            .where(JournalCheckpoint.session_id == session_id)
+            .where(JournalCheckpoint.message_id >= cutoff)
+            .order_by(JournalCheckpoint.message_id)  # type: ignore[arg-type]
+            .limit(1)
+        )).first()
+        logs_query = (
             select(StateChangeLog)
-            .where(StateChangeLog.message_id.in_(msg_ids))  # type: ignore[attr-defined]
-            .order_by(StateChangeLog.id.desc())  # type: ignore[attr-defined, union-attr]
-        ).all()
+            .where(StateChangeLog.session_id == session_id)
+            .where(StateChangeLog.message_id >= cutoff)
+        )
+        if checkpoint is not None:
+            logs_query = logs_query.where(StateChangeLog.message_id <= checkpoint.message_id)
+        logs = (await self.db.exec(logs_query.order_by(StateChangeLog.id))).all()  # type: ignore[arg-type]
 
-        # Revert changes
-        for log in logs:
+        entries_query = select(JournalEntry).where(JournalEntry.session_id == session_id)
+        if not from_checkpoint:
+            # Only entries with reverted changes can differ from their current state
+            entries_query = entries_query.where(JournalEntry.id.in_({log.entity_id for log in logs}))  # type: ignore[union-attr]
+        current = {entry.id: entry for entry in (await self.db.exec(entries_query)).all()}
+        if checkpoint is not None:
+            target = {state["id"]: state for state in checkpoint.entries}
+        else:
+            target = {entry_id: _entry_state(entry) for entry_id, entry in current.items()}
+        # Newest first, so every entry ends up in the state logged before its first reverted change
+        for log in reversed(logs):
             if log.operation == "create":
-                # Undo create -> delete
-                entity = self.db.get(JournalEntry, log.entity_id)
-                if entity:
-                    self.db.delete(entity)
-            
-            elif log.operation == "update":
-                # Undo update -> restore previous state
-                entity = self.db.get(JournalEntry, log.entity_id)
-                if entity and log.previous_state:
-                    for key, value in log.previous_state.items():
-                        if key == "created_at":
-                            value = datetime.fromisoformat(value)
-                        setattr(entity, key, value)
-                    self.db.add(entity)
-            
-            elif log.operation == "delete":
-                # Undo delete -> recreate
-                if log.previous_state:
-                    # Add session_id back as it might not be in previous_state
-                    data = log.previous_state.copy()
-                    data["session_id"] = session_id
-                    if "created_at" in data:
-                        data["created_at"] = datetime.fromisoformat(data["created_at"])
-                    
-                    new_entry = JournalEntry(**data)
-                    self.db.add(new_entry)
-            
-            # Delete the log entry
-            self.db.delete(log)
-
-        for msg in msgs_to_delete:
-            self.db.delete(msg)
-        
-        self.db.commit()
-        return True
+                target.pop(log.entity_id, None)
+            elif log.previous_state:
+                target[log.entity_id] = log.previous_state
+        return current, target, list(logs)  # type: ignore[return-value]
+
+    async def _summary_before(self, session: GameSession, cutoff: int) -> tuple[str | None, int | None]:
+        """The latest summary of the session (and its watermark) not covering messages from `cutoff` on."""
+        if session.summarized_up_to_id is None or session.summarized_up_to_id < cutoff:
+            return session.summary, session.summarized_up_to_id
+        if session.previous_summarized_up_to_id is not None and session.previous_summarized_up_to_id < cutoff:
+            return session.previous_summary, session.previous_summarized_up_to_id
+        # Rewinding past more than one summarization, or past the only one kept since an earlier
+        # undo (which drops the previous summary): take the summary of the last checkpoint before.
+        # A lagging summary job may have summarized past its own message, hence the watermark check
+        checkpoint = (await self.db.exec(
+            select(JournalCheckpoint)
+            .where(JournalCheckpoint.session_id == session.id)
+            .where(JournalCheckpoint.message_id < cutoff)
+            .where(or_(
+                col(JournalCheckpoint.summarized_up_to_id).is_(None),
+                col(JournalCheckpoint.summarized_up_to_id) < cutoff,
+            ))
+            .order_by(JournalCheckpoint.message_id.desc())  # type: ignore[attr-defined]
+            .limit(1)
+        )).first()
+        if checkpoint is None:
+            return None, None
+        return checkpoint.summary, checkpoint.summarized_up_to_id
+
+    async def _apply_journal_changes(
+        self, session_id: int, current: dict[int, JournalEntry], changes: dict[int, dict[str, Any] | None]
+    ) -> dict[int, int]:
+        """
+        Sets journal entries of the session to the given states (JSON-mode dumps; None deletes the
+        entry) with one bulk DELETE, INSERT and UPDATE. `current` holds the session's entries among
+        them. Entries that no longer exist are restored under new ids, since SQLite may have given
+        their old ones to another entry; returns the new id of each by its old one. The caller
+        holds the write lock.
+        """
+        to_delete = [entry_id for entry_id, state in changes.items() if state is None and entry_id in current]
+        to_insert: dict[int, dict[str, Any]] = {}
+        to_update: list[dict[str, Any]] = []
+        for entry_id, state in changes.items():
+            if state is None:
+                continue
+            values = {**state, "id": entry_id, "session_id": session_id}
+            if "created_at" in values:
+                values["created_at"] = datetime.fromisoformat(values["created_at"])
+            if entry_id in current:
+                to_update.append(values)
+            else:
+                del values["id"]
+                to_insert[entry_id] = values
+        restored: dict[int, int] = {}
+        if to_insert:
+            # Before the delete, so no new id is one the changes refer to
+            new_ids = (await self.db.exec(  # type: ignore[call-overload]
+                insert(JournalEntry).returning(col(JournalEntry.id), sort_by_parameter_order=True),
+                params=list(to_insert.values()),
+            )).scalars().all()
+            restored = dict(zip(to_insert, new_ids, strict=True))
+        if to_delete:
+            await self.db.exec(  # type: ignore[call-overload]
+                delete(JournalEntry)
+                .where(col(JournalEntry.session_id) == session_id)
+                .where(col(JournalEntry.id).in_(to_delete))
+            )
+        if to_update:
+            # ORM bulk UPDATE by primary key: one executemany
+            await self.db.exec(update(JournalEntry), params=to_update)  # type: ignore[call-overload]
+        return restored
+
+    async def _remap_entries(self, session_id: int, entry_ids: dict[int, int]):
+        """
+        Points the session's change logs and checkpoints at journal entries restored under new ids
+        (old id -> new id). Only needed when undone moves had deleted entries, so the scan of the
+        change logs by entity is rare.
+        """
+        # One statement, since a new id may equal another entry's old one
+        await self.db.exec(  # type: ignore[call-overload]
+            update(StateChangeLog)
+            .where(col(StateChangeLog.session_id) == session_id)
+            .where(col(StateChangeLog.entity_id).in_(list(entry_ids)))
+            .values(entity_id=case(entry_ids, value=col(StateChangeLog.entity_id)))
+        )
+        checkpoints = (await self.db.exec(
+            select(JournalCheckpoint).where(JournalCheckpoint.session_id == session_id)
+        )).all()
+        for checkpoint in checkpoints:
+            if any(state["id"] in entry_ids for state in checkpoint.entries):
+                checkpoint.entries = [
+                    {**state, "id": entry_ids.get(state["id"], state["id"])} for state in checkpoint.entries
+                ]
+                self.db.add(checkpoint)
+
+    async def fork_session(
+        self, session_id: int, message_id: int | None = None, name: str | None = None
+    ) -> GameSession:
+        """
+        Creates a session that continues from `message_id` of the given session's history
+        (default: its latest message). The fork references the shared history instead of copying
+        it; only the journal as of that message is copied, since both sessions go on to change it,
+        and saved as the fork's first checkpoint along with the summary.
+        Raises ValueError if the session doesn't exist or the message isn't part of its history.
+        """
+        parent = await self.db.get(GameSession, session_id)
+        if not parent:
+            raise ValueError("Session not found")
+        lineage = await lineage_cache.get(self.db, session_id)
+        if message_id is None:
+            message = next(iter(await newest_messages(self.db, lineage, 1)), None)
+        else:
+            message = await self.db.get(ChatMessage, message_id)
+        if message is None or not in_history(lineage, message):
+            raise ValueError("Message not found in the session's history")
+
+        # Fork from the session that owns the message, which may be an ancestor
+        owner = parent if message.session_id == parent.id else await self.db.get(GameSession, message.session_id)
+        _, target, _ = await self._journal_before(owner.id, message.id + 1, from_checkpoint=True)  # type: ignore[union-attr, arg-type, operator]
+        summary, summarized_up_to_id = await self._summary_before(owner, message.id + 1)  # type: ignore[arg-type, operator]
+
+        fork = GameSession(
+            name=name or f"{parent.name} (fork)",
+            start_prompt=parent.start_prompt,
+            summary=summary,
+            summarized_up_to_id=summarized_up_to_id,
+            parent_id=owner.id,  # type: ignore[union-attr]
+            fork_message_id=message.id,
+        )
+        self.db.add(fork)
+        await self.db.flush()
+        rows = [
+            JournalEntry.model_validate({**state, "session_id": fork.id}).model_dump(exclude={"id", "session"})
+            for state in target.values()
+        ]
+        if rows:
+            await self.db.exec(insert(JournalEntry), params=rows)  # type: ignore[call-overload]
+        entries = (await self.db.exec(select(JournalEntry).where(JournalEntry.session_id == fork.id))).all()
+        self.db.add(JournalCheckpoint(
+            session_id=fork.id,  # type: ignore[arg-type]
+            message_id=message.id,  # type: ignore[arg-type]
+            summary=summary,
+            summarized_up_to_id=summarized_up_to_id,
+            entries=[_entry_state(entry) for entry in entries],
+        ))
+        await self.db.commit()
+        return fork
+
+    async def redo_moves(self, session_id: int) -> int:
+        """
+        Plays back the session's most recent undo: its messages, journal changes, change logs and
+        summary are restored. Returns the number of moves redone, 0 if there is nothing to redo.
+        """
+        step = redo_stack.pop(session_id)
+        if step is None:
+            return 0
+        session = await self.db.get(GameSession, session_id)
+        if not session:
+            return 0
+
+        # Messages and re-created journal entries get new ids, since the old ones may have been
+        # reused; the logs and summary of this step and of the steps still to redo follow
+        messages = [ChatMessage(**{k: v for k, v in m.items() if k != "id"}) for m in step.messages]
+        self.db.add_all(messages)
+        await self.db.flush()
+        new_ids: dict[int, int] = {
+            old["id"]: message.id for old, message in zip(step.messages, messages, strict=True)  # type: ignore[misc]
+        }
+
+        current = {
+            entry.id: entry
+            for entry in (await self.db.exec(
+                select(JournalEntry)
+                .where(JournalEntry.session_id == session_id)
+                .where(col(JournalEntry.id).in_(list(step.journal)))
+            )).all()
+        }
+        restored = await self._apply_journal_changes(session_id, current, step.journal)  # type: ignore[arg-type]
+        step.remap(new_ids, restored)
+        redo_stack.remap(session_id, new_ids, restored)
+        if step.logs:
+            await self.db.exec(insert(StateChangeLog), params=[  # type: ignore[call-overload]
+                {**{k: v for k, v in log.items() if k != "id"}, "message_id": new_ids[log["message_id"]]}
+                for log in step.logs
+            ])
+
+        for key, value in step.summary.items():
+            setattr(session, key, value)
+        self.db.add(session)
+        await self.db.commit()
+        world_state_cache.invalidate(session_id)
+        session_versions.bump(session_id)
+        return step.turns
+
+def _entry_state(entry: JournalEntry) -> dict[str, Any]:
+    """Journal entry as stored in change logs and checkpoints."""
+    return entry.model_dump(mode='json', exclude={'session'})
+
+def _summary_state(session: GameSession) -> dict[str, Any]:
+    return {
+        "summary": session.summary,
+        "summarized_up_to_id": session.summarized_up_to_id,
+        "previous_summary": session.previous_summary,
+        "previous_summarized_up_to_id": session.previous_summarized_up_to_id,
+    }
+
+async def _run_with_engine(fn):
+    """Runs a background step with its own DB session, since request sessions are closed by then."""
+    async with new_session() as db:
+        await fn(GameEngine(db))
@@ -1,15 +1,23 @@
+from collections.abc import Sequence
+from datetime import datetime
 from typing import Any
 
-from sqlmodel import Session, select
+from sqlalchemy import insert
+from sqlmodel import col, select
+from sqlmodel.ext.asyncio.session import AsyncSession
 
+from database import lock_for_write
 from models import ChatMessage, GameSession, JournalEntry, StateChangeLog
+from services.metrics import timed_stage
+from services.versions import session_versions
+from services.world_state import world_state_cache
 
 
 class JournalManager:
-    def __init__(self, db: Session):
+    def __init__(self, db: AsyncSession):
         self.db = db
 
-    def update_world_state(
+    async def update_world_state(
         self, 
         session: GameSession, 
         user_input: str, 
@@ -20,37 +28,51 @@ class JournalManager:
         """Extracts updates and saves them to Journal/Characters."""
         from services.llm import ollama_service
         
-        # Serialize current state for LLM
-        serialized_state = self._serialize_state(session)
+        with timed_stage("journal_extract"):
+            # Serialize current state for LLM, limited to entries relevant to this turn
+            serialized_state = await self._serialize_state(session, f"{user_input}\n{ai_response_text}")
+            # Release the connection while the LLM runs
+            await self.db.commit()
 
-        updates = ollama_service.extract_journal_updates(
-            user_input, ai_response_text, serialized_state, language=language
-        )
-        
+            updates = await ollama_service.aextract_journal_updates(
+                user_input, ai_response_text, serialized_state, language=language
+            )
+        await self.apply_updates(session, ai_msg, updates)
+
+    async def apply_updates(self, session: GameSession, ai_msg: ChatMessage, updates: dict[str, Any]):
+        """
+        Applies extracted journal updates ("quests", "lore", "characters" lists) and commits.
+        The session's entries are loaded once and all operations are resolved in memory,
+        then written together with their change logs in a few bulk statements.
+        """
         # Process each type - all are JournalEntry now!
-        self._process_items(session, ai_msg, updates.get("quests", []), "quest")
-        self._process_items(session, ai_msg, updates.get("lore", []), "lore")
-        self._process_items(session, ai_msg, updates.get("characters", []), "character")
-            
-        self.db.commit()
+        try:
+            with timed_stage("journal_apply"):
+                entries = (await self.db.exec(
+                    select(JournalEntry).where(JournalEntry.session_id == session.id)
+                )).all()
+                changes = _PendingChanges(entries)
+                self._process_items(changes, session, updates.get("quests", []), "quest")
+                self._process_items(changes, session, updates.get("lore", []), "lore")
+                self._process_items(changes, session, updates.get("characters", []), "character")
 
-    def _serialize_state(self, session: GameSession) -> dict[str, Any]:
+                await self._write(changes, ai_msg)
+                await self.db.commit()
+            session_versions.bump(session.id)  # type: ignore[arg-type]
+        except Exception:
+            # The cache was patched for changes that never made it to the database
+            world_state_cache.invalidate(session.id)  # type: ignore[arg-type]
+            raise
+
+    async def _serialize_state(self, session: GameSession, query: str = "") -> dict[str, Any]:
         """Serialize game state for LLM."""
-        quests = [j for j in session.journal_entries if j.entry_type == "quest"]
-        lore = [j for j in session.journal_entries if j.entry_type == "lore"]
-        characters = [j for j in session.journal_entries if j.entry_type == "character"]
-        
-        return {
-            "summary": session.summary or "",
-            "quests": [{"name": q.title, "description": q.content} for q in quests],
-            "lore": [{"name": l.title, "description": l.content} for l in lore],
-            "characters": [{"name": c.title, "description": c.content} for c in characters]
-        }
+        world_state = await world_state_cache.get(self.db, session.id)  # type: ignore[arg-type]
+        return world_state.serialize(session.summary, query)
 
     def _process_items(
         self,
+        changes: "_PendingChanges",
         session: GameSession,
-        ai_msg: ChatMessage,
         items: list[dict[str, Any]],
         entry_type: str
     ):
@@ -59,12 +81,12 @@ class JournalManager:
             operation = item.get("operation", "add")
             name = item.get("name", item.get("key"))
             description = item.get("description", item.get("value"))
-            
-            if not name:
+
+            if not isinstance(name, str) or not name.strip():
                 continue
 
-            existing = self._find_existing(session, name, entry_type)
-            
+            existing = changes.find(entry_type, name)
+
             # Normalize operation
             if existing and operation == "add":
                 operation = "update"
@@ -72,106 +94,114 @@ class JournalManager:
                 operation = "add"
 
             if operation == "add" and not existing:
-                self._create_entry(session, ai_msg, name, description or "", entry_type)
+                changes.create(JournalEntry(
+                    session_id=session.id,
+                    title=" ".join(name.split()),
+                    content=description or "",
+                    entry_type=entry_type
+                ))
             elif operation == "update" and existing:
-                self._update_entry(session, ai_msg, existing, description or "")
+                changes.update(existing, description or "")
             elif operation == "delete" and existing:
-                self._delete_entry(ai_msg, existing)
+                changes.delete(existing)
 
-    def _find_existing(
-        self,
-        session: GameSession,
-        name: str,
-        entry_type: str
-    ) -> JournalEntry | None:
-        """Find existing journal entry."""
-        return self.db.exec(
-            select(JournalEntry)
-            .where(JournalEntry.session_id == session.id)
-            .where(JournalEntry.title == name)
-            .where(JournalEntry.entry_type == entry_type)
-        ).first()
-
-    def _create_entry(
-        self,
-        session: GameSession,
-        ai_msg: ChatMessage,
-        name: str,
-        description: str,
-        entry_type: str
-    ):
-        """Create new journal entry."""
-        entry = JournalEntry(
-            session_id=session.id,
-            title=name,
-            content=description,
-            entry_type=entry_type
-        )
-        
-        self.db.add(entry)
-        self.db.flush()
-        
-        self._log_change(session.id, ai_msg, entry.id, "create", None)
+    async def _write(self, changes: "_PendingChanges", ai_msg: ChatMessage):
+        """
+        Writes the resolved changes and their change logs, and patches the world-state cache:
+        one multi-row INSERT for new entries, one executemany each for updates and deletes,
+        and one multi-row INSERT for the logs.
+        """
+        if not (changes.created or changes.updated or changes.deleted):
+            return
+        await lock_for_write(self.db)
+        if changes.created:
+            # Unordered RETURNING lets SQLite take all rows in one statement; names are unique
+            # per type within a batch, so the ids can be matched up by (type, title)
+            rows = await self.db.exec(  # type: ignore[call-overload]
+                insert(JournalEntry).returning(
+                    col(JournalEntry.id), col(JournalEntry.entry_type), col(JournalEntry.title)
+                ),
+                params=[entry.model_dump(exclude={"id", "session"}) for entry in changes.created],
+            )
+            ids = {(entry_type, title): entry_id for entry_id, entry_type, title in rows}
+            for entry in changes.created:
+                entry.id = ids[(entry.entry_type, entry.title)]
+        for entry, _ in changes.deleted:
+            await self.db.delete(entry)
+        await self.db.flush()
 
-    def _update_entry(
-        self,
-        session: GameSession,
+        logs = [self._change_log(ai_msg, entry, "create", None) for entry in changes.created]
+        logs += [self._change_log(ai_msg, entry, "update", state) for entry, state in changes.updated.values()]
+        logs += [self._change_log(ai_msg, entry, "delete", state) for entry, state in changes.deleted]
+        await self.db.exec(insert(StateChangeLog), params=logs)  # type: ignore[call-overload]
+
+        for entry in changes.created:
+            world_state_cache.put(entry)
+        for entry, _ in changes.updated.values():
+            world_state_cache.put(entry)
+        for entry, _ in changes.deleted:
+            world_state_cache.remove(entry.session_id, entry.id)  # type: ignore[arg-type]
+
+    @staticmethod
+    def _change_log(
         ai_msg: ChatMessage,
         entry: JournalEntry,
-        description: str
-    ):
-        """Update existing journal entry."""
-        # Capture previous state using model_dump with JSON mode
-        prev_state = entry.model_dump(mode='json', exclude={'session'})
-        
-        if description:
-            entry.content = description
-        
-        self.db.add(entry)
-        self._log_change(
-            session.id,
-            ai_msg,
-            entry.id,  # type: ignore[arg-type]
-            "update",
-            prev_state
-        )
-
-    def _delete_entry(
-        self,
-        ai_msg: ChatMessage,
-        entry: JournalEntry
-    ):
-        """Delete journal entry."""
-        entry_id = entry.id
-        session_id = entry.session_id
-        
-        # Capture previous state using model_dump with JSON mode
-        prev_state = entry.model_dump(mode='json', exclude={'session'})
-        
-        self.db.delete(entry)
-        self._log_change(
-            session_id,  # type: ignore[arg-type]
-            ai_msg, 
-            entry_id, 
-            "delete", 
-            prev_state
-        )
-
-    def _log_change(
-        self,
-        session_id: int,
-        ai_msg: ChatMessage,
-        entity_id: int | None,
         operation: str,
         previous_state: dict[str, Any] | None
-    ):
-        """Create state change log."""
-        log = StateChangeLog(
-            session_id=session_id,
-            message_id=ai_msg.id,
-            entity_type="journal_entry",
-            entity_id=entity_id,
-            operation=operation,
-            previous_state=previous_state
-        )
-        self.db.add(log)
\ No newline at end of file
+    ) -> dict[str, Any]:
+        """Row of a state change log."""
+        return {
+            "session_id": entry.session_id,
+            "message_id": ai_msg.id,
+            "entity_type": "journal_entry",
+            "entity_id": entry.id,
+            "operation": operation,
+            "previous_state": previous_state,
+            "created_at": datetime.utcnow(),
+        }
+
+
+def _normalize_name(name: str) -> str:
+    """Matching key for entry names, so that "Old  tomas " and "old Tomas" are the same entry."""
+    return " ".join(name.split()).casefold()
+
+
+class _PendingChanges:
+    """
+    Journal operations of one extraction, resolved in memory against the session's entries
+    (indexed by type and normalized name) before anything is written. Each entry gets at most
+    one change log: an entry updated twice keeps the state from before the first update, one
+    created and deleted again in the same batch is never written.
+    """
+
+    def __init__(self, entries: Sequence[JournalEntry]):
+        self.index: dict[tuple[str, str], JournalEntry] = {}
+        for entry in entries:
+            # Near-duplicates written before names were normalized: the oldest one wins
+            self.index.setdefault((entry.entry_type, _normalize_name(entry.title)), entry)
+        self.created: list[JournalEntry] = []
+        # Entry id -> (entry, its state before this batch)
+        self.updated: dict[int, tuple[JournalEntry, dict[str, Any]]] = {}
+        self.deleted: list[tuple[JournalEntry, dict[str, Any]]] = []
+
+    def find(self, entry_type: str, name: str) -> JournalEntry | None:
+        return self.index.get((entry_type, _normalize_name(name)))
+
+    def create(self, entry: JournalEntry):
+        self.created.append(entry)
+        self.index[(entry.entry_type, _normalize_name(entry.title))] = entry
+
+    def update(self, entry: JournalEntry, description: str):
+        if entry.id is not None and entry.id not in self.updated:
+            # Capture previous state using model_dump with JSON mode
+            self.updated[entry.id] = (entry, entry.model_dump(mode='json', exclude={'session'}))
+        if description:
+            entry.content = description
+
+    def delete(self, entry: JournalEntry):
+        del self.index[(entry.entry_type, _normalize_name(entry.title))]
+        if entry.id is None:
+            self.created.remove(entry)
+            return
+        _, previous_state = self.updated.pop(entry.id, (entry, entry.model_dump(mode='json', exclude={'session'})))
+        self.deleted.append((entry, previous_state))
@@ -0,0 +1,78 @@
+import json
+import re
+from typing import Any
+
+# ```json ... ``` fences some models wrap their output in, even in JSON mode
+_FENCE_RE = re.compile(r"```(?:json)?\s*(.*?)\s*(?:```|$)", re.DOTALL)
+_CLOSERS = {"{": "}", "[": "]"}
+# Truncation points tried before giving up
+MAX_REPAIR_ATTEMPTS = 64
+
+
+def parse_json_object(text: str) -> tuple[dict[str, Any] | None, bool]:
+    """
+    Parses an LLM's JSON object output, tolerating code fences, text around the object
+    and truncation (e.g. when num_predict cut the generation short). Truncated output is
+    cut back to the last complete element and its open brackets are closed.
+    Returns the object (None if nothing usable was found) and whether it had to be repaired.
+    """
+    try:
+        data = json.loads(text)
+        return (data, False) if isinstance(data, dict) else (None, False)
+    except json.JSONDecodeError:
+        pass
+
+    fenced = _FENCE_RE.search(text)
+    if fenced:
+        text = fenced.group(1)
+    start = text.find("{")
+    if start < 0:
+        return None, False
+    text = text[start:]
+
+    for candidate in _repair_candidates(text):
+        try:
+            data = json.loads(candidate)
+        except json.JSONDecodeError:
+            continue
+        if isinstance(data, dict):
+            return data, True
+    return None, False
+
+
+def _repair_candidates(text: str) -> list[str]:
+    """Prefixes of the text ending after a complete element, with their brackets closed, longest first."""
+    stack: list[str] = []
+    in_string = escaped = False
+    cuts: list[tuple[int, str]] = []
+    for i, char in enumerate(text):
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+            continue
+        if char == '"':
+            in_string = True
+        elif char in _CLOSERS:
+            stack.append(char)
+        elif char in "}]":
+            if not stack:
+                break
+            stack.pop()
+            cuts.append((i + 1, "".join(_CLOSERS[c] for c in reversed(stack))))
+            if not stack:
+                # The object is complete; anything after it is trailing text
+                return [text[:i + 1]]
+        elif char == "," and stack:
+            cuts.append((i, "".join(_CLOSERS[c] for c in reversed(stack))))
+
+    closers = "".join(_CLOSERS[c] for c in reversed(stack))
+    # Output cut off inside a string value: keep the partial string
+    if in_string:
+        tail = [(text[:-1] if escaped else text) + '"' + closers]
+    else:
+        tail = [text + closers]
+    return tail + [text[:cut] + close for cut, close in reversed(cuts[-MAX_REPAIR_ATTEMPTS:])]
@@ -0,0 +1,104 @@
+from collections import OrderedDict
+
+from sqlalchemy import and_, or_
+from sqlalchemy.sql import ColumnElement
+from sqlmodel import col, func, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from models import ChatMessage, GameSession
+
+# Sessions whose ancestry is kept
+LINEAGE_CACHE_SIZE = 4096
+
+# (session id, id of the last message of that session the history includes; None = all of them)
+Segment = tuple[int, int | None]
+
+
+class LineageCache:
+    """
+    Fork ancestry per session, newest segment first: a forked session's history is its own
+    messages followed, going back, by its parent's up to the fork point, the grandparent's
+    up to the parent's fork point, and so on. Ancestry never changes after a fork, so it is
+    only dropped when a session is deleted (its id may be reused).
+    """
+
+    def __init__(self, max_sessions: int = LINEAGE_CACHE_SIZE):
+        self.max_sessions = max_sessions
+        self._lineages: OrderedDict[int, list[Segment]] = OrderedDict()
+
+    async def get(self, db: AsyncSession, session_id: int) -> list[Segment]:
+        lineage = self._lineages.get(session_id)
+        if lineage is not None:
+            self._lineages.move_to_end(session_id)
+            return lineage
+
+        session = await db.get(GameSession, session_id)
+        if session is None:
+            return [(session_id, None)]
+        lineage = [(session_id, None)]
+        while session is not None and session.parent_id is not None:
+            parent_id = session.parent_id
+            lineage.append((parent_id, session.fork_message_id))
+            session = await db.get(GameSession, parent_id)
+        self._lineages[session_id] = lineage
+        while len(self._lineages) > self.max_sessions:
+            self._lineages.popitem(last=False)
+        return lineage
+
+    def invalidate(self, session_id: int):
+        self._lineages.pop(session_id, None)
+
+lineage_cache = LineageCache()
+
+
+def history_filter(lineage: list[Segment]) -> ColumnElement[bool]:
+    """
+    WHERE clause selecting the chat messages of a session's history, ancestors included.
+    For a fork, ordered reads of it sort every matching row, so it suits bounded ranges such
+    as the unsummarized tail; use newest_messages() to page back through the history.
+    """
+    if len(lineage) == 1:
+        return col(ChatMessage.session_id) == lineage[0][0]
+    return or_(*(
+        col(ChatMessage.session_id) == session_id if last_id is None
+        else and_(col(ChatMessage.session_id) == session_id, col(ChatMessage.id) <= last_id)
+        for session_id, last_id in lineage
+    ))
+
+
+def in_history(lineage: list[Segment], message: ChatMessage) -> bool:
+    """Whether the message is part of the history described by the lineage."""
+    return any(
+        message.session_id == session_id and (last_id is None or (message.id is not None and message.id <= last_id))
+        for session_id, last_id in lineage
+    )
+
+
+async def newest_messages(
+    db: AsyncSession, lineage: list[Segment], limit: int, offset: int = 0, before_id: int | None = None
+) -> list[ChatMessage]:
+    """
+    Newest-first page of a session's history, ancestors included. Segments cover descending
+    id ranges, so they are read one after another, each walking the (session_id, id) index
+    without a sort; an unforked session takes a single query.
+    """
+    messages: list[ChatMessage] = []
+    for session_id, last_id in lineage:
+        segment = select(ChatMessage).where(ChatMessage.session_id == session_id)
+        if last_id is not None:
+            segment = segment.where(col(ChatMessage.id) <= last_id)
+        if before_id is not None:
+            segment = segment.where(col(ChatMessage.id) < before_id)
+        page = (await db.exec(
+            segment.order_by(col(ChatMessage.id).desc()).offset(offset).limit(limit - len(messages))
+        )).all()
+        messages.extend(page)
+        if len(messages) >= limit:
+            break
+        if offset and not page:
+            # The offset skips past this whole segment
+            skipped = (await db.exec(select(func.count()).select_from(segment.subquery()))).one()
+            offset -= skipped
+        else:
+            offset = 0
+    return messages
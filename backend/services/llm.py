@@ -1,111 +1,805 @@
+import asyncio
+import heapq
+import itertools
 import json
 import logging
+import math
+import threading
+import time
 from abc import ABC, abstractmethod
+from collections.abc import AsyncIterator, Iterator
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, fields
 from typing import Any
 
-import requests
+import httpx
 
 from config import settings
 from prompts import get_prompt
+from services.json_repair import parse_json_object
+from services.llm_tasks import GAME_MASTER, JOURNAL_EXTRACTOR, SUMMARIZER, task_config
+from services.metrics import llm_metrics
 
 logger = logging.getLogger(__name__)
 
+# Game session the current LLM calls belong to; a multi-host pool keeps a session on one
+# endpoint so its prompt cache stays warm
+affinity_key: ContextVar[int | None] = ContextVar("affinity_key", default=None)
+
+# Event-loop time by which the LLM calls of the current request must finish
+request_deadline: ContextVar[float | None] = ContextVar("request_deadline", default=None)
+
+class DeadlineExceededError(Exception):
+    """An LLM call ran past the deadline of the request it was made for."""
+
+class LLMUnavailableError(Exception):
+    """An LLM call failed: the backend is unreachable, errored or timed out."""
+
+def _deadline_passed() -> bool:
+    deadline = request_deadline.get()
+    return deadline is not None and asyncio.get_running_loop().time() >= deadline
+
+# True for any JSON object, or a JSON schema the output must follow
+JsonFormat = bool | dict[str, Any]
+
+def _journal_items_schema() -> dict[str, Any]:
+    return {
+        "type": "array",
+        "items": {
+            "type": "object",
+            "properties": {
+                "operation": {"type": "string", "enum": list(JOURNAL_OPERATIONS)},
+                "name": {"type": "string"},
+                "description": {"type": "string"},
+            },
+            "required": ["operation", "name"],
+        },
+    }
+
+JOURNAL_CATEGORIES = ("quests", "characters", "lore")
+JOURNAL_OPERATIONS = ("add", "update", "delete")
+
+# Output of journal extraction
+JOURNAL_SCHEMA: dict[str, Any] = {
+    "type": "object",
+    "properties": {category: _journal_items_schema() for category in JOURNAL_CATEGORIES},
+    "required": list(JOURNAL_CATEGORIES),
+}
+
+# Output of a single-call turn: the narration plus the journal delta
+TURN_SCHEMA: dict[str, Any] = {
+    "type": "object",
+    "properties": {
+        "narration": {"type": "string"},
+        "quests": _journal_items_schema(),
+        "characters": _journal_items_schema(),
+        "lore": _journal_items_schema(),
+    },
+    "required": ["narration", "quests", "characters", "lore"],
+}
+
+@dataclass
+class GenerationStats:
+    """Token counts and timings Ollama reports with a finished generation (durations in ns)."""
+    prompt_eval_count: int | None = None
+    prompt_eval_duration: int | None = None
+    eval_count: int | None = None
+    eval_duration: int | None = None
+    load_duration: int | None = None
+    total_duration: int | None = None
+
+    def update(self, data: dict[str, Any]):
+        for field in fields(self):
+            if field.name in data:
+                setattr(self, field.name, data[field.name])
+
+    def phases(self) -> dict[str, float]:
+        """Reported model load, prompt evaluation and generation times, in seconds."""
+        durations = {"load": self.load_duration, "prompt_eval": self.prompt_eval_duration, "eval": self.eval_duration}
+        return {phase: ns / 1e9 for phase, ns in durations.items() if ns is not None}
+
+# Scheduling classes, highest priority first
+INTERACTIVE = 0
+EXTRACTION = 1
+SUMMARIZATION = 2
+TASK_PRIORITIES = {GAME_MASTER: INTERACTIVE, JOURNAL_EXTRACTOR: EXTRACTION, SUMMARIZER: SUMMARIZATION}
+PRIORITY_NAMES = {INTERACTIVE: "interactive", EXTRACTION: "extraction", SUMMARIZATION: "summarization"}
+
+class LLMSaturatedError(Exception):
+    """The LLM backend's queue is full; the client should retry after `retry_after` seconds."""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"LLM backend is saturated, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+class LLMScheduler:
+    """
+    Concurrency cap for one LLM backend. Calls beyond the cap wait for a slot, and freed
+    slots go to the highest-priority waiter (interactive > extraction > summarization),
+    first come first served within a class. Player-facing calls are admitted only while
+    fewer than `max_queue_depth` of them are waiting. Background calls need no such bound:
+    they come from the post-turn worker, which runs at most BACKGROUND_WORKERS jobs at once.
+    """
+
+    def __init__(self, capacity: int, max_queue_depth: int):
+        self.capacity = capacity
+        self.max_queue_depth = max_queue_depth
+        self.running = 0
+        self._waiters: list[tuple[int, int, asyncio.Future]] = []
+        self._order = itertools.count()
+        # Moving average of how long a call holds a slot, for Retry-After estimates
+        self._avg_hold = 5.0
+
+    def waiting(self) -> dict[str, int]:
+        counts = {name: 0 for name in PRIORITY_NAMES.values()}
+        for priority, _, future in self._waiters:
+            if not future.done():
+                counts[PRIORITY_NAMES[priority]] += 1
+        return counts
+
+    def retry_after(self) -> int | None:
+        """Seconds after which a new player-facing call is likely to be admitted, or None if it is now."""
+        queued = sum(1 for priority, _, future in self._waiters if priority == INTERACTIVE and not future.done())
+        if queued < self.max_queue_depth:
+            return None
+        return max(1, math.ceil(self._avg_hold * (queued + 1) / self.capacity))
+
+    @asynccontextmanager
+    async def slot(self, task: str, deadline: float | None = None):
+        """Holds a slot for the duration of a call; waits for one until the (loop time) deadline."""
+        priority = TASK_PRIORITIES.get(task, INTERACTIVE)
+        queued_at = time.perf_counter()
+        if self.running < self.capacity and not self._waiters:
+            self.running += 1
+        else:
+            future = asyncio.get_running_loop().create_future()
+            heapq.heappush(self._waiters, (priority, next(self._order), future))
+            try:
+                async with asyncio.timeout_at(deadline):
+                    await future
+            except (asyncio.CancelledError, TimeoutError):
+                if future.done() and not future.cancelled():
+                    # The slot was handed over just as the waiter was cancelled or timed out
+                    self._release()
+                raise
+        llm_metrics.record_queue_wait(task, time.perf_counter() - queued_at)
+
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._avg_hold = 0.8 * self._avg_hold + 0.2 * (time.perf_counter() - started)
+            self._release()
+
+    def _release(self):
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                # The slot passes straight to the waiter
+                future.set_result(None)
+                return
+        self.running -= 1
+
 class LLMProvider(ABC):
     @abstractmethod
-    def generate(self, prompt: str, system: str = "", stream: bool = False, json_format: bool = False) -> str:
+    def generate(
+        self,
+        prompt: str,
+        system: str = "",
+        stream: bool = False,
+        json_format: JsonFormat = False,
+        task: str = GAME_MASTER
+    ) -> str:
+        pass
+
+    @abstractmethod
+    def generate_stream(self, prompt: str, system: str = "", task: str = GAME_MASTER) -> Iterator[str]:
+        pass
+
+    @abstractmethod
+    async def agenerate(
+        self,
+        prompt: str,
+        system: str = "",
+        json_format: JsonFormat = False,
+        stats: GenerationStats | None = None,
+        task: str = GAME_MASTER
+    ) -> str:
+        pass
+
+    @abstractmethod
+    def agenerate_stream(
+        self, prompt: str, system: str = "", stats: GenerationStats | None = None, task: str = GAME_MASTER
+    ) -> AsyncIterator[str]:
+        pass
+
+    @abstractmethod
+    async def achat(
+        self,
+        messages: list[dict[str, str]],
+        json_format: JsonFormat = False,
+        stats: GenerationStats | None = None,
+        task: str = GAME_MASTER
+    ) -> str:
+        pass
+
+    @abstractmethod
+    def achat_stream(
+        self, messages: list[dict[str, str]], stats: GenerationStats | None = None, task: str = GAME_MASTER
+    ) -> AsyncIterator[str]:
         pass
 
 class OllamaService(LLMProvider):
     def __init__(self, base_url: str = settings.OLLAMA_BASE_URL, model: str = settings.OLLAMA_MODEL):
         self.base_url = base_url
         self.model = model
+        self.total_timeout = settings.OLLAMA_TOTAL_TIMEOUT
+        self.timeout = httpx.Timeout(
+            connect=settings.OLLAMA_CONNECT_TIMEOUT,
+            read=settings.OLLAMA_READ_TIMEOUT,
+            write=settings.OLLAMA_CONNECT_TIMEOUT,
+            pool=settings.OLLAMA_POOL_TIMEOUT,
+        )
+        self.limits = httpx.Limits(
+            max_connections=settings.OLLAMA_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.OLLAMA_MAX_KEEPALIVE_CONNECTIONS,
+        )
+        # Clients are created lazily so that the async one binds to the running event loop
+        self._client: httpx.Client | None = None
+        self._async_client: httpx.AsyncClient | None = None
+        # Caps on in-flight generations, so one slow request can't pile up others behind it
+        self._sync_slots = threading.BoundedSemaphore(settings.OLLAMA_MAX_CONCURRENT_REQUESTS)
+        self.scheduler = LLMScheduler(settings.OLLAMA_MAX_CONCURRENT_REQUESTS, settings.LLM_MAX_QUEUE_DEPTH)
 
-    def generate(self, prompt: str, system: str = "", stream: bool = False, json_format: bool = False) -> str:
-        """Generic method to call Ollama generate API."""
-        url = f"{self.base_url}/api/generate"
-        payload = {
-            "model": self.model,
+    @property
+    def client(self) -> httpx.Client:
+        if self._client is None:
+            self._client = httpx.Client(base_url=self.base_url, timeout=self.timeout, limits=self.limits)
+        return self._client
+
+    @property
+    def async_client(self) -> httpx.AsyncClient:
+        if self._async_client is None:
+            self._async_client = httpx.AsyncClient(base_url=self.base_url, timeout=self.timeout, limits=self.limits)
+        return self._async_client
+
+    def start(self):
+        """Starts background tasks; a single endpoint has none."""
+
+    async def aclose(self):
+        """Closes the pooled HTTP clients."""
+        if self._async_client is not None:
+            await self._async_client.aclose()
+            self._async_client = None
+        if self._client is not None:
+            self._client.close()
+            self._client = None
+
+    def _payload(
+        self, prompt: str, system: str, stream: bool, json_format: JsonFormat = False, task: str = GAME_MASTER
+    ) -> dict[str, Any]:
+        config = task_config(task, self.model)
+        return {
+            "model": config.model,
             "prompt": prompt,
             "system": system,
             "stream": stream,
-            "format": "json" if json_format else None
+            "format": self._format(json_format),
+            "options": config.options(),
+            "keep_alive": config.keep_alive,
         }
-        
+
+    def _chat_payload(
+        self, messages: list[dict[str, str]], stream: bool, json_format: JsonFormat = False, task: str = GAME_MASTER
+    ) -> dict[str, Any]:
+        config = task_config(task, self.model)
+        return {
+            "model": config.model,
+            "messages": messages,
+            "stream": stream,
+            "format": self._format(json_format),
+            "options": config.options(),
+            "keep_alive": config.keep_alive,
+        }
+
+    @staticmethod
+    def _format(json_format: JsonFormat) -> str | dict[str, Any] | None:
+        if isinstance(json_format, dict):
+            return json_format
+        return "json" if json_format else None
+
+    @staticmethod
+    def _record(task: str, payload: dict[str, Any], started: float, stats: GenerationStats, error: bool = False):
+        llm_metrics.record(
+            task,
+            payload["model"],
+            time.perf_counter() - started,
+            prompt_tokens=stats.prompt_eval_count,
+            completion_tokens=stats.eval_count,
+            error=error,
+            phases=stats.phases(),
+        )
+
+    def _parse_chunk(self, line: str) -> dict[str, Any]:
+        """Parses one NDJSON line of an Ollama stream."""
+        chunk = json.loads(line)
+        if chunk.get("error"):
+            raise httpx.HTTPError(chunk["error"])
+        return chunk
+
+    def generate(
+        self,
+        prompt: str,
+        system: str = "",
+        stream: bool = False,
+        json_format: JsonFormat = False,
+        task: str = GAME_MASTER
+    ) -> str:
+        """Generic method to call Ollama generate API."""
+        if stream:
+            return "".join(self.generate_stream(prompt, system=system, task=task))
+
+        deadline = time.monotonic() + self.total_timeout
         try:
             logger.debug('REQUEST: %s', prompt)
-            response = requests.post(url, json=payload)
-            response.raise_for_status()
-            if stream:
-                # Handle streaming if needed, for now just return full text
-                pass 
-            rsp = response.json().get("response", "")
+            with self._sync_slots, self.client.stream(
+                "POST", "/api/generate", json=self._payload(prompt, system, False, json_format, task)
+            ) as response:
+                response.raise_for_status()
+                # The read timeout only bounds each read; check the total deadline between them
+                body = bytearray()
+                for data in response.iter_bytes():
+                    if time.monotonic() > deadline:
+                        raise httpx.TimeoutException(f"Generation exceeded {self.total_timeout}s")
+                    body += data
+            rsp = json.loads(body).get("response", "")
             logger.debug('RESPONSE: %s', rsp)
             return rsp
-        except requests.RequestException as e:
+        except httpx.HTTPError as e:
             logger.error(f"Error calling Ollama: {e}")
-            return f"Error: {str(e)}"
+            raise LLMUnavailableError(f"The LLM backend failed: {str(e) or type(e).__name__}") from e
 
-    def generate_response(
-        self, 
-        player_action: str, 
-        world_state: str, 
-        conversation_history: str, 
-        language: str = "en"
+    def generate_stream(self, prompt: str, system: str = "", task: str = GAME_MASTER) -> Iterator[str]:
+        """Calls Ollama generate API in streaming mode, yielding text chunks as they arrive."""
+        deadline = time.monotonic() + self.total_timeout
+        try:
+            logger.debug('REQUEST (stream): %s', prompt)
+            with self._sync_slots, self.client.stream(
+                "POST", "/api/generate", json=self._payload(prompt, system, True, task=task)
+            ) as response:
+                response.raise_for_status()
+                # Ollama streams NDJSON: one JSON object per line, the last one has "done": true
+                for line in response.iter_lines():
+                    if time.monotonic() > deadline:
+                        raise httpx.TimeoutException(f"Generation exceeded {self.total_timeout}s")
+                    if not line:
+                        continue
+                    chunk = self._parse_chunk(line)
+                    text = chunk.get("response", "")
+                    if text:
+                        yield text
+                    if chunk.get("done"):
+                        break
+        except httpx.HTTPError as e:
+            logger.error(f"Error calling Ollama: {e}")
+            raise LLMUnavailableError(f"The LLM backend failed: {str(e) or type(e).__name__}") from e
+
+    @staticmethod
+    def _chunk_text(chunk: dict[str, Any]) -> str:
+        """Text of a /api/generate or /api/chat response (or stream chunk)."""
+        if "message" in chunk:
+            return chunk["message"].get("content", "")
+        return chunk.get("response", "")
+
+    def retry_after(self) -> int | None:
+        """Seconds a new player-facing call should wait before retrying, or None if it can be admitted."""
+        return self.scheduler.retry_after()
+
+    def admit(self):
+        """Raises LLMSaturatedError if a new player-facing call would not be admitted."""
+        retry_after = self.retry_after()
+        if retry_after is not None:
+            raise LLMSaturatedError(retry_after)
+
+    def scheduler_stats(self) -> list[dict[str, Any]]:
+        """Running and waiting calls per backend."""
+        return [{
+            "backend": self.base_url,
+            "running": self.scheduler.running,
+            "capacity": self.scheduler.capacity,
+            "waiting": self.scheduler.waiting(),
+        }]
+
+    def _call_deadline(self) -> float:
+        """Loop time by which a call must finish: the generation timeout, capped by the request deadline."""
+        deadline = asyncio.get_running_loop().time() + self.total_timeout
+        limit = request_deadline.get()
+        return deadline if limit is None else min(deadline, limit)
+
+    async def _send(
+        self, path: str, payload: dict[str, Any], stats: GenerationStats | None = None, task: str = GAME_MASTER
     ) -> str:
-        """Generates a response for the game."""
-        system_prompt = get_prompt("game_master", language)
-        
-        full_prompt = (
+        """Posts a non-streaming request; raises httpx.HTTPError or TimeoutError on failure."""
+        async with self.scheduler.slot(task, request_deadline.get()), asyncio.timeout_at(self._call_deadline()):
+            response = await self.async_client.post(path, json=payload)
+        response.raise_for_status()
+        data = response.json()
+        if stats is not None:
+            stats.update(data)
+        return self._chunk_text(data)
+
+    async def _send_stream(
+        self, path: str, payload: dict[str, Any], stats: GenerationStats | None = None, task: str = GAME_MASTER
+    ) -> AsyncIterator[str]:
+        """Posts a streaming request, yielding text chunks; raises httpx.HTTPError or TimeoutError on failure."""
+        async with self.scheduler.slot(task, request_deadline.get()):
+            deadline = self._call_deadline()
+            request = self.async_client.build_request("POST", path, json=payload)
+            async with asyncio.timeout_at(deadline):
+                response = await self.async_client.send(request, stream=True)
+            try:
+                response.raise_for_status()
+                lines = response.aiter_lines()
+                while True:
+                    # The deadline bounds each read, so it also fires while the host stalls mid-line;
+                    # it must not be held across a yield, where it would cancel the consumer instead
+                    async with asyncio.timeout_at(deadline):
+                        line = await anext(lines, None)
+                    if line is None:
+                        break
+                    if not line:
+                        continue
+                    chunk = self._parse_chunk(line)
+                    text = self._chunk_text(chunk)
+                    if text:
+                        yield text
+                    if chunk.get("done"):
+                        if stats is not None:
+                            stats.update(chunk)
+                        break
+            finally:
+                await response.aclose()
+
+    async def _apost(
+        self, path: str, payload: dict[str, Any], stats: GenerationStats | None = None, task: str = GAME_MASTER
+    ) -> str:
+        stats = stats if stats is not None else GenerationStats()
+        started = time.perf_counter()
+        try:
+            logger.debug('REQUEST: %s', payload.get("prompt", payload.get("messages")))
+            rsp = await self._send(path, payload, stats, task)
+            logger.debug('RESPONSE: %s', rsp)
+            self._record(task, payload, started, stats)
+            return rsp
+        except (httpx.HTTPError, TimeoutError) as e:
+            logger.error(f"Error calling Ollama: {e!r}")
+            self._record(task, payload, started, stats, error=True)
+            if _deadline_passed():
+                raise DeadlineExceededError("The request deadline passed before the LLM replied") from e
+            raise LLMUnavailableError(f"The LLM backend failed: {str(e) or type(e).__name__}") from e
+
+    async def _astream(
+        self, path: str, payload: dict[str, Any], stats: GenerationStats | None = None, task: str = GAME_MASTER
+    ) -> AsyncIterator[str]:
+        stats = stats if stats is not None else GenerationStats()
+        started = time.perf_counter()
+        try:
+            logger.debug('REQUEST (stream): %s', payload.get("prompt", payload.get("messages")))
+            async for text in self._send_stream(path, payload, stats, task):
+                yield text
+            self._record(task, payload, started, stats)
+        except (httpx.HTTPError, TimeoutError) as e:
+            logger.error(f"Error calling Ollama: {e!r}")
+            self._record(task, payload, started, stats, error=True)
+            if _deadline_passed():
+                raise DeadlineExceededError("The request deadline passed before the LLM replied") from e
+            raise LLMUnavailableError(f"The LLM backend failed: {str(e) or type(e).__name__}") from e
+
+    async def agenerate(
+        self,
+        prompt: str,
+        system: str = "",
+        json_format: JsonFormat = False,
+        stats: GenerationStats | None = None,
+        task: str = GAME_MASTER
+    ) -> str:
+        """Async counterpart of generate, using the shared keep-alive connection pool."""
+        return await self._apost(
+            "/api/generate", self._payload(prompt, system, False, json_format, task), stats, task
+        )
+
+    def agenerate_stream(
+        self, prompt: str, system: str = "", stats: GenerationStats | None = None, task: str = GAME_MASTER
+    ) -> AsyncIterator[str]:
+        """Async counterpart of generate_stream."""
+        return self._astream("/api/generate", self._payload(prompt, system, True, task=task), stats, task)
+
+    async def achat(
+        self,
+        messages: list[dict[str, str]],
+        json_format: JsonFormat = False,
+        stats: GenerationStats | None = None,
+        task: str = GAME_MASTER
+    ) -> str:
+        """Calls Ollama chat API with a list of role/content messages."""
+        return await self._apost("/api/chat", self._chat_payload(messages, False, json_format, task), stats, task)
+
+    def achat_stream(
+        self, messages: list[dict[str, str]], stats: GenerationStats | None = None, task: str = GAME_MASTER
+    ) -> AsyncIterator[str]:
+        """Streaming counterpart of achat."""
+        return self._astream("/api/chat", self._chat_payload(messages, True, task=task), stats, task)
+
+    def _build_game_master_prompt(self, player_action: str, world_state: str, conversation_history: str) -> str:
+        return (
             f"<world_state>\n{world_state}\n</world_state>\n\n"
             f"<conversation_history>\n{conversation_history}\n</conversation_history>\n\n"
             f"<player_action>\n{player_action}\n</player_action>"
         )
-        
+
+    def _build_summary_prompt(self, text: str, previous_summary: str | None) -> str:
+        if previous_summary:
+            return (
+                f"<previous_summary>\n{previous_summary}\n</previous_summary>\n\n"
+                f"<recent_events>\n{text}\n</recent_events>"
+            )
+        return text
+
+    def _build_extraction_prompt(
+        self,
+        user_input: str,
+        ai_response_text: str,
+        serialized_state: dict[str, Any],
+        language: str
+    ) -> str:
+        system_prompt_template = get_prompt("journal_extractor", language)
+        if settings.JOURNAL_COMPACT_JSON:
+            existing_state = json.dumps(serialized_state, ensure_ascii=False, separators=(",", ":"))
+        else:
+            existing_state = json.dumps(serialized_state, ensure_ascii=False, indent=2)
+        return system_prompt_template.format(
+            existing_state=existing_state,
+            user_request=user_input,
+            game_master_response=ai_response_text
+        )
+
+    def _parse_json(self, response: str, task: str) -> dict[str, Any] | None:
+        """Parses (repairing if needed) a JSON object response, counting failures and repairs."""
+        data, repaired = parse_json_object(response)
+        if data is None:
+            logger.warning(f"Failed to parse JSON from LLM: {response}")
+            llm_metrics.count(task, "parse_failures")
+        elif repaired:
+            logger.info(f"Repaired malformed JSON from LLM: {response}")
+            llm_metrics.count(task, "parse_repairs")
+        return data
+
+    def _validate_journal_updates(self, data: dict[str, Any], task: str) -> dict[str, list[dict[str, str]]]:
+        """
+        Keeps the well-formed update items: a non-empty name, a known operation ("add" if
+        missing) and a string description. Legacy "key"/"value" items are converted.
+        """
+        updates: dict[str, list[dict[str, str]]] = {}
+        dropped = 0
+        for category in JOURNAL_CATEGORIES:
+            items = data.get(category) or []
+            if not isinstance(items, list):
+                dropped += 1
+                items = []
+            valid = []
+            for item in items:
+                if not isinstance(item, dict):
+                    dropped += 1
+                    continue
+                name = item.get("name", item.get("key"))
+                operation = item.get("operation") or "add"
+                description = item.get("description", item.get("value")) or ""
+                if not isinstance(name, str) or not name.strip() or operation not in JOURNAL_OPERATIONS:
+                    dropped += 1
+                    continue
+                valid.append({"operation": operation, "name": name.strip(), "description": str(description)})
+            updates[category] = valid
+        if dropped:
+            logger.warning(f"Dropped {dropped} malformed journal items from LLM output")
+            llm_metrics.count(task, "invalid_items", dropped)
+        return updates
+
+    def _parse_journal_updates(self, response: str) -> dict[str, Any]:
+        data = self._parse_json(response, JOURNAL_EXTRACTOR)
+        return self._validate_journal_updates(data, JOURNAL_EXTRACTOR) if data is not None else {}
+
+    def generate_response(
+        self,
+        player_action: str,
+        world_state: str,
+        conversation_history: str,
+        language: str = "en"
+    ) -> str:
+        """Generates a response for the game."""
+        system_prompt = get_prompt("game_master", language)
+        full_prompt = self._build_game_master_prompt(player_action, world_state, conversation_history)
         return self.generate(full_prompt, system=system_prompt)
 
+    async def agenerate_response(
+        self,
+        player_action: str,
+        world_state: str,
+        conversation_history: str,
+        language: str = "en",
+        stats: GenerationStats | None = None
+    ) -> str:
+        """Async counterpart of generate_response."""
+        system_prompt = get_prompt("game_master", language)
+        full_prompt = self._build_game_master_prompt(player_action, world_state, conversation_history)
+        return await self.agenerate(full_prompt, system=system_prompt, stats=stats)
+
+    def stream_response(
+        self,
+        player_action: str,
+        world_state: str,
+        conversation_history: str,
+        language: str = "en"
+    ) -> Iterator[str]:
+        """Streams a response for the game chunk by chunk."""
+        system_prompt = get_prompt("game_master", language)
+        full_prompt = self._build_game_master_prompt(player_action, world_state, conversation_history)
+        return self.generate_stream(full_prompt, system=system_prompt)
+
+    def astream_response(
+        self,
+        player_action: str,
+        world_state: str,
+        conversation_history: str,
+        language: str = "en",
+        stats: GenerationStats | None = None
+    ) -> AsyncIterator[str]:
+        """Async counterpart of stream_response."""
+        system_prompt = get_prompt("game_master", language)
+        full_prompt = self._build_game_master_prompt(player_action, world_state, conversation_history)
+        return self.agenerate_stream(full_prompt, system=system_prompt, stats=stats)
+
+    def _game_master_system_prompt(self, language: str, structured: bool = False) -> str:
+        system_prompt = get_prompt("game_master", language)
+        if structured:
+            system_prompt += "\n\n" + get_prompt("structured_turn", language)
+        return system_prompt
+
+    def _build_chat_messages(
+        self, context: dict[str, Any], player_action: str, language: str, structured: bool = False
+    ) -> list[dict[str, str]]:
+        """
+        Chat-mode prompt laid out for Ollama's prompt cache: the system prompt, summary and
+        chat history form a prefix that only grows between summarizations, while the volatile
+        journal state travels with the player action in the last message.
+        """
+        system_prompt = self._game_master_system_prompt(language, structured)
+        if context["summary"]:
+            system_prompt += f"\n\n<story_summary>\n{context['summary']}\n</story_summary>"
+        return [
+            {"role": "system", "content": system_prompt},
+            *context["history"],
+            {
+                "role": "user",
+                "content": (
+                    f"<world_state>\n{context['journal']}\n</world_state>\n\n"
+                    f"<player_action>\n{player_action}\n</player_action>"
+                ),
+            },
+        ]
+
+    async def agenerate_turn(
+        self,
+        context: dict[str, Any],
+        player_action: str,
+        language: str = "en",
+        stats: GenerationStats | None = None
+    ) -> str:
+        """Generates the game master's reply for a context built by ContextBuilder."""
+        if settings.OLLAMA_CHAT_MODE:
+            return await self.achat(self._build_chat_messages(context, player_action, language), stats=stats)
+        return await self.agenerate_response(
+            player_action, context["world_state"], context["conversation_history"], language, stats=stats
+        )
+
+    def astream_turn(
+        self,
+        context: dict[str, Any],
+        player_action: str,
+        language: str = "en",
+        stats: GenerationStats | None = None
+    ) -> AsyncIterator[str]:
+        """Streaming counterpart of agenerate_turn."""
+        if settings.OLLAMA_CHAT_MODE:
+            return self.achat_stream(self._build_chat_messages(context, player_action, language), stats=stats)
+        return self.astream_response(
+            player_action, context["world_state"], context["conversation_history"], language, stats=stats
+        )
+
+    async def agenerate_structured_turn(
+        self,
+        context: dict[str, Any],
+        player_action: str,
+        language: str = "en",
+        stats: GenerationStats | None = None
+    ) -> tuple[str, dict[str, Any] | None]:
+        """
+        Generates the game master's narration together with the journal delta of the turn in
+        one call constrained to TURN_SCHEMA. Returns the narration and the journal updates; if
+        the output has no usable narration, the turn is regenerated as plain narration and the
+        updates are None (callers then extract separately).
+        """
+        if settings.OLLAMA_CHAT_MODE:
+            messages = self._build_chat_messages(context, player_action, language, structured=True)
+            response = await self.achat(messages, json_format=TURN_SCHEMA, stats=stats)
+        else:
+            full_prompt = self._build_game_master_prompt(
+                player_action, context["world_state"], context["conversation_history"]
+            )
+            system_prompt = self._game_master_system_prompt(language, structured=True)
+            response = await self.agenerate(full_prompt, system=system_prompt, json_format=TURN_SCHEMA, stats=stats)
+
+        data = self._parse_json(response, GAME_MASTER)
+        narration = data.get("narration") if data is not None else None
+        if data is None or not isinstance(narration, str) or not narration.strip():
+            if data is not None:
+                logger.warning(f"Structured turn without narration: {response}")
+                llm_metrics.count(GAME_MASTER, "parse_failures")
+            # Never show the raw JSON to the player
+            return await self.agenerate_turn(context, player_action, language, stats=stats), None
+        return narration, self._validate_journal_updates(data, GAME_MASTER)
+
     def summarize_context(self, text: str, previous_summary: str | None = None, language: str = "en") -> str:
         """Summarizes the given text to save context window."""
         system_prompt = get_prompt("summarizer", language)
-        
-        if previous_summary:
-            full_text = f"<previous_summary>\n{previous_summary}\n</previous_summary>\n\n<recent_events>\n{text}\n</recent_events>"
-        else:
-            full_text = text
-            
-        return self.generate(full_text, system=system_prompt)
+        return self.generate(self._build_summary_prompt(text, previous_summary), system=system_prompt, task=SUMMARIZER)
+
+    async def asummarize_context(self, text: str, previous_summary: str | None = None, language: str = "en") -> str:
+        """Async counterpart of summarize_context."""
+        system_prompt = get_prompt("summarizer", language)
+        return await self.agenerate(
+            self._build_summary_prompt(text, previous_summary), system=system_prompt, task=SUMMARIZER
+        )
 
     def extract_journal_updates(
-        self, 
-        user_input: str, 
-        ai_response_text: str, 
-        serialized_state: dict[str, Any], 
+        self,
+        user_input: str,
+        ai_response_text: str,
+        serialized_state: dict[str, Any],
         language: str = "en"
     ) -> dict[str, Any]:
         """
         Analyzes the last turn to extract updates for the journal (quests, characters, etc.).
         Returns a JSON object.
-        
+
         Args:
             user_input: User's input text
             ai_response_text: AI's response text
             serialized_state: Already serialized game state (dict with summary, quests, lore, characters)
             language: Language for prompts
         """
-        system_prompt_template = get_prompt("journal_extractor", language)
-        
-        # Format the prompt with data
-        prompt = system_prompt_template.format(
-            existing_state=json.dumps(serialized_state, ensure_ascii=False, indent=2),
-            user_request=user_input,
-            game_master_response=ai_response_text
-        )
-        
-        try:
-            response = self.generate(prompt, system="", json_format=True)
-            return json.loads(response)
-        except json.JSONDecodeError:
-            logger.warning(f"Failed to parse JSON from LLM: {response}")
-            return {}
+        prompt = self._build_extraction_prompt(user_input, ai_response_text, serialized_state, language)
+        response = self.generate(prompt, system="", json_format=JOURNAL_SCHEMA, task=JOURNAL_EXTRACTOR)
+        return self._parse_journal_updates(response)
+
+    async def aextract_journal_updates(
+        self,
+        user_input: str,
+        ai_response_text: str,
+        serialized_state: dict[str, Any],
+        language: str = "en"
+    ) -> dict[str, Any]:
+        """Async counterpart of extract_journal_updates."""
+        prompt = self._build_extraction_prompt(user_input, ai_response_text, serialized_state, language)
+        response = await self.agenerate(prompt, system="", json_format=JOURNAL_SCHEMA, task=JOURNAL_EXTRACTOR)
+        return self._parse_journal_updates(response)
+
+def create_llm_service() -> OllamaService:
+    """A single-endpoint service, or a pool when several OLLAMA_BASE_URLS are configured."""
+    if len(settings.OLLAMA_BASE_URLS) > 1:
+        from services.llm_pool import OllamaPool
+        return OllamaPool(settings.OLLAMA_BASE_URLS)
+    return OllamaService(settings.OLLAMA_BASE_URLS[0] if settings.OLLAMA_BASE_URLS else settings.OLLAMA_BASE_URL)
 
 # Singleton instance or factory can be used
-ollama_service = OllamaService()
+ollama_service = create_llm_service()
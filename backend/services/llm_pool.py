@@ -0,0 +1,215 @@
+import asyncio
+import logging
+from collections import OrderedDict
+from collections.abc import AsyncIterator, Iterator
+from typing import Any
+
+import httpx
+
+from config import settings
+from services.llm import GenerationStats, JsonFormat, OllamaService, _deadline_passed, affinity_key
+from services.llm_tasks import GAME_MASTER
+
+logger = logging.getLogger(__name__)
+
+# Sessions whose endpoint assignment is remembered
+AFFINITY_CACHE_SIZE = 4096
+
+
+class Endpoint:
+    """One Ollama host of a pool, with its own connection pool and load/health bookkeeping."""
+
+    def __init__(self, base_url: str, model: str):
+        self.service = OllamaService(base_url, model)
+        self.outstanding = 0
+        self.healthy = True
+        self.failures = 0
+
+    @property
+    def base_url(self) -> str:
+        return self.service.base_url
+
+    def record_success(self):
+        self.failures = 0
+
+    def record_failure(self, error: Exception):
+        self.failures += 1
+        if self.healthy and self.failures >= settings.OLLAMA_EJECT_AFTER_FAILURES:
+            self.healthy = False
+            logger.warning(f"Ejecting Ollama endpoint {self.base_url} after {self.failures} failures: {error!r}")
+
+
+def _is_endpoint_failure(error: Exception) -> bool:
+    """
+    Whether an error points at the host rather than at the request: a transport error, a 5xx
+    response or the host exceeding its own total timeout. Running out of the request's deadline,
+    which also bounds the wait in the scheduler queue, and waiting for a free local connection
+    say nothing about the host.
+    """
+    if _deadline_passed() or isinstance(error, httpx.PoolTimeout):
+        return False
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code >= 500
+    return isinstance(error, (httpx.TransportError, TimeoutError))
+
+
+class OllamaPool(OllamaService):
+    """
+    Spreads requests over several Ollama hosts. Each request goes to the healthy endpoint
+    with the fewest requests in flight, except that a game session sticks to the endpoint it
+    last used (keeping that host's prompt cache warm) unless it is more than
+    OLLAMA_AFFINITY_SLACK requests busier than the least-loaded one.
+    Endpoints are ejected after OLLAMA_EJECT_AFTER_FAILURES consecutive failures or a failed
+    health check, and readmitted by the background health check once they respond again.
+    """
+
+    def __init__(self, base_urls: list[str], model: str = settings.OLLAMA_MODEL):
+        super().__init__(base_urls[0], model)
+        self.endpoints = [Endpoint(url, model) for url in base_urls]
+        self._affinity: OrderedDict[int, Endpoint] = OrderedDict()
+        self._health_task: asyncio.Task | None = None
+
+    def start(self):
+        """Starts the background health checks (needs a running event loop)."""
+        if self._health_task is None:
+            self._health_task = asyncio.create_task(self._health_loop())
+
+    async def aclose(self):
+        if self._health_task is not None:
+            self._health_task.cancel()
+            await asyncio.gather(self._health_task, return_exceptions=True)
+            self._health_task = None
+        for endpoint in self.endpoints:
+            await endpoint.service.aclose()
+
+    async def _health_loop(self):
+        while True:
+            await asyncio.gather(*(self.check_health(endpoint) for endpoint in self.endpoints))
+            await asyncio.sleep(settings.OLLAMA_HEALTH_CHECK_INTERVAL)
+
+    async def check_health(self, endpoint: Endpoint) -> bool:
+        """Probes an endpoint, ejecting or readmitting it accordingly."""
+        try:
+            response = await endpoint.service.async_client.get(
+                "/api/version", timeout=settings.OLLAMA_CONNECT_TIMEOUT
+            )
+            response.raise_for_status()
+        except httpx.HTTPError as e:
+            if endpoint.healthy:
+                logger.warning(f"Ejecting Ollama endpoint {endpoint.base_url}: health check failed: {e!r}")
+            endpoint.healthy = False
+            return False
+        if not endpoint.healthy:
+            logger.info(f"Readmitting Ollama endpoint {endpoint.base_url}")
+        endpoint.healthy = True
+        endpoint.failures = 0
+        return True
+
+    def pick(self, exclude: Endpoint | None = None) -> Endpoint:
+        """Endpoint for the next request of the current session (see class docstring)."""
+        candidates = [e for e in self.endpoints if e.healthy and e is not exclude]
+        if not candidates:
+            # Nothing known to be up: try anyway rather than failing outright
+            candidates = [e for e in self.endpoints if e is not exclude] or self.endpoints
+        least_loaded = min(candidates, key=lambda e: (e.outstanding, e.failures))
+
+        key = affinity_key.get()
+        if key is None:
+            return least_loaded
+        current = self._affinity.get(key)
+        if (
+            current is not None
+            and current in candidates
+            and current.outstanding <= least_loaded.outstanding + settings.OLLAMA_AFFINITY_SLACK
+        ):
+            self._affinity.move_to_end(key)
+            return current
+        self._affinity[key] = least_loaded
+        self._affinity.move_to_end(key)
+        while len(self._affinity) > AFFINITY_CACHE_SIZE:
+            self._affinity.popitem(last=False)
+        return least_loaded
+
+    def retry_after(self) -> int | None:
+        """None if any usable endpoint can admit a player-facing call, else the shortest wait."""
+        usable = [e for e in self.endpoints if e.healthy] or self.endpoints
+        waits = [e.service.retry_after() for e in usable]
+        if None in waits:
+            return None
+        return min(wait for wait in waits if wait is not None)
+
+    def scheduler_stats(self) -> list[dict[str, Any]]:
+        return [
+            {**endpoint.service.scheduler_stats()[0], "healthy": endpoint.healthy}
+            for endpoint in self.endpoints
+        ]
+
+    async def _send(
+        self, path: str, payload: dict[str, Any], stats: GenerationStats | None = None, task: str = GAME_MASTER
+    ) -> str:
+        endpoint = self.pick()
+        try:
+            return await self._send_to(endpoint, path, payload, stats, task)
+        except httpx.ConnectError:
+            # Nothing was sent, so another endpoint can take the request
+            logger.warning(f"Ollama endpoint {endpoint.base_url} unreachable, retrying elsewhere")
+            return await self._send_to(self.pick(exclude=endpoint), path, payload, stats, task)
+
+    async def _send_to(
+        self, endpoint: Endpoint, path: str, payload: dict[str, Any], stats: GenerationStats | None, task: str
+    ) -> str:
+        endpoint.outstanding += 1
+        try:
+            rsp = await endpoint.service._send(path, payload, stats, task)
+        except Exception as e:
+            if _is_endpoint_failure(e):
+                endpoint.record_failure(e)
+            raise
+        finally:
+            endpoint.outstanding -= 1
+        endpoint.record_success()
+        return rsp
+
+    async def _send_stream(
+        self, path: str, payload: dict[str, Any], stats: GenerationStats | None = None, task: str = GAME_MASTER
+    ) -> AsyncIterator[str]:
+        endpoint = self.pick()
+        started = False
+        try:
+            async for text in self._stream_from(endpoint, path, payload, stats, task):
+                started = True
+                yield text
+        except httpx.ConnectError:
+            if started:
+                raise
+            logger.warning(f"Ollama endpoint {endpoint.base_url} unreachable, retrying elsewhere")
+            async for text in self._stream_from(self.pick(exclude=endpoint), path, payload, stats, task):
+                yield text
+
+    async def _stream_from(
+        self, endpoint: Endpoint, path: str, payload: dict[str, Any], stats: GenerationStats | None, task: str
+    ) -> AsyncIterator[str]:
+        endpoint.outstanding += 1
+        try:
+            async for text in endpoint.service._send_stream(path, payload, stats, task):
+                yield text
+        except Exception as e:
+            if _is_endpoint_failure(e):
+                endpoint.record_failure(e)
+            raise
+        finally:
+            endpoint.outstanding -= 1
+        endpoint.record_success()
+
+    def generate(
+        self,
+        prompt: str,
+        system: str = "",
+        stream: bool = False,
+        json_format: JsonFormat = False,
+        task: str = GAME_MASTER
+    ) -> str:
+        return self.pick().service.generate(prompt, system=system, stream=stream, json_format=json_format, task=task)
+
+    def generate_stream(self, prompt: str, system: str = "", task: str = GAME_MASTER) -> Iterator[str]:
+        return self.pick().service.generate_stream(prompt, system=system, task=task)
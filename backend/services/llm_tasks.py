@@ -0,0 +1,48 @@
+from dataclasses import dataclass
+from typing import Any
+
+from config import settings
+
+# LLM tasks, named after their prompts
+GAME_MASTER = "game_master"
+JOURNAL_EXTRACTOR = "journal_extractor"
+SUMMARIZER = "summarizer"
+
+
+@dataclass(frozen=True)
+class TaskConfig:
+    """Model and generation options for one task, with LLM_TASKS overrides applied."""
+    model: str
+    num_ctx: int
+    num_predict: int | None
+    temperature: float | None
+    keep_alive: str
+
+    def options(self) -> dict[str, Any]:
+        """Ollama request options."""
+        # Prompts are packed against num_ctx, so make Ollama use the same window
+        options: dict[str, Any] = {"num_ctx": self.num_ctx}
+        if self.num_predict is not None:
+            options["num_predict"] = self.num_predict
+        if self.temperature is not None:
+            options["temperature"] = self.temperature
+        return options
+
+
+def context_window(model: str) -> int:
+    """Context window (num_ctx) configured for a model."""
+    return settings.MODEL_CONTEXT_WINDOWS.get(model, settings.DEFAULT_CONTEXT_WINDOW)
+
+
+def task_config(task: str, default_model: str = settings.OLLAMA_MODEL) -> TaskConfig:
+    overrides = settings.LLM_TASKS.get(task)
+    if overrides is None:
+        return TaskConfig(default_model, context_window(default_model), None, None, settings.OLLAMA_KEEP_ALIVE)
+    model = overrides.model or default_model
+    return TaskConfig(
+        model=model,
+        num_ctx=overrides.num_ctx or context_window(model),
+        num_predict=overrides.num_predict,
+        temperature=overrides.temperature,
+        keep_alive=overrides.keep_alive or settings.OLLAMA_KEEP_ALIVE,
+    )
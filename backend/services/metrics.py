@@ -0,0 +1,271 @@
+import bisect
+import time
+from collections import Counter, deque
+from collections.abc import Iterator, Mapping
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Any
+
+# Latencies kept per task for percentiles
+LATENCY_WINDOW = 500
+# Histogram bucket bounds: seconds for latencies, counts for tokens
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+TOKEN_BUCKETS = (16, 64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384, 32768)
+
+# Label name/value pairs identifying one series of a metric family
+Labels = tuple[tuple[str, str], ...]
+
+
+def _percentile(values: list[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * q), len(ordered) - 1)]
+
+
+class Histogram:
+    """Prometheus-style histogram: per-bucket counts plus the sum and count of observations."""
+
+    def __init__(self, buckets: tuple[float, ...] = SECONDS_BUCKETS):
+        self.buckets = buckets
+        # Non-cumulative; the last slot counts observations above the largest bound
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def render(self, name: str, labels: dict[str, str]) -> list[str]:
+        lines = []
+        cumulative = 0
+        for bound, count in zip((*self.buckets, "+Inf"), self.counts, strict=True):
+            cumulative += count
+            lines.append(f"{name}_bucket{_labels({**labels, 'le': str(bound)})} {cumulative}")
+        lines.append(f"{name}_sum{_labels(labels)} {self.sum}")
+        lines.append(f"{name}_count{_labels(labels)} {self.count}")
+        return lines
+
+
+def _labels(labels: dict[str, str]) -> str:
+    if not labels:
+        return ""
+    pairs = (f'{key}="{_escape(str(value))}"' for key, value in labels.items())
+    return "{" + ",".join(pairs) + "}"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _histogram_family(name: str, help_text: str, series: dict[Labels, Histogram]) -> list[str]:
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+    for labels, histogram in sorted(series.items()):
+        lines.extend(histogram.render(name, dict(labels)))
+    return lines
+
+
+def _simple_family(
+    name: str, kind: str, help_text: str, series: Mapping[Labels, float]
+) -> list[str]:
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+    lines.extend(f"{name}{_labels(dict(labels))} {value}" for labels, value in sorted(series.items()))
+    return lines
+
+
+@dataclass
+class TaskMetrics:
+    """Running totals for one LLM task."""
+    requests: int = 0
+    errors: int = 0
+    total_seconds: float = 0.0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    recent: deque[float] = field(default_factory=lambda: deque(maxlen=LATENCY_WINDOW))
+
+    def snapshot(self) -> dict[str, Any]:
+        recent = list(self.recent)
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "avg_seconds": round(self.total_seconds / self.requests, 4) if self.requests else None,
+            "p50_seconds": round(_percentile(recent, 0.5), 4) if recent else None,
+            "p95_seconds": round(_percentile(recent, 0.95), 4) if recent else None,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+        }
+
+
+@dataclass
+class WaitMetrics:
+    """Time LLM calls of one task spent queued for a backend slot."""
+    count: int = 0
+    total_seconds: float = 0.0
+    max_seconds: float = 0.0
+    recent: deque[float] = field(default_factory=lambda: deque(maxlen=LATENCY_WINDOW))
+
+    def snapshot(self) -> dict[str, Any]:
+        recent = list(self.recent)
+        return {
+            "count": self.count,
+            "avg_seconds": round(self.total_seconds / self.count, 4) if self.count else None,
+            "p95_seconds": round(_percentile(recent, 0.95), 4) if recent else None,
+            "max_seconds": round(self.max_seconds, 4),
+        }
+
+
+class LLMMetrics:
+    """
+    Per-task, per-model latency and token counters of LLM calls, plus per-task queue waits
+    and event counters.
+    """
+
+    def __init__(self):
+        self._tasks: dict[tuple[str, str], TaskMetrics] = {}
+        self._waits: dict[str, WaitMetrics] = {}
+        self._events: dict[str, Counter[str]] = {}
+        # Histograms for the Prometheus export, keyed by their label pairs
+        self._latency: dict[Labels, Histogram] = {}
+        self._ollama_phases: dict[Labels, Histogram] = {}
+        self._tokens: dict[Labels, Histogram] = {}
+        self._wait_latency: dict[Labels, Histogram] = {}
+
+    def record_queue_wait(self, task: str, seconds: float):
+        waits = self._waits.setdefault(task, WaitMetrics())
+        waits.count += 1
+        waits.total_seconds += seconds
+        waits.max_seconds = max(waits.max_seconds, seconds)
+        waits.recent.append(seconds)
+        self._wait_latency.setdefault((("task", task),), Histogram()).observe(seconds)
+
+    def count(self, task: str, event: str, n: int = 1):
+        """Counts an event of a task, e.g. an unparseable or repaired response."""
+        self._events.setdefault(task, Counter())[event] += n
+
+    def record(
+        self,
+        task: str,
+        model: str,
+        seconds: float,
+        prompt_tokens: int | None = None,
+        completion_tokens: int | None = None,
+        error: bool = False,
+        phases: dict[str, float] | None = None
+    ):
+        """
+        Records one LLM call. `phases` holds the durations (seconds) Ollama reports for
+        the call, e.g. {"load": ..., "prompt_eval": ..., "eval": ...}.
+        """
+        metrics = self._tasks.setdefault((task, model), TaskMetrics())
+        metrics.requests += 1
+        metrics.errors += error
+        metrics.total_seconds += seconds
+        metrics.recent.append(seconds)
+        metrics.prompt_tokens += prompt_tokens or 0
+        metrics.completion_tokens += completion_tokens or 0
+
+        labels = (("model", model), ("task", task))
+        self._latency.setdefault(labels, Histogram()).observe(seconds)
+        for phase, phase_seconds in (phases or {}).items():
+            self._ollama_phases.setdefault((*labels, ("phase", phase)), Histogram()).observe(phase_seconds)
+        for kind, tokens in (("prompt", prompt_tokens), ("completion", completion_tokens)):
+            if tokens is not None:
+                self._tokens.setdefault((*labels, ("kind", kind)), Histogram(TOKEN_BUCKETS)).observe(tokens)
+
+    def snapshot(self) -> dict[str, Any]:
+        return {
+            "tasks": [
+                {"task": task, "model": model, **metrics.snapshot()}
+                for (task, model), metrics in sorted(self._tasks.items())
+            ],
+            "queue_wait": {task: waits.snapshot() for task, waits in sorted(self._waits.items())},
+            "events": {task: dict(events) for task, events in sorted(self._events.items())},
+        }
+
+    def prometheus_lines(self) -> list[str]:
+        requests: dict[Labels, float] = {
+            (("model", model), ("task", task)): metrics.requests for (task, model), metrics in self._tasks.items()
+        }
+        errors: dict[Labels, float] = {
+            (("model", model), ("task", task)): metrics.errors for (task, model), metrics in self._tasks.items()
+        }
+        events: dict[Labels, float] = {
+            (("event", event), ("task", task)): n
+            for task, counts in self._events.items() for event, n in counts.items()
+        }
+        return [
+            *_simple_family("llm_requests_total", "counter", "LLM calls", requests),
+            *_simple_family("llm_errors_total", "counter", "Failed LLM calls", errors),
+            *_histogram_family("llm_request_seconds", "Wall time of LLM calls, including streaming", self._latency),
+            *_histogram_family(
+                "llm_ollama_phase_seconds", "Load, prompt evaluation and generation time reported by Ollama",
+                self._ollama_phases
+            ),
+            *_histogram_family("llm_tokens", "Prompt and completion tokens per LLM call", self._tokens),
+            *_histogram_family(
+                "llm_queue_wait_seconds", "Time LLM calls waited for a backend slot", self._wait_latency
+            ),
+            *_simple_family("llm_events_total", "counter", "Notable LLM events, e.g. repaired responses", events),
+        ]
+
+
+class TurnMetrics:
+    """Latency histograms of the stages of a turn (context build, generation, DB commits, ...)."""
+
+    def __init__(self):
+        self._stages: dict[Labels, Histogram] = {}
+
+    def record_stage(self, stage: str, seconds: float):
+        self._stages.setdefault((("stage", stage),), Histogram()).observe(seconds)
+
+    def prometheus_lines(self) -> list[str]:
+        return _histogram_family("turn_stage_seconds", "Time spent in each stage of a turn", self._stages)
+
+llm_metrics = LLMMetrics()
+turn_metrics = TurnMetrics()
+
+# Stage durations (seconds) of the turn being processed, reported in its Server-Timing header
+stage_timings: ContextVar[dict[str, float] | None] = ContextVar("stage_timings", default=None)
+
+
+@contextmanager
+def timed_stage(stage: str) -> Iterator[None]:
+    """Times the enclosed block as a turn stage; repeated stages of one turn add up."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - started
+        turn_metrics.record_stage(stage, seconds)
+        timings = stage_timings.get()
+        if timings is not None:
+            timings[stage] = timings.get(stage, 0.0) + seconds
+
+
+def server_timing(timings: dict[str, float]) -> str:
+    """Server-Timing header value for a turn's stage durations."""
+    return ", ".join(f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in timings.items())
+
+
+def render_prometheus(backends: list[dict[str, Any]]) -> str:
+    """All metrics in the Prometheus text exposition format; `backends` are the scheduler stats."""
+    running: dict[Labels, float] = {(("backend", b["backend"]),): b["running"] for b in backends}
+    capacity: dict[Labels, float] = {(("backend", b["backend"]),): b["capacity"] for b in backends}
+    waiting: dict[Labels, float] = {
+        (("backend", b["backend"]), ("priority", priority)): n
+        for b in backends for priority, n in b["waiting"].items()
+    }
+    healthy: dict[Labels, float] = {
+        (("backend", b["backend"]),): int(b["healthy"]) for b in backends if "healthy" in b
+    }
+    lines = [
+        *turn_metrics.prometheus_lines(),
+        *llm_metrics.prometheus_lines(),
+        *_simple_family("llm_backend_running", "gauge", "LLM calls running on a backend", running),
+        *_simple_family("llm_backend_capacity", "gauge", "Concurrent LLM calls a backend admits", capacity),
+        *_simple_family("llm_backend_waiting", "gauge", "LLM calls queued for a backend slot", waiting),
+    ]
+    if healthy:
+        lines.extend(_simple_family("llm_backend_healthy", "gauge", "Whether a pooled backend is in rotation", healthy))
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,75 @@
+from collections import OrderedDict, deque
+from dataclasses import dataclass
+from typing import Any
+
+from config import settings
+
+# Sessions whose redo stack is kept
+REDO_SESSIONS = 1024
+
+
+@dataclass
+class RedoStep:
+    """What one undo removed, enough to play it back."""
+    turns: int
+    # Removed messages and their change logs, oldest first, as model dumps with their original ids
+    messages: list[dict[str, Any]]
+    logs: list[dict[str, Any]]
+    # Entry id -> state before the undo (a JSON-mode dump, None if the entry didn't exist)
+    journal: dict[int, dict[str, Any] | None]
+    # Summary fields of the session before the undo
+    summary: dict[str, Any]
+
+    def remap(self, message_ids: dict[int, int], entry_ids: dict[int, int]):
+        """
+        Rewrites the ids of restored messages (summary watermarks) and journal entries (journal
+        states, change log entities) the step refers to, old id -> new id.
+        """
+        self.summary = {
+            key: message_ids.get(value, value) if key.endswith("_id") and value is not None else value
+            for key, value in self.summary.items()
+        }
+        journal: dict[int, dict[str, Any] | None] = {}
+        for entry_id, state in self.journal.items():
+            new_id = entry_ids.get(entry_id, entry_id)
+            journal[new_id] = None if state is None else {**state, "id": new_id}
+        self.journal = journal
+        self.logs = [{**log, "entity_id": entry_ids.get(log["entity_id"], log["entity_id"])} for log in self.logs]
+
+
+class RedoStack:
+    """
+    Undone moves per session, most recent last, for redo. Bounded per session and in the
+    number of sessions (LRU); a session's stack is cleared once a new turn is played.
+    """
+
+    def __init__(self, depth: int = settings.REDO_STACK_SIZE, max_sessions: int = REDO_SESSIONS):
+        self.depth = depth
+        self.max_sessions = max_sessions
+        self._stacks: OrderedDict[int, deque[RedoStep]] = OrderedDict()
+
+    def push(self, session_id: int, step: RedoStep):
+        stack = self._stacks.setdefault(session_id, deque(maxlen=self.depth))
+        stack.append(step)
+        self._stacks.move_to_end(session_id)
+        while len(self._stacks) > self.max_sessions:
+            self._stacks.popitem(last=False)
+
+    def pop(self, session_id: int) -> RedoStep | None:
+        stack = self._stacks.get(session_id)
+        if not stack:
+            return None
+        step = stack.pop()
+        if not stack:
+            del self._stacks[session_id]
+        return step
+
+    def remap(self, session_id: int, message_ids: dict[int, int], entry_ids: dict[int, int]):
+        """Applies the new ids a redo gave to messages and journal entries to the steps still to redo."""
+        for step in self._stacks.get(session_id, ()):
+            step.remap(message_ids, entry_ids)
+
+    def clear(self, session_id: int):
+        self._stacks.pop(session_id, None)
+
+redo_stack = RedoStack()
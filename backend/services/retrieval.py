@@ -0,0 +1,68 @@
+import math
+import re
+from collections import Counter
+
+# Lowercased word tokens; one-letter words carry no signal for ranking
+_WORD_RE = re.compile(r"\w{2,}")
+
+
+def tokenize(text: str) -> list[str]:
+    return _WORD_RE.findall(text.lower())
+
+
+class BM25Index:
+    """
+    Incremental in-memory BM25 index. Documents can be added, replaced and removed at
+    any time; scoring uses the current collection statistics.
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        # term -> {doc_id: term frequency}
+        self._postings: dict[str, dict[int, int]] = {}
+        self._doc_terms: dict[int, list[str]] = {}
+        self._lengths: dict[int, int] = {}
+        self._total_length = 0
+
+    def __len__(self) -> int:
+        return len(self._lengths)
+
+    def add(self, doc_id: int, text: str):
+        """Indexes a document, replacing any previous version with the same id."""
+        self.remove(doc_id)
+        terms = Counter(tokenize(text))
+        for term, freq in terms.items():
+            self._postings.setdefault(term, {})[doc_id] = freq
+        self._doc_terms[doc_id] = list(terms)
+        length = sum(terms.values())
+        self._lengths[doc_id] = length
+        self._total_length += length
+
+    def remove(self, doc_id: int):
+        length = self._lengths.pop(doc_id, None)
+        if length is None:
+            return
+        self._total_length -= length
+        for term in self._doc_terms.pop(doc_id):
+            docs = self._postings[term]
+            del docs[doc_id]
+            if not docs:
+                del self._postings[term]
+
+    def search(self, query: str, limit: int) -> list[tuple[int, float]]:
+        """Best-matching (doc_id, score) pairs, highest score first. Non-matching documents are left out."""
+        if not self._lengths:
+            return []
+        doc_count = len(self._lengths)
+        avg_length = self._total_length / doc_count or 1.0
+        scores: dict[int, float] = {}
+        for term in set(tokenize(query)):
+            docs = self._postings.get(term)
+            if not docs:
+                continue
+            idf = math.log(1 + (doc_count - len(docs) + 0.5) / (len(docs) + 0.5))
+            for doc_id, freq in docs.items():
+                norm = self.k1 * (1 - self.b + self.b * self._lengths[doc_id] / avg_length)
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * freq * (self.k1 + 1) / (freq + norm)
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:limit]
@@ -0,0 +1,21 @@
+import re
+
+from config import settings
+from services.llm_tasks import GAME_MASTER, task_config
+
+# ASCII word pieces of up to 4 characters, other (e.g. Cyrillic) word pieces of up to 2,
+# or single punctuation marks. Close enough to BPE token counts for budgeting, at a
+# fraction of a tokenizer's cost.
+_TOKEN_RE = re.compile(r"[A-Za-z0-9_]{1,4}|\w{1,2}|[^\w\s]")
+
+
+def estimate_tokens(text: str) -> int:
+    """Fast local estimate of the number of LLM tokens in a text."""
+    return len(_TOKEN_RE.findall(text))
+
+
+def prompt_budget(task: str = GAME_MASTER) -> int:
+    """Tokens available for a task's prompt once room for the reply is reserved."""
+    config = task_config(task)
+    reserve = config.num_predict if config.num_predict is not None else settings.RESPONSE_TOKEN_RESERVE
+    return max(config.num_ctx - reserve, 0)
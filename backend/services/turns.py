@@ -0,0 +1,186 @@
+import asyncio
+import functools
+import logging
+from collections import OrderedDict
+from collections.abc import AsyncIterator, Awaitable, Callable
+
+from config import settings
+from models import ChatMessage
+
+logger = logging.getLogger(__name__)
+
+
+class SessionBusyError(Exception):
+    """Another turn is already running for the session."""
+
+
+class TurnCancelledError(Exception):
+    """The turn was cancelled before it produced a reply."""
+
+
+class Turn:
+    """
+    A turn in flight. The generation runs in its own task, so it isn't tied to the request
+    that started it; any number of requests can follow it, replaying the chunks produced
+    so far and then the saved AI message. Once the last follower goes away (its client
+    disconnected) before the turn is done, the turn is cancelled.
+    """
+
+    def __init__(self, session_id: int, key: str | None):
+        self.session_id = session_id
+        self.key = key
+        self.chunks: list[str] = []
+        self.result: ChatMessage | None = None
+        self.error: Exception | None = None
+        self.finished = False
+        self.task: asyncio.Task | None = None
+        # Seconds spent per stage of the turn (see services.metrics.timed_stage)
+        self.timings: dict[str, float] = {}
+        self._followers = 0
+        self._changed = asyncio.Condition()
+
+    def _attach(self):
+        self._followers += 1
+
+    def _detach(self):
+        self._followers -= 1
+        if self._followers == 0 and not self.finished and self.task is not None:
+            logger.info(f"Clients of the turn for session {self.session_id} are gone, cancelling it")
+            self.task.cancel()
+
+    async def publish(self, chunk: str):
+        async with self._changed:
+            self.chunks.append(chunk)
+            self._changed.notify_all()
+
+    async def finish(self, result: ChatMessage | None = None, error: Exception | None = None):
+        async with self._changed:
+            self.result = result
+            self.error = error
+            self.finished = True
+            self._changed.notify_all()
+
+    def _has_news(self, seen: int) -> bool:
+        """Whether there is more to yield to a follower that has seen `seen` chunks."""
+        return seen < len(self.chunks) or self.finished
+
+    async def follow(self) -> AsyncIterator[str | ChatMessage]:
+        """Yields the turn's chunks from the start, then its AI message (or raises its error)."""
+        index = 0
+        self._attach()
+        try:
+            while True:
+                async with self._changed:
+                    await self._changed.wait_for(functools.partial(self._has_news, index))
+                while index < len(self.chunks):
+                    yield self.chunks[index]
+                    index += 1
+                if self.finished and index == len(self.chunks):
+                    if self.error is not None:
+                        raise self.error
+                    yield self.result  # type: ignore[misc]
+                    return
+        finally:
+            self._detach()
+
+    async def wait(self) -> ChatMessage:
+        self._attach()
+        try:
+            async with self._changed:
+                await self._changed.wait_for(lambda: self.finished)
+        finally:
+            self._detach()
+        if self.error is not None:
+            raise self.error
+        return self.result  # type: ignore[return-value]
+
+
+class TurnRegistry:
+    """
+    Serializes turns per session. Only one turn runs per session at a time; a request
+    carrying the idempotency key of the running turn attaches to it, any other request
+    is rejected with SessionBusyError. Keys of finished turns are remembered (bounded LRU)
+    so that a late retry gets the saved reply instead of a second generation.
+    """
+
+    def __init__(self, max_keys: int = settings.IDEMPOTENCY_CACHE_SIZE):
+        self.max_keys = max_keys
+        self._active: dict[int, Turn] = {}
+        self._tasks: set[asyncio.Task] = set()
+        # (session_id, idempotency key) -> id of the AI message of the finished turn
+        self._completed: OrderedDict[tuple[int, str], int] = OrderedDict()
+
+    def is_busy(self, session_id: int) -> bool:
+        return session_id in self._active
+
+    def completed_message_id(self, session_id: int, key: str | None) -> int | None:
+        """AI message id of a finished turn with this idempotency key, if remembered."""
+        if key is None:
+            return None
+        return self._completed.get((session_id, key))
+
+    def forget(self, session_id: int, message_ids: list[int]):
+        """Drops remembered keys whose reply was deleted (e.g. by an undo)."""
+        ids = set(message_ids)
+        self._completed = OrderedDict(
+            (entry, message_id) for entry, message_id in self._completed.items()
+            if entry[0] != session_id or message_id not in ids
+        )
+
+    def forget_session(self, session_id: int):
+        """Drops all remembered keys of a deleted session, whose id may be reused."""
+        self._completed = OrderedDict(
+            (entry, message_id) for entry, message_id in self._completed.items() if entry[0] != session_id
+        )
+
+    def start(
+        self,
+        session_id: int,
+        key: str | None,
+        run: Callable[[Turn], Awaitable[ChatMessage]],
+        admit: Callable[[], None] | None = None,
+    ) -> Turn:
+        """
+        Starts a turn that runs `run(turn)`, or returns the running turn with the same key.
+        Raises SessionBusyError if a different turn is running for the session. `admit` is
+        called only before starting a new turn (retries always attach) and may raise to reject it.
+        """
+        active = self._active.get(session_id)
+        if active is not None:
+            if key is not None and active.key == key:
+                logger.info(f"Attaching retried request to the running turn of session {session_id}")
+                return active
+            raise SessionBusyError(f"A turn is already in progress for session {session_id}")
+        if admit is not None:
+            admit()
+
+        turn = Turn(session_id, key)
+        self._active[session_id] = turn
+        task = turn.task = asyncio.create_task(self._run(turn, run))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return turn
+
+    async def _run(self, turn: Turn, run: Callable[[Turn], Awaitable[ChatMessage]]):
+        result: ChatMessage | None = None
+        error: Exception | None = None
+        try:
+            result = await run(turn)
+        except asyncio.CancelledError:
+            error = TurnCancelledError("The turn was cancelled")
+            raise
+        except Exception as e:
+            error = e
+        finally:
+            del self._active[turn.session_id]
+            if result is not None and turn.key is not None:
+                self._completed[(turn.session_id, turn.key)] = result.id  # type: ignore[assignment]
+                while len(self._completed) > self.max_keys:
+                    self._completed.popitem(last=False)
+            await turn.finish(result, error)
+
+    async def shutdown(self):
+        """Lets running turns finish."""
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+turn_registry = TurnRegistry()
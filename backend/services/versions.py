@@ -0,0 +1,32 @@
+import uuid
+
+
+class SessionVersions:
+    """
+    In-memory change counter per session, bumped after every committed write to a session's
+    messages, journal or summary. Polled reads derive their ETag from it, so an unchanged
+    session is answered with 304 without a database round trip. The tag includes a per-process
+    epoch, so tags handed out before a restart never match.
+    Writers bump after committing: a read that races with a write then carries the old version
+    and is refetched on the next poll, rather than a stale body being tagged with the new one.
+    """
+
+    def __init__(self):
+        self._epoch = uuid.uuid4().hex[:8]
+        self._versions: dict[int, int] = {}
+
+    def bump(self, session_id: int):
+        self._versions[session_id] = self._versions.get(session_id, 0) + 1
+
+    def etag(self, session_id: int) -> str:
+        return f'"{self._epoch}-{session_id}-{self._versions.get(session_id, 0)}"'
+
+session_versions = SessionVersions()
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    """Whether an If-None-Match header value covers the ETag (weak comparison)."""
+    if not if_none_match:
+        return False
+    tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return "*" in tags or etag in tags
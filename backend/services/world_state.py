@@ -0,0 +1,191 @@
+from collections import OrderedDict
+from typing import Any
+
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from config import settings
+from models import JournalEntry
+from services.retrieval import BM25Index
+from services.tokens import estimate_tokens
+
+# Prompt sections in the order they are rendered
+SECTIONS = [
+    ("character", "CHARACTERS"),
+    ("quest", "ACTIVE QUESTS"),
+    ("lore", "WORLD LORE"),
+]
+
+# Estimated tokens of a section heading plus separators
+HEADING_TOKENS = 4
+
+# Keys of the serialized state handed to the journal extractor
+SERIALIZED_KEYS = {"quest": "quests", "lore": "lore", "character": "characters"}
+
+
+class SessionWorldState:
+    """
+    Journal entries of one session with lazily rendered prompt text and serialized dict,
+    plus a BM25 index to narrow large journals down to the entries relevant to a turn.
+    """
+
+    def __init__(self, entries: list[JournalEntry]):
+        # id -> (entry_type, title, content, estimated tokens of its prompt line), in creation order
+        self.entries: dict[int, tuple[str, str, str, int]] = {}
+        self.index = BM25Index()
+        for entry in entries:
+            self._store(entry)
+        self._sections: list[str] | None = None
+        self._section_tokens = 0
+        self._serialized: dict[str, list[dict[str, str]]] | None = None
+
+    def _store(self, entry: JournalEntry):
+        tokens = estimate_tokens(f"- {entry.title}: {entry.content}")
+        self.entries[entry.id] = (entry.entry_type, entry.title, entry.content, tokens)  # type: ignore[index]
+        self.index.add(entry.id, f"{entry.title} {entry.content}")  # type: ignore[arg-type]
+
+    def put(self, entry: JournalEntry):
+        self._store(entry)
+        self._reset()
+
+    def remove(self, entry_id: int):
+        self.entries.pop(entry_id, None)
+        self.index.remove(entry_id)
+        self._reset()
+
+    def _reset(self):
+        self._sections = None
+        self._serialized = None
+
+    def relevant(self, query: str) -> list[int] | None:
+        """
+        Ids (in creation order) of the JOURNAL_RELEVANT_ENTRIES entries that best match the
+        query, topped up with the most recent entries; None if the journal is small enough
+        to be used whole.
+        """
+        limit = settings.JOURNAL_RELEVANT_ENTRIES
+        if limit <= 0 or len(self.entries) <= limit or not query:
+            return None
+        selected = {entry_id for entry_id, _ in self.index.search(query, limit)}
+        for entry_id in reversed(self.entries):
+            if len(selected) >= limit:
+                break
+            selected.add(entry_id)
+        return [entry_id for entry_id in self.entries if entry_id in selected]
+
+    def sections(self, max_tokens: int | None = None, query: str = "") -> list[str]:
+        """
+        World state sections for the game master prompt (without the summary).
+        Large journals are narrowed down to the entries relevant to the query.
+        With a token limit, entries that don't fit are dropped, lowest-priority section first.
+        """
+        selected = self.relevant(query)
+        if selected is not None:
+            return self._fit([self.entries[entry_id] for entry_id in selected], max_tokens)
+
+        if self._sections is None:
+            self._sections = self._render(self.entries.values())
+            entry_tokens = sum(entry[3] for entry in self.entries.values())
+            self._section_tokens = entry_tokens + len(self._sections) * HEADING_TOKENS
+        if max_tokens is None or self._section_tokens <= max_tokens:
+            return self._sections
+        # Over budget (rare, and not cached)
+        return self._fit(list(self.entries.values()), max_tokens)
+
+    @classmethod
+    def _fit(cls, entries: list[tuple[str, str, str, int]], max_tokens: int | None) -> list[str]:
+        """Renders the entries in section order while they fit into the limit."""
+        if max_tokens is None:
+            return cls._render(entries)
+        kept = []
+        used = 0
+        for entry_type, _ in SECTIONS:
+            used += HEADING_TOKENS
+            for entry in entries:
+                if entry[0] == entry_type and used + entry[3] <= max_tokens:
+                    kept.append(entry)
+                    used += entry[3]
+        return cls._render(kept)
+
+    @staticmethod
+    def _render(entries) -> list[str]:
+        sections = []
+        for entry_type, heading in SECTIONS:
+            lines = [f"- {title}: {content}" for t, title, content, _ in entries if t == entry_type]
+            if lines:
+                sections.append(f"{heading}:\n" + "\n".join(lines))
+        return sections
+
+    def serialize(self, summary: str | None, query: str = "") -> dict[str, Any]:
+        """Game state for the journal extractor, narrowed down to the entries relevant to the query."""
+        selected = self.relevant(query)
+        if selected is not None:
+            return {"summary": summary or "", **self._serialize([self.entries[entry_id] for entry_id in selected])}
+        if self._serialized is None:
+            self._serialized = self._serialize(self.entries.values())
+        return {"summary": summary or "", **self._serialized}
+
+    @staticmethod
+    def _serialize(entries) -> dict[str, list[dict[str, str]]]:
+        serialized: dict[str, list[dict[str, str]]] = {key: [] for key in SERIALIZED_KEYS.values()}
+        for entry_type, title, content, _ in entries:
+            key = SERIALIZED_KEYS.get(entry_type)
+            if key:
+                serialized[key].append({"name": title, "description": content})
+        return serialized
+
+
+class WorldStateCache:
+    """
+    Bounded LRU of per-session world state. Journal operations patch the cached entries
+    in place; anything else that rewrites the journal (undo, session deletion) invalidates.
+    """
+
+    def __init__(self, max_sessions: int = settings.WORLD_STATE_CACHE_SIZE):
+        self.max_sessions = max_sessions
+        self._states: OrderedDict[int, SessionWorldState] = OrderedDict()
+        # Bumped on every change, so a load that raced with a write isn't cached
+        self._generations: dict[int, int] = {}
+
+    async def get(self, db: AsyncSession, session_id: int) -> SessionWorldState:
+        state = self._states.get(session_id)
+        if state is not None:
+            self._states.move_to_end(session_id)
+            return state
+
+        generation = self._generations.get(session_id, 0)
+        entries = (await db.exec(
+            select(JournalEntry)
+            .where(JournalEntry.session_id == session_id)
+            .order_by(JournalEntry.id)  # type: ignore[arg-type]
+        )).all()
+        state = SessionWorldState(list(entries))
+        if self._generations.get(session_id, 0) == generation:
+            self._states[session_id] = state
+            while len(self._states) > self.max_sessions:
+                evicted, _ = self._states.popitem(last=False)
+                self._generations.pop(evicted, None)
+        return state
+
+    def _bump(self, session_id: int):
+        self._generations[session_id] = self._generations.get(session_id, 0) + 1
+
+    def put(self, entry: JournalEntry):
+        """Records a created or updated entry."""
+        self._bump(entry.session_id)
+        state = self._states.get(entry.session_id)
+        if state is not None:
+            state.put(entry)
+
+    def remove(self, session_id: int, entry_id: int):
+        """Records a deleted entry."""
+        self._bump(session_id)
+        state = self._states.get(session_id)
+        if state is not None:
+            state.remove(entry_id)
+
+    def invalidate(self, session_id: int):
+        self._bump(session_id)
+        self._states.pop(session_id, None)
+
+world_state_cache = WorldStateCache()
@@ -0,0 +1,9 @@
+import os
+import tempfile
+
+# Settings are read on import, so the database is pointed at a scratch file before any app module loads
+os.environ["DATABASE_FILE"] = os.path.join(tempfile.mkdtemp(prefix="tavern-tests-"), "test.db")
+
+from database import create_db_and_tables  # noqa: E402
+
+create_db_and_tables()
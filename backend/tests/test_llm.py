@@ -0,0 +1,26 @@
+import time
+from collections.abc import Iterator
+
+import httpx
+import pytest
+
+from services.llm import LLMUnavailableError, OllamaService
+
+
+def test_generate_enforces_the_total_timeout():
+    def trickle() -> Iterator[bytes]:
+        # Each read arrives well within the read timeout, but the whole reply takes 5s
+        for _ in range(100):
+            time.sleep(0.05)
+            yield b" "
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(200, content=trickle())
+
+    service = OllamaService(base_url="http://ollama")
+    service.total_timeout = 0.3
+    service._client = httpx.Client(base_url=service.base_url, transport=httpx.MockTransport(handler))
+    started = time.monotonic()
+    with pytest.raises(LLMUnavailableError):
+        service.generate("Describe the tavern.")
+    assert time.monotonic() - started < 2
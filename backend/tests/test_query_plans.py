@@ -0,0 +1,15 @@
+from database import engine, migrate, query_plan_problems
+
+
+def test_hot_queries_use_their_indexes():
+    assert query_plan_problems() == []
+
+
+def test_hot_queries_use_their_indexes_after_migrating_an_older_database():
+    # Databases created by older versions still have indexes this version drops
+    with engine.begin() as conn:
+        conn.exec_driver_sql(
+            "CREATE INDEX IF NOT EXISTS ix_chatmessage_session_timestamp ON chatmessage (session_id, timestamp)"
+        )
+    migrate()
+    assert query_plan_problems() == []
@@ -0,0 +1,33 @@
+import asyncio
+import time
+
+import pytest
+
+from services.llm import LLMScheduler
+from services.llm_tasks import GAME_MASTER, SUMMARIZER
+
+
+def test_slot_handed_over_as_the_waiter_times_out_is_released():
+    scheduler = LLMScheduler(capacity=1, max_queue_depth=8)
+
+    async def wait_for_slot(deadline: float):
+        async with scheduler.slot(SUMMARIZER, deadline):
+            pass
+
+    async def scenario():
+        loop = asyncio.get_running_loop()
+        async with scheduler.slot(GAME_MASTER):
+            waiter = asyncio.create_task(wait_for_slot(loop.time() + 0.05))
+            await asyncio.sleep(0)
+            # Block past the waiter's deadline, so its timeout fires in the same loop pass
+            # that hands it the slot, before it gets to run
+            time.sleep(0.1)
+            await asyncio.sleep(0)
+        with pytest.raises(TimeoutError):
+            await waiter
+        assert scheduler.running == 0
+        async with asyncio.timeout(1):
+            async with scheduler.slot(GAME_MASTER):
+                pass
+
+    asyncio.run(scenario())
@@ -0,0 +1,117 @@
+import asyncio
+import json
+from collections.abc import MutableMapping
+from typing import Any
+
+import httpx
+from sqlmodel import select
+
+from database import async_engine, new_session
+from main import app
+from models import ChatMessage, GameSession
+from routers import game
+from services.background import post_turn_worker
+from services.llm import ollama_service
+from services.turns import turn_registry
+
+
+async def call_action(session_id: int, disconnect_after: float) -> list[MutableMapping[str, Any]]:
+    """Sends POST /action straight to the ASGI app; the client goes away after `disconnect_after` seconds."""
+    body = json.dumps({"action": "wait for the bard"}).encode()
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "POST", "scheme": "http",
+        "path": f"/sessions/{session_id}/action", "raw_path": f"/sessions/{session_id}/action".encode(),
+        "query_string": b"", "root_path": "", "headers": [(b"content-type", b"application/json")],
+        "client": ("127.0.0.1", 1234), "server": ("testserver", 80),
+    }
+    messages = [{"type": "http.request", "body": body, "more_body": False}]
+    loop = asyncio.get_running_loop()
+    gone_at = loop.time() + disconnect_after
+
+    async def receive() -> MutableMapping[str, Any]:
+        if messages:
+            return messages.pop()
+        # Like a server, report a disconnect that already happened without waiting
+        if loop.time() < gone_at:
+            await asyncio.sleep(gone_at - loop.time())
+        return {"type": "http.disconnect"}
+
+    sent: list[MutableMapping[str, Any]] = []
+
+    async def send(message: MutableMapping[str, Any]):
+        sent.append(message)
+
+    await app(scope, receive, send)
+    return sent
+
+
+def test_turn_is_cancelled_when_the_client_disconnects(monkeypatch):
+    monkeypatch.setattr(game, "DISCONNECT_POLL_SECONDS", 0.05)
+    cancelled = asyncio.Event()
+
+    async def generate_turn(*args, **kwargs) -> str:
+        try:
+            await asyncio.sleep(30)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+        return "The bard finally arrives."
+
+    monkeypatch.setattr(ollama_service, "agenerate_turn", generate_turn)
+
+    async def scenario():
+        async with new_session() as db:
+            session = GameSession(name="Disconnect", start_prompt="You wake up in a tavern.")
+            db.add(session)
+            await db.commit()
+            assert session.id is not None
+            session_id = session.id
+        try:
+            sent = await asyncio.wait_for(call_action(session_id, disconnect_after=0.2), timeout=10)
+            await asyncio.wait_for(cancelled.wait(), timeout=10)
+            await turn_registry.shutdown()
+            assert sent[0]["status"] == 499
+            async with new_session() as db:
+                # The user message of the abandoned turn was rolled back
+                messages = (await db.exec(select(ChatMessage).where(ChatMessage.session_id == session_id))).all()
+                assert messages == []
+        finally:
+            await async_engine.dispose()
+
+    asyncio.run(scenario())
+
+
+def test_deleting_a_session_forgets_its_idempotency_keys(monkeypatch):
+    async def generate_turn(context: dict[str, Any], player_action: str, *args, **kwargs) -> str:
+        return f"You {player_action}."
+
+    async def extract_journal_updates(*args, **kwargs) -> dict[str, Any]:
+        return {"quests": [], "characters": [], "lore": []}
+
+    monkeypatch.setattr(ollama_service, "agenerate_turn", generate_turn)
+    monkeypatch.setattr(ollama_service, "aextract_journal_updates", extract_journal_updates)
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=app)
+        try:
+            async with httpx.AsyncClient(transport=transport, base_url="http://testserver") as client:
+                new = {"name": "Keys", "start_prompt": "You wake up in a tavern."}
+                session_id = (await client.post("/sessions/", json=new)).json()["id"]
+                action = {"action": "order an ale", "idempotency_key": "turn-1"}
+                first = (await client.post(f"/sessions/{session_id}/action", json=action)).json()
+                await post_turn_worker.shutdown()
+                assert turn_registry.completed_message_id(session_id, "turn-1") == first["message_id"]
+
+                assert (await client.delete(f"/sessions/{session_id}")).status_code == 200
+                assert turn_registry.completed_message_id(session_id, "turn-1") is None
+                # The same key in another session is a new turn, never the deleted session's reply
+                other_id = (await client.post("/sessions/", json=new)).json()["id"]
+                other = (await client.post(f"/sessions/{other_id}/action", json=action)).json()
+                await post_turn_worker.shutdown()
+                history = (await client.get(f"/sessions/{other_id}/history")).json()
+                assert other["message_id"] in [message["id"] for message in history]
+        finally:
+            await turn_registry.shutdown()
+            await async_engine.dispose()
+
+    asyncio.run(scenario())
@@ -0,0 +1,179 @@
+import asyncio
+from typing import Any
+
+import pytest
+from sqlmodel import select
+
+from config import settings
+from database import async_engine, new_session
+from models import ChatMessage, GameSession, JournalEntry
+from services.background import post_turn_worker
+from services.game_engine import GameEngine
+from services.llm import ollama_service
+
+TURNS = 6
+
+
+@pytest.fixture(autouse=True)
+def fake_llm(monkeypatch):
+    """
+    Summarizes every 4 messages, checkpoints every 2 turns; each move adds a character named
+    after it, except "forget <name>", which deletes that character.
+    """
+    monkeypatch.setattr(settings, "SUMMARY_THRESHOLD", 4)
+    monkeypatch.setattr(settings, "JOURNAL_CHECKPOINT_INTERVAL", 2)
+
+    async def generate_turn(context: dict[str, Any], player_action: str, language: str = "en", stats=None) -> str:
+        return f"You {player_action}."
+
+    async def extract_journal_updates(user_input: str, ai_response_text: str, *args, **kwargs) -> dict[str, Any]:
+        if user_input.startswith("forget "):
+            change = {"operation": "delete", "name": user_input.removeprefix("forget ")}
+        else:
+            change = {"operation": "add", "name": user_input, "description": "-"}
+        return {"quests": [], "lore": [], "characters": [change]}
+
+    async def summarize_context(text: str, previous_summary: str | None = None, language: str = "en") -> str:
+        last_move = [line for line in text.splitlines() if line.startswith("user: ")][-1]
+        return f"Up to {last_move.removeprefix('user: ')}"
+
+    monkeypatch.setattr(ollama_service, "agenerate_turn", generate_turn)
+    monkeypatch.setattr(ollama_service, "aextract_journal_updates", extract_journal_updates)
+    monkeypatch.setattr(ollama_service, "asummarize_context", summarize_context)
+
+
+def run(scenario):
+    async def main():
+        try:
+            await scenario()
+        finally:
+            await post_turn_worker.shutdown()
+            await async_engine.dispose()
+    asyncio.run(main())
+
+
+async def play(turns: int | list[str], session_id: int | None = None) -> int:
+    """
+    Plays the given moves ("move 1" to "move <turns>" for a count) in the session, a new one by
+    default, letting every post-turn job finish. Returns the session id.
+    """
+    moves = [f"move {move}" for move in range(1, turns + 1)] if isinstance(turns, int) else turns
+    async with new_session() as db:
+        if session_id is None:
+            session = GameSession(name="Undo", start_prompt="You wake up in a tavern.")
+            db.add(session)
+            await db.commit()
+            assert session.id is not None
+            session_id = session.id
+        for move in moves:
+            await GameEngine(db).process_action(session_id, move)
+            await post_turn_worker.shutdown()
+    return session_id
+
+
+async def undo(session_id: int, steps: int = 1) -> int:
+    async with new_session() as db:
+        return await GameEngine(db).undo_moves(session_id, steps)
+
+
+async def redo(session_id: int) -> int:
+    async with new_session() as db:
+        return await GameEngine(db).redo_moves(session_id)
+
+
+async def entry_ids(session_id: int) -> dict[str, int]:
+    async with new_session() as db:
+        entries = (await db.exec(select(JournalEntry).where(JournalEntry.session_id == session_id))).all()
+        return {entry.title: entry.id for entry in entries}  # type: ignore[misc]
+
+
+async def state(session_id: int) -> tuple[str | None, list[str]]:
+    async with new_session() as db:
+        session = await db.get(GameSession, session_id)
+        assert session is not None
+        if session.summarized_up_to_id is not None:
+            # The watermark must name a message of the session, even after redos gave them new ids
+            watermark = await db.get(ChatMessage, session.summarized_up_to_id)
+            assert watermark is not None and watermark.session_id == session_id
+        entries = (await db.exec(select(JournalEntry.title).where(JournalEntry.session_id == session_id))).all()
+        return session.summary, sorted(entries)
+
+
+def test_undo_in_steps_across_two_summarizations():
+    async def scenario():
+        session_id = await play(TURNS)
+        assert await state(session_id) == ("Up to move 6", [f"move {n}" for n in range(1, 7)])
+
+        async with new_session() as db:
+            assert await GameEngine(db).undo_moves(session_id, 1) == 1
+        assert await state(session_id) == ("Up to move 4", [f"move {n}" for n in range(1, 6)])
+
+        # The first undo used up the previous summary; this one needs a checkpoint's
+        async with new_session() as db:
+            assert await GameEngine(db).undo_moves(session_id, 2) == 2
+        assert await state(session_id) == ("Up to move 2", ["move 1", "move 2", "move 3"])
+
+        async with new_session() as db:
+            assert await GameEngine(db).redo_moves(session_id) == 2
+            assert await GameEngine(db).redo_moves(session_id) == 1
+        assert await state(session_id) == ("Up to move 6", [f"move {n}" for n in range(1, 7)])
+
+    run(scenario)
+
+
+def test_single_undo_across_two_summarizations():
+    async def scenario():
+        session_id = await play(TURNS)
+        async with new_session() as db:
+            assert await GameEngine(db).undo_moves(session_id, 3) == 3
+        assert await state(session_id) == ("Up to move 2", ["move 1", "move 2", "move 3"])
+
+        async with new_session() as db:
+            assert await GameEngine(db).undo_moves(session_id, 2) == 2
+        assert await state(session_id) == (None, ["move 1"])
+
+    run(scenario)
+
+
+def test_redo_leaves_entries_that_reused_an_undone_id_alone():
+    async def scenario():
+        session_a = await play(["a0", "a1"])
+        undone_id = (await entry_ids(session_a))["a1"]
+        assert await undo(session_a) == 1
+
+        # SQLite hands the freed rowid to the next entry, here one of another session
+        session_b = await play(["b0"])
+        assert await entry_ids(session_b) == {"b0": undone_id}
+
+        assert await redo(session_a) == 1
+        assert (await state(session_a))[1] == ["a0", "a1"]
+        assert await entry_ids(session_b) == {"b0": undone_id}
+
+        # The restored entry's change log follows it to its new id
+        assert await undo(session_a) == 1
+        assert (await state(session_a))[1] == ["a0"]
+        assert await entry_ids(session_b) == {"b0": undone_id}
+
+    run(scenario)
+
+
+def test_undo_restores_a_deleted_entry_whose_id_was_reused():
+    async def scenario():
+        session_a = await play(["c0", "c1", "forget c1"])
+        deleted_id = max((await entry_ids(session_a)).values()) + 1
+        session_b = await play(["d0"])
+        assert await entry_ids(session_b) == {"d0": deleted_id}
+
+        assert await undo(session_a) == 1
+        assert (await state(session_a))[1] == ["c0", "c1"]
+        assert await entry_ids(session_b) == {"d0": deleted_id}
+
+        # Undoing the move that created it removes the entry under its new id
+        assert await undo(session_a) == 1
+        assert (await state(session_a))[1] == ["c0"]
+        assert await redo(session_a) == 1
+        assert await redo(session_a) == 1
+        assert (await state(session_a))[1] == ["c0"]
+        assert await entry_ids(session_b) == {"d0": deleted_id}
+
+    run(scenario)
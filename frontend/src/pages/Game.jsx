@@ -64,8 +64,10 @@ const Game = () => {
 
     const handleLoadMore = async () => {
         try {
-            const offset = messages.length;
-            const response = await api.get(`/sessions/${id}/history?limit=20&offset=${offset}`);
+            // Page back from the oldest loaded message, so turns landing meanwhile don't shift the page
+            const oldestId = messages.length > 0 ? messages[0].id : null;
+            const cursor = typeof oldestId === 'number' ? `before_id=${oldestId}` : `offset=${messages.length}`;
+            const response = await api.get(`/sessions/${id}/history?limit=20&${cursor}`);
             const olderMessages = response.data;
 
             if (olderMessages.length < 20) {